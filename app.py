@@ -7,6 +7,7 @@ from io import BytesIO
 from datetime import datetime
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -14,6 +15,21 @@ from googleapiclient.errors import HttpError
 
 # --- ステータス計算ロジックをインポート ---
 from status import calculate_status
+from status_engine import prepare_status_column, build_rakuten_group_table, STATUS_ENGINE_LEGACY, STATUS_ENGINE_VECTORIZED
+from status_engine import STATUS_LABELS, STATUS_BLANK, STATUS_NOT_APPLICABLE, STATUS_PUBLIC, STATUS_UNREGISTERED, encode_statuses, status_categorical, calculate_check_column
+from lookup_index import LookupIndex
+# --- ファイル読み込みヘルパーをインポート ---
+from file_reader import detect_encoding, format_read_info, parse_csv_text, read_excel_streaming, CSV_ENGINE_C, CSV_ENGINE_PYARROW
+# --- 読み込み結果のディスクキャッシュをインポート ---
+from parse_cache import ParseCache
+# --- 掲載状況の結果のキャッシュをインポート ---
+from result_cache import ResultCache
+# --- 楽天の取り込み時の前処理をインポート ---
+from rakuten_preprocess import preprocess_rakuten
+# --- 取り込み時の型変換をインポート ---
+from typed_columns import normalize_column_types, number_array, normalize_keys, to_date_int, KEY_COL
+# --- 返礼品コードの辞書 (コード <-> 整数ID) をインポート ---
+from code_dict import CodeDictionary, KEY_ID_COL, NO_CODE
 # --- 操作マニュアルをインポート ---
 from operation_manual import show_instructions
 # --- ステータス判定条件をインポート ---
@@ -232,7 +248,8 @@ else:
         if df.empty:
             return set() # 空のセットを返す
             
-        return set(df["定期便番号"].dropna().unique())
+        # 返礼品コードと同じ規則で正規化して照合する
+        return set(normalize_keys(df["定期便番号"].dropna()).unique()) - {''}
 
     @st.cache_data(ttl=600)
     def get_business_data_from_gsheet(_sheets_service):
@@ -314,9 +331,82 @@ else:
         "あとギフ": {"返礼品コード"}, # ※あとギフはパターン分岐があるため最小限のキーのみここで定義
     }
 
+    # 楽天の必須ヘッダー (fill-down・親判定・SKU上書きで使用)
+    RAKUTEN_REQUIRED_COLUMNS = {
+        "商品管理番号（商品URL）", "商品番号", "商品名", "倉庫指定",
+        "サーチ表示", "販売期間指定（開始日時）", "販売期間指定（終了日時）",
+        "注文ボタン", "SKU管理番号", "システム連携用SKU番号",
+        "在庫数", "SKU倉庫指定"
+    }
+
+    # --- 列の絞り込み読み込み (projection) ---
+    # 判定ロジックで使用する列だけを読み込み、パース時間とメモリを削減する
+    # (環境変数 COLUMN_PROJECTION = "0" で全列読み込みに戻す)
+    COLUMN_PROJECTION = os.environ.get("COLUMN_PROJECTION", "1") != "0"
+
+    # PORTAL_REQUIRED_COLUMNS・キー列・名称列以外に読み込みが必要な列
+    PORTAL_EXTRA_COLUMNS = {
+        # (ヘッダーなし: インデックス番号)
+        "チョイス": {0, 1, 2, 97, 98, 99, 100, 102}, # ID, 商品管理番号, 名称, 判定列, 親ID, 返礼品コード
+        "チョイス在庫": {0, 1, 3}, # 返礼品コード挿入後は 1, 2, 4 列目として参照される
+        # (ヘッダーあり: ヘッダー名)
+        "楽天": RAKUTEN_REQUIRED_COLUMNS,
+        "Amazon": {"sku", "quantity"}, # 英語版ヘッダー (リネーム前)
+        "あとギフ": {"販売フラグ", "公開フラグ", "在庫数", "受付開始日時", "受付終了日時",
+                   "表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)"},
+    }
+
+    # インポート時の並列読み込みのスレッド数 (環境変数 IMPORT_MAX_WORKERS で変更可、1 で逐次処理)
+    IMPORT_MAX_WORKERS = int(os.environ.get("IMPORT_MAX_WORKERS", "4"))
+
+    # CSVのパースエンジン (環境変数 CSV_ENGINE = "pyarrow" で pyarrow.csv を使用、読み込めない場合は C パーサー)
+    CSV_ENGINE = os.environ.get("CSV_ENGINE", CSV_ENGINE_C)
+    if CSV_ENGINE not in (CSV_ENGINE_C, CSV_ENGINE_PYARROW):
+        st.warning(f"環境変数 CSV_ENGINE の値「{CSV_ENGINE}」は不正です (\"{CSV_ENGINE_C}\" または \"{CSV_ENGINE_PYARROW}\")。C パーサーで読み込みます。")
+        CSV_ENGINE = CSV_ENGINE_C
+
+    # 読み込み結果のディスクキャッシュ (同じ内容のファイルは別セッションでもパースせずに読み込む)
+    # 環境変数 PARSE_CACHE_DIR で保存先、PARSE_CACHE_MAX_MB で上限サイズを変更 (0 で無効)
+    PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", ".parse_cache")
+    PARSE_CACHE_MAX_MB = int(os.environ.get("PARSE_CACHE_MAX_MB", "1024"))
+    parse_cache = ParseCache(PARSE_CACHE_DIR, PARSE_CACHE_MAX_MB * 1024 * 1024)
+
+    # 掲載状況の結果のキャッシュ (同じ入力・ベースポータル・基準日での再実行は計算せずに結果を返す)
+    # 環境変数 RESULT_CACHE_MAX_MB でメモリ上の上限、RESULT_CACHE_DIR / RESULT_CACHE_DISK_MAX_MB でディスクの保存先・上限を変更 (0 で無効)
+    RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "256"))
+    RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", ".result_cache")
+    RESULT_CACHE_DISK_MAX_MB = int(os.environ.get("RESULT_CACHE_DISK_MAX_MB", "512"))
+
+    @st.cache_resource # サーバー内の全セッションで1つのキャッシュを共有する
+    def get_result_cache():
+        disk_cache = ParseCache(RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_MB * 1024 * 1024)
+        return ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, disk_cache)
+
+    result_cache = get_result_cache()
+
+    # ステータス計算エンジンの切り替え (環境変数 STATUS_ENGINE = "legacy" で従来の calculate_status を使用)
+    STATUS_ENGINE = os.environ.get("STATUS_ENGINE", STATUS_ENGINE_VECTORIZED)
+
+    # 複数日付の一括判定: 期間指定の間隔 (表示名 -> pandas の日付の頻度) と、一度に判定できる基準日の上限
+    BATCH_DATE_INTERVALS = {'毎日': 'D', '毎週': '7D', '毎月1日': 'MS'}
+    BATCH_MAX_DATES = 60
+
     PORTAL_ORDER = ['チョイス', '楽天', 'ANA', 'ふるなび', 'JAL', 'まいふる', 'マイナビ', 'プレミアム', 'JRE', 'さとふる', 'Amazon', '百選', 'ぐるなび', 'あとギフ']
     # TODAY_STR は L23 で定義
 
+    # ポータルのステータス判定に使うシート (ポータル本体と在庫ファイル、列の再計算の要否判定用。記載がなければポータル名のシートのみ)
+    STATUS_INPUT_SHEETS = {
+        'チョイス': ('チョイス', 'チョイス在庫'),
+        'さとふる': ('さとふる', 'さとふる在庫'),
+        '百選': ('百選', '百選在庫'),
+    }
+
+    # 次回のステータス変更 (基準日より後で最初にステータスが変わる日と変更後のステータス) の列
+    # 全体の列 (ポータルのうち最も早い変更) と、ポータルごとの列 (ポータル名 + 接尾辞)。表示は任意 (フィルター欄で切り替え)
+    NEXT_CHANGE_COLUMNS = ['次回変更日', '変更までの日数']
+    NEXT_CHANGE_DATE_SUFFIX = '_次回変更日'
+    NEXT_CHANGE_STATUS_SUFFIX = '_次回ステータス'
+
     # フィルタリングをスキップするシートのリスト
     SKIP_FILTERING_SHEETS = ['楽天', 'チョイス在庫', 'さとふる在庫', '百選在庫'] # 「楽天」がファイル構成が特殊なのでスキップ
     
@@ -353,25 +443,51 @@ else:
         # ポータル名を特定できない場合は None を返す（インポート対象外）
         return None
 
-    def robust_read_file(uploaded_file):
+    def get_usecols(sheet_name):
+        """
+        シート名から読み込む列のセットを返す。
+        絞り込み無効時・ポータル不明時は None (全列読み込み)。
+        """
+        if not COLUMN_PROJECTION or sheet_name is None:
+            return None
+        if sheet_name not in PORTAL_REQUIRED_COLUMNS and sheet_name not in PORTAL_EXTRA_COLUMNS:
+            return None
+
+        cols = set(PORTAL_REQUIRED_COLUMNS.get(sheet_name, set()))
+        cols |= PORTAL_EXTRA_COLUMNS.get(sheet_name, set())
+        for col_map in (KEY_COLUMN_MAP, PORTAL_NAME_COLUMN_MAP):
+            if col_map.get(sheet_name) is not None:
+                cols.add(col_map[sheet_name])
+        return cols
+
+    def robust_read_file(file_name, bytes_data):
         """
         様々なエンコーディングと形式に対応したファイル読み込み関数。
         シート名に応じてヘッダーの有無（header=0 or header=None）を切り替える。
+        スレッドプールから呼び出すため、st.* は使用しない。
+        戻り値: (DataFrame または None, エラーメッセージ, 読み込み情報)
         """
-        bytes_data = uploaded_file.getvalue()
-        file_name = uploaded_file.name
         sheet_name = get_sheet_name_from_filename(file_name)
         
         # シート名に基づいてヘッダーの有無を決定
         # チョイス系は header=None、それ以外は header=0 (1行目をヘッダーとする)
         header_setting = None if sheet_name in SHEETS_WITHOUT_HEADER else 0
 
+        # 読み込む列 (None の場合は全列)
+        projected_cols = get_usecols(sheet_name)
+
         if file_name.endswith('.xlsx'):
+            # 先頭シートを1行ずつ読み込み、必要な列だけを保持する
             try:
-                return pd.read_excel(BytesIO(bytes_data), header=header_setting, dtype=str).fillna('')
+                return read_excel_streaming(bytes_data, header_setting, projected_cols), None, "Excel（ストリーミング読み込み）"
+            except Exception:
+                pass
+            # ストリーミング読み込みに失敗した場合は従来の方法で読み込む
+            try:
+                usecols = (lambda c: c in projected_cols) if projected_cols is not None else None
+                return pd.read_excel(BytesIO(bytes_data), header=header_setting, dtype=str, usecols=usecols).fillna(''), None, None
             except Exception as e:
-                st.error(f"Excelファイル '{file_name}' の読み込みに失敗: {e}")
-                return None
+                return None, f"Excelファイル '{file_name}' の読み込みに失敗: {e}", None
 
         separator = '\t' if file_name.lower().endswith(('.tsv', '.txt')) else ','
         
@@ -383,31 +499,157 @@ else:
         else:
             encodings_to_try = ['cp932', 'shift_jis', 'utf-8-sig', 'utf-8']
 
-        for encoding in encodings_to_try:
-            try:
-                # BytesIOは読み込むとカーソルが進むため、ループ毎に新しいBytesIOを作成するかseek(0)が必要
-                # ここでは念のため毎回データを渡す
-                
-                df = pd.read_csv(
-                    BytesIO(bytes_data), 
-                    header=header_setting,
-                    encoding=encoding, 
-                    dtype=str, 
-                    sep=separator, 
-                    on_bad_lines='warn', 
-                    # これにより、文字コードが違う場合に例外が発生し、次のencodingを試しに行きます
-                    encoding_errors='strict'
-                )
-                return df.fillna('')
-            except UnicodeDecodeError:
-                # エンコーディング不一致の場合は次を試す
-                continue
-            except Exception:
-                # その他のエラーでも次を試す（念のため）
-                continue
-                
-        st.error(f"'{file_name}' をサポートされているエンコーディングで読み込めませんでした。ファイルが破損している可能性があります。")
-        return None
+        # 文字コードを判定 (デコードのみ行い、パースは判定後に1回だけ実行する)
+        encoding, text, detect_sec = detect_encoding(bytes_data, encodings_to_try)
+        if encoding is None:
+            return None, f"'{file_name}' をサポートされているエンコーディングで読み込めませんでした。ファイルが破損している可能性があります。", None
+        try:
+            df, engine_used = parse_csv_text(text, header_setting, separator, projected_cols, CSV_ENGINE)
+            return df, None, format_read_info(encoding, detect_sec, engine_used)
+        except Exception as e:
+            return None, f"'{file_name}' の読み込みに失敗しました（文字コード: {encoding}）: {e}", format_read_info(encoding, detect_sec)
+
+    def preprocess_portal_data(df, sheet_name, file_name):
+        """
+        読み込んだデータにポータル固有の前処理（必須列チェック、Amazonのリネーム、楽天のfill-down・親判定、チョイスの親判定、検索キー列の作成、判定に使う列の型変換）を行う。
+        スレッドプールから呼び出すため、st.* は使用せずエラーメッセージを戻り値で返す。
+        戻り値: (前処理後のDataFrame または None, エラーメッセージのリスト, チョイスのグループ表 または None)
+        """
+        choice_group_table = None
+
+        # --- 英語版Amazonのヘッダー対応 ---
+        if sheet_name == 'Amazon':
+            # 英語版の小文字ヘッダーを日本語ヘッダーに置換
+            amazon_rename_map = {
+                'sku': '出品者SKU',
+                'asin': 'ASIN',
+                'price': '価格',
+                'quantity': '数量'
+            }
+            # リネーム実行（列が存在しない場合は何もしない）
+            df = df.rename(columns=amazon_rename_map)
+
+        # --- 共通の必須列チェック (楽天、チョイス系以外) ---
+        # PORTAL_REQUIRED_COLUMNS に定義されたポータルのみチェックを行う
+        if sheet_name in PORTAL_REQUIRED_COLUMNS:
+            required_cols = PORTAL_REQUIRED_COLUMNS[sheet_name]
+            missing_cols = required_cols - set(df.columns)
+
+            # あとギフの場合の追加チェック（パターン分岐対応）
+            if sheet_name == 'あとギフ' and not missing_cols:
+                # 返礼品コードは存在する前提で、パターンごとの必須列を確認
+                is_furunavi_cols = {'販売フラグ', '公開フラグ', '在庫数', '受付開始日時', '受付終了日時'}.issubset(df.columns)
+                choice_col_name = '表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)'
+                is_choice_col = choice_col_name in df.columns
+
+                if not is_furunavi_cols and not is_choice_col:
+                     # どちらのパターンも満たさない場合エラーとする
+                     return None, [f"⚠️ **{file_name}** はインポートできませんでした。'販売フラグ'等の一式、または '{choice_col_name}' のいずれかが必要です。"], None
+
+            if missing_cols:
+                return None, [f"⚠️ **{file_name}** はインポートできませんでした。以下の必須列が不足しています: {', '.join(missing_cols)}"], None
+
+        # --- 楽天の処理 (必須列チェック & データ加工) ---
+        if sheet_name == '楽天':
+            # 1. 必須列チェック
+            missing_cols = RAKUTEN_REQUIRED_COLUMNS - set(df.columns)
+            if missing_cols:
+                return None, [f"⚠️ **{file_name}** はインポートできませんでした。以下の必須列が不足しています: {', '.join(missing_cols)}"], None
+
+            # 2. データ加工: fill-down・親判定・SKU番号/SKU倉庫指定の上書き (rakuten_preprocess.py)
+            df = preprocess_rakuten(df)
+
+        # --- ★ チョイスの親判定・前処理 ★ ---
+        if sheet_name == 'チョイス':
+            # 必要な列が存在するか確認 (A列=0, CW列=100, 返礼品コード列=102)
+            if {CHOICE_ID_COL_IDX, CHOICE_PARENT_COL_IDX, CHOICE_CODE_COL_IDX}.issubset(df.columns):
+                # データ型を文字列に統一してスペース除去
+                id_series = df[CHOICE_ID_COL_IDX].astype(str).str.strip()
+                parent_series = df[CHOICE_PARENT_COL_IDX].astype(str).str.strip()
+
+                # 親IDとして参照されているIDのセットを作成
+                # (CW列に値があり、かつ空文字でないもの)
+                parent_ids_referenced = set(parent_series[parent_series != ''].unique())
+
+                # A列の値が「親IDセット」に含まれる行を特定（＝親行）
+                is_parent_row = id_series.isin(parent_ids_referenced)
+
+                # 親行の「返礼品コード(102列目)」に (チョイス親) を付与
+                df.loc[is_parent_row, CHOICE_CODE_COL_IDX] = df.loc[is_parent_row, CHOICE_CODE_COL_IDX].astype(str) + '（チョイス親）'
+                # 検索キー (親サフィックス付与後のコードから作成)
+                df[KEY_COL] = normalize_keys(df[CHOICE_CODE_COL_IDX])
+
+                # ★ ソート用グループ表の作成 (列: code, group_id の2列)
+                # キー: 返礼品コード(サフィックスなし), 値: グループID(親のA列の値)
+                # 1. 親行: 自分自身がグループID
+                # 2. 子行: CW列の値がグループID
+                # (この時点でコードには '（チョイス親）' がついているので注意)
+                # コードは検索キー (正規化済み) を使用する
+                code_series = df[KEY_COL]
+
+                # 子行: コード(102) -> 親ID(CW)
+                is_child_row = parent_series != ''
+                child_part = pd.DataFrame({'code': code_series[is_child_row], 'group_id': parent_series[is_child_row]})
+
+                # 親行: コード(102, サフィックス除去) -> 自分自身(A)
+                parent_part = pd.DataFrame({
+                    'code': code_series[is_parent_row].str.replace('（チョイス親）', '', regex=False),
+                    'group_id': id_series[is_parent_row]
+                })
+
+                # 親行を後ろに連結し、同じコードは後の行を優先する (親行の情報で上書き)
+                group_table = pd.concat([child_part, parent_part], ignore_index=True)
+                group_table = group_table[group_table['code'] != '']
+                choice_group_table = group_table.drop_duplicates(subset=['code'], keep='last').reset_index(drop=True)
+
+        # --- 検索キー列の作成 (返礼品コードを正規化し、以降は完全一致で結合する) ---
+        # ※ チョイス在庫のキー (返礼品コード) はチョイスとの紐付け後に作成する
+        key_col = KEY_COLUMN_MAP.get(sheet_name)
+        if sheet_name != 'チョイス在庫' and KEY_COL not in df.columns and key_col in df.columns:
+            df[KEY_COL] = normalize_keys(df[key_col])
+
+        # --- 判定に使う列の型変換 (日付は整数 YYYYMMDD、在庫数・フラグは数値) ---
+        df = normalize_column_types(df, sheet_name)
+
+        return df, [], choice_group_table
+
+    def load_portal_file(file_name, bytes_data, sheet_name):
+        """
+        1ファイル分の読み込みと前処理を行う (インポートの並列実行用)。
+        戻り値: {'df', 'errors', 'read_info', 'choice_group_table', 'content_key'} の辞書
+        (content_key はファイル内容と読み込み条件のハッシュ)
+        """
+        result = {'df': None, 'errors': [], 'read_info': None, 'choice_group_table': None, 'content_key': None}
+        try:
+            # 同じ内容・同じ読み込み条件のファイルはキャッシュから読み込む
+            # (拡張子で区切り文字、ファイル名で文字コードの候補が変わるため、ファイル名も条件に含める)
+            cache_key = parse_cache.make_key(bytes_data, sheet_name, file_name.lower(), COLUMN_PROJECTION)
+            result['content_key'] = cache_key
+            cached = parse_cache.get(cache_key)
+            if cached is not None:
+                result['df'], extra = cached
+                if extra.get('choice_group_table') is not None:
+                    result['choice_group_table'] = pd.DataFrame(extra['choice_group_table'], columns=['code', 'group_id'])
+                result['read_info'] = f"{extra['read_info']}（キャッシュから読み込み）" if extra.get('read_info') else "キャッシュから読み込み"
+                return result
+
+            df, error, result['read_info'] = robust_read_file(file_name, bytes_data)
+            if df is None:
+                result['errors'].append(error)
+                return result
+            result['df'], result['errors'], result['choice_group_table'] = preprocess_portal_data(df, sheet_name, file_name)
+
+            if result['df'] is not None:
+                parse_cache.put(cache_key, result['df'], {
+                    'read_info': result['read_info'],
+                    # グループ表は JSON に変換できる形式 (列名 -> 値のリスト) で保存する
+                    'choice_group_table': result['choice_group_table'].to_dict('list') if result['choice_group_table'] is not None else None
+                })
+        except Exception as e:
+            # 予期せぬエラーでも他のファイルの処理は継続する
+            result['df'] = None
+            result['errors'].append(f"⚠️ **{file_name}** の読み込み中に予期せぬエラーが発生しました: {e}")
+        return result
 
     def generate_vendor_code(item_code):
         """返礼品コードから事業者コードを生成する"""
@@ -425,6 +667,487 @@ else:
         if re.match(r'^[A-Z]{3}', code): return code[:3]
         return ''
 
+    def get_key_ids(df):
+        """返礼品コードの ID 列を返す (インポート時に作成した KEY_ID_COL、なければ検索キー列 KEY_COL から作成)"""
+        if KEY_ID_COL in df.columns:
+            return df[KEY_ID_COL]
+        return pd.Series(st.session_state.code_dict.encode(df[KEY_COL]), index=df.index, name=KEY_ID_COL)
+
+    def build_master_table(master_items, lookup_maps, code_dict):
+        """
+        マスター (返礼品コードの ID -> 返礼品名) から、結果1行ごとの親子判定を列として一括で作成する。
+        列: code_id / code (返礼品コード), is_rakuten_parent / is_choice_parent (親コードか),
+            target_id / target_code (サフィックスなしのコード), display_name (表示名),
+            rakuten_child_exists (楽天親の子行が楽天データ内に存在するか)
+        """
+        code_ids = np.fromiter(master_items.keys(), dtype=np.int64, count=len(master_items))
+        codes = pd.Series(code_dict.decode(code_ids), dtype=object)
+        names = np.array(list(master_items.values()), dtype=object)
+
+        # 親コード判定と、サフィックスを除去したコード
+        is_rakuten_parent = codes.str.endswith('（楽天親）').to_numpy(dtype=bool)
+        is_choice_parent = codes.str.endswith('（チョイス親）').to_numpy(dtype=bool)
+        is_parent = is_rakuten_parent | is_choice_parent
+        target_codes = codes.mask(is_rakuten_parent, codes.str.replace('（楽天親）', '', regex=False))
+        target_codes = target_codes.mask(is_choice_parent, codes.str.replace('（チョイス親）', '', regex=False))
+        # サフィックスなしコードの ID (どのポータルにも存在しないコードは NO_CODE)
+        target_ids = np.where(is_parent, code_dict.lookup(target_codes), code_ids)
+
+        # 親コードの表示名: マスターに接尾辞なしのコードがあればその名前、なければ元データ (楽天・チョイス) の名称
+        target_names = pd.Series(target_ids).map(pd.Series(names, index=code_ids)).fillna('').to_numpy(dtype=object)
+        use_target_name = is_parent & (target_names != '')
+        display_names = np.where(use_target_name, target_names, names)
+        for p_source, is_source_parent in (('楽天', is_rakuten_parent), ('チョイス', is_choice_parent)):
+            rows = is_source_parent & ~use_target_name
+            if p_source in lookup_maps and rows.any():
+                nm_col = PORTAL_NAME_COLUMN_MAP[p_source]
+                values, found = lookup_maps[p_source].take(code_ids[rows], [nm_col])
+                source_names = display_names[rows]
+                source_names[found] = values[nm_col][found]
+                display_names[rows] = source_names
+
+        # 楽天親の「子行」(サフィックスなしのコード) が楽天データ内に存在するか
+        child_exists = np.zeros(len(code_ids), dtype=bool)
+        if '楽天' in lookup_maps:
+            _, target_found = lookup_maps['楽天'].take(target_ids, [])
+            child_exists = is_rakuten_parent & target_found
+
+        master_table = pd.DataFrame({
+            'code_id': code_ids,
+            'code': codes,
+            'is_rakuten_parent': is_rakuten_parent,
+            'is_choice_parent': is_choice_parent,
+            'target_id': target_ids,
+            'target_code': target_codes,
+            'display_name': display_names,
+            'rakuten_child_exists': child_exists,
+        })
+        return master_table
+
+    def portal_lookup_ids(master_table, portal, lookup_maps, code_dict):
+        """
+        ポータル1列分の検索コードを決める。
+        戻り値: (検索に使う返礼品コードの ID 配列, 計算せず空白にする行のマスク)
+        """
+        code_ids = master_table['code_id'].to_numpy()
+        target_ids = master_table['target_id'].to_numpy()
+        is_rakuten_parent = master_table['is_rakuten_parent'].to_numpy()
+        is_choice_parent = master_table['is_choice_parent'].to_numpy()
+        child_exists = master_table['rakuten_child_exists'].to_numpy()
+
+        lookup_ids = code_ids
+        skip = np.zeros(len(code_ids), dtype=bool)
+        if portal != '楽天':
+            # 楽天親: 子行が存在する場合は親行の結果を空白にし (子行側に出るため)、存在しない場合はサフィックスなしで検索
+            skip = child_exists
+            lookup_ids = np.where(is_rakuten_parent & ~child_exists, target_ids, lookup_ids)
+        if portal != 'チョイス':
+            # チョイス親: 他ポータルはサフィックスなしで検索
+            lookup_ids = np.where(is_choice_parent, target_ids, lookup_ids)
+        else:
+            # チョイス親以外: まずそのままのコード(子)で検索し、なければ親コード（チョイス親）を試す (子のステータスを優先)
+            choice_table = lookup_maps.get('チョイス')
+            child_found = choice_table.take(code_ids, [])[1] if choice_table is not None else np.zeros(len(code_ids), dtype=bool)
+            choice_parent_ids = code_dict.lookup(master_table['code'] + '（チョイス親）')
+            lookup_ids = np.where(is_choice_parent | child_found, code_ids, choice_parent_ids)
+        return lookup_ids.astype(np.int32), skip
+
+    def cached_step(cache, name, key, build):
+        """
+        処理段階 name の結果を、入力のキー (ファイル内容のハッシュ等) が前回と同じなら再利用し、異なれば build() で作り直す。
+        cache: 段階名 -> (キー, 結果) の辞書 (セッションステートに保持)
+        """
+        entry = cache.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        cache.pop(name, None) # 古い結果を先に解放する
+        value = build()
+        cache[name] = (key, value)
+        return value
+
+    def prepare_portal_column(portal, master_table, lookup_maps, rakuten_maps, code_dict):
+        """
+        ポータル1列分の検索コードと、基準日に依存しない判定 (ベクトル化方式のみ) を準備する。
+        戻り値: {'lookup_ids', 'skip_flags', 'prepared'} の辞書 (従来方式の prepared は None)
+        """
+        lookup_ids, skip_flags = portal_lookup_ids(master_table, portal, lookup_maps, code_dict)
+        prepared = None
+        if STATUS_ENGINE != STATUS_ENGINE_LEGACY:
+            prepared = prepare_status_column(
+                portal, lookup_ids, lookup_maps,
+                rakuten_product_id_map=rakuten_maps['product_id_map'],
+                rakuten_management_id_map=rakuten_maps['management_id_map'],
+                rakuten_group_table=rakuten_maps['group_table'],
+                code_dictionary=code_dict
+            )
+        return {'lookup_ids': lookup_ids, 'skip_flags': skip_flags, 'prepared': prepared}
+
+    def evaluate_portal_column(column, portal, select_date_str, lookup_maps, rakuten_maps, code_dict):
+        """準備済みのポータル1列分に基準日を適用し、ステータスのコード配列 (uint8) を返す"""
+        skip_flags = column['skip_flags']
+        if column['prepared'] is None:
+            # 従来方式: 返礼品コードごとに calculate_status を呼び出す (ID はコードに戻して渡す)
+            status_values = [
+                '' if skip_calculation else calculate_status(
+                    portal, lookup_code, lookup_maps, {}, # 親コード用の検索インデックスは未使用
+
+                    # 基準日(文字列)をキーワード引数として渡す
+                    select_date_str=select_date_str,
+
+                    # 楽天用の辞書をキーワード引数として渡す
+                    # ★ 商品管理DB廃止に伴い、memo_map も廃止（空辞書とする）
+                    memo_map={},
+                    rakuten_product_id_map=rakuten_maps['product_id_map'],
+                    rakuten_management_id_map=rakuten_maps['management_id_map'],
+
+                    # 楽天のグループ集計表を渡す
+                    rakuten_group_table=rakuten_maps['group_table']
+                )
+                for lookup_code, skip_calculation in zip(code_dict.decode(column['lookup_ids']), skip_flags)
+            ]
+        else:
+            # ベクトル化方式: 準備済みの判定 (返礼品コードの ID 配列で検索済み) に基準日の条件を適用する
+            status_values = column['prepared'].evaluate(select_date_str)
+        # 子行が存在する楽天親行は空白にする
+        return np.where(skip_flags, STATUS_BLANK, encode_statuses(status_values)).astype(np.uint8)
+
+    def evaluate_portal_column_dates(column, portal, select_date_strs, lookup_maps, rakuten_maps, code_dict):
+        """準備済みのポータル1列分に複数の基準日を適用し、(返礼品コード × 基準日) のコード行列 (uint8) を返す"""
+        if column['prepared'] is None:
+            # 従来方式: 基準日ごとに評価する
+            return np.stack([
+                evaluate_portal_column(column, portal, select_date_str, lookup_maps, rakuten_maps, code_dict)
+                for select_date_str in select_date_strs
+            ], axis=1)
+        # ベクトル化方式: 日付の条件のみ基準日の軸にブロードキャストして一度に評価する
+        status_values = column['prepared'].evaluate_dates(select_date_strs)
+        status_codes = encode_statuses(status_values.ravel()).reshape(status_values.shape)
+        return np.where(column['skip_flags'][:, None], STATUS_BLANK, status_codes).astype(np.uint8)
+
+    def next_portal_change(column, portal, select_date_str, lookup_maps, rakuten_maps, code_dict):
+        """
+        準備済みのポータル1列分の次回のステータス変更を返す (従来方式でも変更日はルール表から求める)。
+        戻り値: (次回変更日 (YYYYMMDD、変更がなければ 0) の配列, 変更後のステータスのコード配列 (変更がなければ STATUS_BLANK))
+        """
+        prepared = column['prepared']
+        if prepared is None:
+            prepared = prepare_status_column(
+                portal, column['lookup_ids'], lookup_maps,
+                rakuten_product_id_map=rakuten_maps['product_id_map'],
+                rakuten_management_id_map=rakuten_maps['management_id_map'],
+                rakuten_group_table=rakuten_maps['group_table'],
+                code_dictionary=code_dict
+            )
+        next_dates, next_statuses = prepared.next_change(select_date_str)
+        skip_flags = column['skip_flags']
+        return np.where(skip_flags, 0, next_dates), np.where(skip_flags, STATUS_BLANK, encode_statuses(next_statuses)).astype(np.uint8)
+
+    def format_date_ints(date_ints):
+        """YYYYMMDD 形式の整数配列を 'YYYY/MM/DD' の文字列配列にする (0 は空欄)"""
+        dates = pd.to_datetime(pd.Series(date_ints).astype(str), format='%Y%m%d', errors='coerce')
+        return dates.dt.strftime('%Y/%m/%d').fillna('').to_numpy(dtype=object)
+
+    def next_change_columns(df):
+        """結果の表のうち、次回のステータス変更の列 (表示は任意) を返す"""
+        return [c for c in df.columns
+                if c in NEXT_CHANGE_COLUMNS or c.endswith(NEXT_CHANGE_DATE_SUFFIX) or c.endswith(NEXT_CHANGE_STATUS_SUFFIX)]
+
+    def adjust_parent_rows(status_matrix, uploaded_portals, master_table):
+        """
+        親行の調整 (コード行列を直接書き換える)。
+        親行における他ポータル検索結果は、子行（サフィックスなし）が一覧（master_items）に存在する場合は
+        重複するため '-' とする。検索結果が「未登録」の場合も '-' とする（ベースポータル由来ではないため）
+        """
+        is_rakuten_parent_row = master_table['is_rakuten_parent'].to_numpy()
+        is_choice_parent_row = master_table['is_choice_parent'].to_numpy()
+        child_in_master = np.isin(master_table['target_id'].to_numpy(), master_table['code_id'].to_numpy())
+        for portal_idx, portal in enumerate(uploaded_portals):
+            other_portal_parent = (is_choice_parent_row & (portal != 'チョイス')) | (is_rakuten_parent_row & (portal != '楽天'))
+            is_unregistered = status_matrix[:, portal_idx] == STATUS_UNREGISTERED
+            status_matrix[other_portal_parent & (child_in_master | is_unregistered), portal_idx] = STATUS_NOT_APPLICABLE
+
+    def parse_batch_dates(date_range, interval, dates_text):
+        """
+        複数日付の一括判定の基準日を作成する (期間 + 間隔、および1行1日付で入力された日付)。
+        戻り値: (重複を除いて昇順に並べた YYYYMMDD のリスト, 日付として解釈できなかった行のリスト)
+        """
+        date_ints = set()
+        if len(date_range) == 2:
+            start, end = date_range
+            date_ints.update(int(d.strftime('%Y%m%d')) for d in pd.date_range(start, end, freq=BATCH_DATE_INTERVALS[interval]))
+        invalid_lines = []
+        for line in dates_text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            date_int = to_date_int(line)
+            if date_int:
+                date_ints.add(date_int)
+            else:
+                invalid_lines.append(line)
+        return [str(d) for d in sorted(date_ints)], invalid_lines
+
+    def build_batch_sheets(results_df, master_rows, status_cube, uploaded_portals, master_table, select_date_strs):
+        """
+        複数日付の判定結果を、基準日ごとの表 (結果の表と同じ列・行順) にする。
+        master_rows: 結果の表の各行に対応するマスターの行番号、status_cube: (返礼品コード × ポータル × 基準日) のコード行列
+        戻り値: 基準日 (YYYYMMDD) -> 結果の表
+        """
+        is_rakuten_parent_row = master_table['is_rakuten_parent'].to_numpy()
+        is_choice_parent_row = master_table['is_choice_parent'].to_numpy()
+        sheets = {}
+        for date_idx, select_date_str in enumerate(select_date_strs):
+            status_matrix = status_cube[:, :, date_idx]
+            # 次回のステータス変更の列は基準日の結果のみのため含めない
+            sheet = results_df.drop(columns=next_change_columns(results_df))
+            for portal_idx, portal in enumerate(uploaded_portals):
+                sheet[portal] = status_categorical(status_matrix[master_rows, portal_idx])
+            sheet['チェック'] = calculate_check_column(status_matrix, uploaded_portals, is_rakuten_parent_row, is_choice_parent_row)[master_rows]
+            sheet['公開中の数'] = (status_matrix == STATUS_PUBLIC).sum(axis=1)[master_rows]
+            sheets[select_date_str] = sheet
+        return sheets
+
+    def build_batch_long_form(sheets, uploaded_portals):
+        """基準日ごとの表を、返礼品コード × ポータル × 基準日の縦持ちの表 (1行 = 1つのステータス) にする"""
+        frames = []
+        for select_date_str, sheet in sheets.items():
+            id_columns = [c for c in ['返礼品コード', '楽天親判定', 'チョイス親判定', '返礼品名', '事業者コード'] if c in sheet.columns]
+            portals = [p for p in uploaded_portals if p in sheet.columns]
+            long_df = sheet.melt(id_vars=id_columns, value_vars=portals, var_name='ポータル', value_name='ステータス')
+            long_df.insert(0, '基準日', select_date_str)
+            frames.append(long_df)
+        if not frames:
+            return pd.DataFrame()
+        long_df = pd.concat(frames, ignore_index=True)
+        long_df['ステータス'] = pd.Categorical(long_df['ステータス'], categories=list(STATUS_LABELS))
+        return long_df
+
+    def build_master_items(full_data, base_portal_name, code_dict):
+        """ベースポータルの返礼品コードと名称、楽天・チョイスの親コードからマスター (返礼品コードの ID -> 返礼品名) を作成する"""
+        master_items = {} # 返礼品コードの ID -> 返礼品名
+        df_base = full_data.get(base_portal_name)
+        
+        # ベースポータルから返礼品コードと名称のリストを作成
+        df_base_data = df_base # robust_read_fileでヘッダー処理済み
+        
+        if df_base_data is not None:
+            code_col = KEY_COLUMN_MAP.get(base_portal_name)
+            name_col = PORTAL_NAME_COLUMN_MAP.get(base_portal_name)
+
+            if code_col is not None:
+                # gspread と googleapiclient で .dropna() の挙動が異なる可能性があるため
+                # キー列が存在することを確認してから subset を指定する
+                subset_col = [code_col] if code_col in df_base_data.columns or isinstance(code_col, int) else None
+                if subset_col:
+                    df_master_source = df_base_data.dropna(subset=subset_col).copy()
+                else:
+                    df_master_source = df_base_data.copy() # subset なし (万が一の場合)
+
+                
+                # 取り込み時に作成した返礼品コードの ID を使う (lookup_maps側と同じキー)
+                if KEY_COL in df_master_source.columns:
+                    df_master_source['key'] = get_key_ids(df_master_source)
+                else:
+                    df_master_source['key'] = code_dict.encode(normalize_keys(df_master_source[code_col]))
+                    
+                # 重複を除去
+                unique_items = df_master_source[df_master_source['key'] != NO_CODE].drop_duplicates(subset=['key'], keep='first')
+
+                # マスター辞書を作成 (返礼品コードの ID -> 返礼品名)
+                if name_col is not None and name_col in unique_items.columns:
+                    item_names = unique_items[name_col].astype(str).str.strip().tolist()
+                else:
+                    item_names = [""] * len(unique_items)
+                master_items = dict(zip(unique_items['key'].tolist(), item_names))
+            
+            # --- 親コードをマスターに追加（楽天・チョイス） ---
+            for p_name in ['楽天', 'チョイス']:
+                if base_portal_name != p_name and p_name in full_data:
+                    df_check = full_data[p_name]
+                    p_key_col = KEY_COLUMN_MAP[p_name]
+                    suffix = f'（{p_name}親）'
+                    
+                    # キー列データの取得 (検索キーは正規化済み、サフィックスは全角のまま)
+                    check_series = df_check[KEY_COL] if KEY_COL in df_check.columns else normalize_keys(df_check[p_key_col])
+                    
+                    parent_codes = check_series[check_series.str.endswith(suffix)].unique()
+                    for p_id in code_dict.encode(parent_codes).tolist():
+                        if p_id not in master_items:
+                            master_items[p_id] = ""
+        return master_items
+
+    def build_rakuten_maps(df_rakuten):
+        """
+        楽天データからステータス判定・ソート用の検索インデックスを作成する (楽天データがない場合は空)。
+        戻り値: {'product_id_map', 'management_id_map', 'group_table', 'mgmt_id_by_code_id'} の辞書
+        """
+        # 楽天データから各種検索インデックスを作成 (ヘッダー名で参照)
+        rakuten_product_id_map = {} # 商品番号 -> 行データ (LookupIndex)
+        rakuten_management_id_map = {} # 商品管理番号（商品URL） -> 行データ (LookupIndex)
+        
+        # 楽天のグループ集計表 (商品管理番号 -> 件数・先頭2行の情報)
+        rakuten_group_table = None
+        
+        # ソート用のURLマップ（返礼品コードの ID -> 商品管理番号）
+        item_code_to_mgmt_id_map = pd.Series(dtype=object)
+
+        if df_rakuten is not None:
+            # robust_read_fileでヘッダー処理済みのため、iloc[1:] は不要
+            df_rakuten_data = df_rakuten
+        
+            # ★「商品番号」列のソート -> 行データ
+            if '商品番号' in df_rakuten_data.columns:
+                # まず商品番号がある行を抽出
+                df_rakuten_b = df_rakuten_data.dropna(subset=['商品番号']).copy()
+            
+                # --- 分割ソート ---
+
+                # 1. SKU有無の判定（フラグ作成）
+                # 「システム連携用SKU番号」に値がある（空文字でない）場合はTrue
+                if 'システム連携用SKU番号' in df_rakuten_b.columns:
+                    has_sku_mask = (df_rakuten_b['システム連携用SKU番号'].astype(str).str.strip() != '')
+                else:
+                    has_sku_mask = pd.Series(False, index=df_rakuten_b.index)
+
+                # --- ランク計算用ロジック（列単位で一括計算） ---
+                # ※以前は全行をソートしてから重複排除していたが、
+                #   各ランクを整数の順位に変換して1つのキーにまとめ、商品番号ごとの最小値の行を選ぶ
+
+                # 複数のランクを、辞書順を保ったまま1つの整数キーにまとめる
+                def _pack_rank_keys(rank_columns):
+                    packed = np.zeros(len(df_rakuten_b), dtype=np.int64)
+                    n_packed = 1
+                    for values, ascending in rank_columns:
+                        # 値の順位 (同じ値は同じ順位)
+                        codes, uniques = pd.factorize(values, sort=True)
+                        n_values = max(len(uniques), 1)
+                        if not ascending:
+                            codes = n_values - 1 - codes
+                        # 桁あふれする場合は、それまでのキーを順位に詰め直す
+                        if n_packed * n_values >= 2 ** 62:
+                            packed = np.unique(packed, return_inverse=True)[1].astype(np.int64)
+                            n_packed = int(packed.max()) + 1
+                        packed = packed * n_values + codes
+                        n_packed *= n_values
+                    return packed
+
+                # 列名の定義
+                col_warehouse = '倉庫指定' if '倉庫指定' in df_rakuten_b.columns else None
+                col_search = 'サーチ表示' if 'サーチ表示' in df_rakuten_b.columns else None
+                col_order = '注文ボタン' if '注文ボタン' in df_rakuten_b.columns else None
+                col_start = '販売期間指定（開始日時）' if '販売期間指定（開始日時）' in df_rakuten_b.columns else None
+                col_end = '販売期間指定（終了日時）' if '販売期間指定（終了日時）' in df_rakuten_b.columns else None
+                col_stock = '在庫数' if '在庫数' in df_rakuten_b.columns else None
+            
+                # 日付列は取り込み時に整数 (YYYYMMDD) に変換済み (空欄は 0 とする)
+                current_date = int(TODAY_STR)
+                n_rows = len(df_rakuten_b)
+
+                # 数値列は取り込み時に数値化済み (空欄・数値以外の値は 0 とする)
+                def _rank_number(col):
+                    values = number_array(df_rakuten_b[col])
+                    return np.where(np.isfinite(values), values, 0)
+
+                # 【1】「倉庫指定」: '0' が優先 -> 昇順
+                p_rank_1 = np.where(number_array(df_rakuten_b[col_warehouse]) == 0, 0, 1) if col_warehouse else np.ones(n_rows, dtype=np.int64)
+
+                # 【2】「サーチ表示」: '1' が優先 -> 降順
+                p_rank_2 = _rank_number(col_search) if col_search else np.zeros(n_rows)
+
+                # 【3】「注文ボタン」: '1' が優先 -> 降順
+                p_rank_3 = _rank_number(col_order) if col_order else np.zeros(n_rows)
+
+                # 【4】「開始日時」: 区分 ① 空 / ② 過去 / ③ 未来
+                s_start_dates = df_rakuten_b[col_start].fillna(0).astype(np.int64) if col_start else pd.Series(0, index=df_rakuten_b.index)
+                p_rank_4_cat = np.select([s_start_dates.eq(0), s_start_dates.le(current_date)], [0, 1], 2)
+
+                # 【5】「終了日時」: 区分 ① 空 / ② 未来 / ③ 過去
+                s_end_dates = df_rakuten_b[col_end].fillna(0).astype(np.int64) if col_end else pd.Series(0, index=df_rakuten_b.index)
+                p_rank_5_cat = np.select([s_end_dates.eq(0), s_end_dates.ge(current_date)], [0, 1], 2)
+
+                # 【6】「在庫数」: 多い方が優先 -> 降順
+                p_rank_6 = _rank_number(col_stock) if col_stock else np.zeros(n_rows)
+
+                rank_key = _pack_rank_keys([
+                    (p_rank_1, True),                 # 【1】倉庫 (0優先 -> 昇順)
+                    (p_rank_2, False),                # 【2】サーチ (1優先 -> 降順)
+                    (p_rank_3, False),                # 【3】注文 (1優先 -> 降順)
+                    (p_rank_4_cat, True),             # 【4】開始区分 (空<過去<未来 -> 昇順)
+                    (s_start_dates.to_numpy(), True), # 【4】開始日値 (古い日付優先 -> 昇順)
+                    (p_rank_5_cat, True),             # 【5】終了区分 (空<未来<過去 -> 昇順)
+                    (s_end_dates.to_numpy(), False),  # 【5】終了日値 (新しい日付優先 -> 降順)
+                    (p_rank_6, False)                 # 【6】在庫 (多い順 -> 降順)
+                ])
+
+                # SKUなしの行 (親コード含む) はランクを使わず、SKUありの行より後ろの同順位とする
+                # (同順位の場合はファイル上位の行が残る)
+                if n_rows:
+                    rank_key = np.where(has_sku_mask.to_numpy(), rank_key, rank_key.max() + 1)
+
+                # ★ 商品番号は検索キー (取り込み時に正規化済み) で同一キーとみなす
+
+                # 商品番号ごとに最上位の行を選ぶ (SKUありが優先され、同順位ならファイル上位が残る)
+                # ※ 親コード（楽天親）はコード自体が異なるため、子コード（SKU）とは別物として残る
+                rank_key = pd.Series(rank_key, index=df_rakuten_b.index)
+                key_ids = get_key_ids(df_rakuten_b)
+                is_best = rank_key.eq(rank_key.groupby(key_ids, sort=False).transform('min'))
+                df_rakuten_b = df_rakuten_b[is_best].assign(**{KEY_ID_COL: key_ids[is_best]})
+                df_rakuten_b = df_rakuten_b[~df_rakuten_b[KEY_ID_COL].duplicated()]
+            
+                # 検索インデックス化 (キーは正規化・重複排除済み、返礼品コードの ID でも検索できる)
+                rakuten_product_id_map = LookupIndex.from_frame(df_rakuten_b, KEY_COL, id_col=KEY_ID_COL)
+            
+                # ソート用のマップ作成 (返礼品コードの ID -> 商品管理番号)
+                if '商品管理番号（商品URL）' in df_rakuten_b.columns:
+                    has_code = df_rakuten_b[KEY_ID_COL] != NO_CODE
+                    item_code_to_mgmt_id_map = pd.Series(
+                        df_rakuten_b.loc[has_code, '商品管理番号（商品URL）'].astype(str).str.strip().to_numpy(),
+                        index=df_rakuten_b.loc[has_code, KEY_ID_COL].to_numpy()
+                    )
+        
+            # A列(商品管理番号（商品URL）) -> 行データ
+            if '商品管理番号（商品URL）' in df_rakuten_data.columns:
+                df_rakuten_a = df_rakuten_data.dropna(subset=['商品管理番号（商品URL）']).drop_duplicates(subset=['商品管理番号（商品URL）'], keep='first')
+                # .upper() に統一
+                df_rakuten_a = df_rakuten_a.assign(_mgmt_key=df_rakuten_a['商品管理番号（商品URL）'].astype(str).str.strip().str.upper())
+                # 大文字化で重複したキーは後勝ちとする
+                df_rakuten_a = df_rakuten_a.drop_duplicates(subset=['_mgmt_key'], keep='last')
+                rakuten_management_id_map = LookupIndex.from_frame(df_rakuten_a, '_mgmt_key')
+
+            # グループ集計表の構築 (商品管理番号ごとの件数と、2件グループの相方判定用の行情報)
+            rakuten_group_table = build_rakuten_group_table(df_rakuten_data)
+    
+
+        return {
+            'product_id_map': rakuten_product_id_map,
+            'management_id_map': rakuten_management_id_map,
+            'group_table': rakuten_group_table,
+            'mgmt_id_by_code_id': item_code_to_mgmt_id_map,
+        }
+
+    def build_lookup_index(name, df):
+        """
+        シート1つ分の検索インデックス (キー: 検索キー列 KEY_COL、返礼品コードの ID KEY_ID_COL) を作成する。
+        キー列が未定義・見つからないシートは None
+        """
+        key_col = KEY_COLUMN_MAP.get(name)
+        if key_col is None:
+            return None # キー列が未定義のシートはスキップ
+
+        # 取り込み時に作成した検索キー列 (正規化済み) で完全一致の検索インデックスを作成する
+        # (チョイス在庫はチョイスとの紐付け後にキー列が作成される)
+        if KEY_COL not in df.columns:
+            if key_col not in df.columns:
+                st.error(f"ファイル '{name}' に必要なキー列 '{key_col}' が見つかりません。")
+            return None
+
+        key_ids = get_key_ids(df)
+        df_cleaned = df[key_ids != NO_CODE].assign(**{KEY_ID_COL: key_ids[key_ids != NO_CODE]})
+        unique_data = df_cleaned.drop_duplicates(subset=[KEY_ID_COL], keep='first')
+        # 列キーはチョイス系がインデックス番号(0, 1...)、その他がヘッダー名('商品番号', '商品名'...)
+        # 返礼品コードの ID でも検索できるようにする (ベクトル化方式は ID 配列で検索する)
+        return LookupIndex.from_frame(unique_data, KEY_COL, id_col=KEY_ID_COL)
+
     def filter_dataframe(df, sheet_name, item_codes_to_filter, vendor_codes_to_filter):
         """
         DataFrameを指定されたコードリストでフィルタリングする関数。
@@ -505,12 +1228,13 @@ else:
         # --- キー列の型（int or str）で処理を分岐 ---
         if isinstance(key_col, int):
             # (チョイス系: ヘッダーなし、インデックス番号で参照)
-            if df.shape[1] <= key_col:
+            if key_col not in data.columns:
                 st.error(f"ファイル '{sheet_name}' の列数が不足しています。キー列 {key_col} が存在しません。")
                 return df
             
             # チョイス系はそのままの値を使用
-            item_code_series = data.iloc[:, key_col].astype(str).str.strip()
+            # (列の絞り込み読み込み時は位置と列番号が一致しないため、列名で参照する)
+            item_code_series = data[key_col].astype(str).str.strip()
 
         elif isinstance(key_col, str):
             # (その他: ヘッダーあり、ヘッダー名で参照)
@@ -550,8 +1274,16 @@ else:
         st.session_state.dataframes = {}
     if 'results_df' not in st.session_state:
         st.session_state.results_df = pd.DataFrame()
-    if 'choice_group_map' not in st.session_state:
-        st.session_state.choice_group_map = {} # ★ チョイスのグループ情報保存用
+    if 'choice_group_table' not in st.session_state:
+        st.session_state.choice_group_table = pd.DataFrame(columns=['code', 'group_id', 'code_id']) # ★ チョイスのグループ情報保存用 (返礼品コード -> グループID、code_id は返礼品コードの ID)
+    if 'file_read_info' not in st.session_state:
+        st.session_state.file_read_info = {} # シート名 -> 読み込み情報 (文字コード・判定時間)
+    if 'code_dict' not in st.session_state:
+        st.session_state.code_dict = CodeDictionary() # 返礼品コード <-> 整数ID (全ポータル共通)
+    if 'data_hashes' not in st.session_state:
+        st.session_state.data_hashes = {} # シート名 -> 取り込んだデータのハッシュ (処理結果の再利用判定用)
+    if 'run_cache' not in st.session_state:
+        st.session_state.run_cache = {} # 処理段階 -> (入力のキー, 結果) (基準日以外の処理結果・ポータル別のステータス列)
     # (認証関連のセッションステートはStreamlitが内部で管理するため不要)
 
     # --- フィルター状態の初期化 (リセットされないようにsession_stateで管理) ---
@@ -560,6 +1292,8 @@ else:
     if 'f_vendor' not in st.session_state: st.session_state.f_vendor = [] 
     if 'f_check' not in st.session_state: st.session_state.f_check = "すべて"
     if 'f_teiki' not in st.session_state: st.session_state.f_teiki = "すべて"
+    if 'f_change_days' not in st.session_state: st.session_state.f_change_days = 0 # N日以内に変更 (0 はすべて)
+    if 'f_show_next_change' not in st.session_state: st.session_state.f_show_next_change = False
 
     if 'w_item_code' not in st.session_state: st.session_state.w_item_code = st.session_state.f_item_code
     if 'w_vendor' not in st.session_state: st.session_state.w_vendor = st.session_state.f_vendor
@@ -635,10 +1369,13 @@ else:
             if is_hyakusen_present ^ is_hyakusen_stock_present:
                 st.error("⚠️ 「百選」と「百選在庫」は、必ずセットでアップロードしてください。")
 
-        def show_file_preview(uploaded_file, df_preview, num_rows=5):
+        def show_file_preview(uploaded_file, df_preview, num_rows=5, read_info=None):
             """アップロードされたファイルのプレビューを表示する"""
             with st.expander(f"📄 **{uploaded_file.name}**"):
-                st.dataframe(df_preview.head(num_rows))
+                if read_info:
+                    st.caption(read_info)
+                # 検索キー列 (取り込み時に作成) は表示しない
+                st.dataframe(df_preview.drop(columns=[KEY_COL, KEY_ID_COL], errors='ignore').head(num_rows))
 
         all_uploaded_files = uploaded_files or []
 
@@ -692,7 +1429,8 @@ else:
             item_codes_list = [code.strip() for code in item_codes_to_filter_input.split('\n') if code.strip()]
             vendor_codes_list = [code.strip() for code in vendor_codes_to_filter_input.split('\n') if code.strip()]
 
-            # 3. 処理対象のファイル (files_to_process) のみループ処理
+            # 3. 処理対象のファイル (files_to_process) のうち、読み込みが必要なものを抽出
+            files_to_load = []
             for file in files_to_process:
             
                 # fileがNoneの可能性は事前チェックで排除されている
@@ -705,161 +1443,54 @@ else:
                 # 既に読み込まれていて、ファイルメタデータが変わっていない場合は再読み込みしない
                 # file_id の比較をメタデータの比較に変更
                 if sheet_name not in st.session_state.dataframes or st.session_state.dataframes.get(file_key) != current_metadata:
-                    df = robust_read_file(file)
-                    
-                    if df is not None:
-                        # --- 英語版Amazonのヘッダー対応 ---
-                        if sheet_name == 'Amazon':
-                            # 英語版の小文字ヘッダーを日本語ヘッダーに置換
-                            amazon_rename_map = {
-                                'sku': '出品者SKU',
-                                'asin': 'ASIN',
-                                'price': '価格',
-                                'quantity': '数量'
-                            }
-                            # リネーム実行（列が存在しない場合は何もしない）
-                            df = df.rename(columns=amazon_rename_map)
-
-                        # --- 共通の必須列チェック (楽天、チョイス系以外) ---
-                        # PORTAL_REQUIRED_COLUMNS に定義されたポータルのみチェックを行う
-                        if sheet_name in PORTAL_REQUIRED_COLUMNS:
-                            required_cols = PORTAL_REQUIRED_COLUMNS[sheet_name]
-                            missing_cols = required_cols - set(df.columns)
-                            
-                            # あとギフの場合の追加チェック（パターン分岐対応）
-                            if sheet_name == 'あとギフ' and not missing_cols:
-                                # 返礼品コードは存在する前提で、パターンごとの必須列を確認
-                                is_furunavi_cols = {'販売フラグ', '公開フラグ', '在庫数', '受付開始日時', '受付終了日時'}.issubset(df.columns)
-                                choice_col_name = '表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)'
-                                is_choice_col = choice_col_name in df.columns
-                                
-                                if not is_furunavi_cols and not is_choice_col:
-                                     # どちらのパターンも満たさない場合エラーとする
-                                     st.error(f"⚠️ **{file.name}** はインポートできませんでした。'販売フラグ'等の一式、または '{choice_col_name}' のいずれかが必要です。")
-                                     continue
-
-                            if missing_cols:
-                                st.error(f"⚠️ **{file.name}** はインポートできませんでした。以下の必須列が不足しています: {', '.join(missing_cols)}")
-                                continue
-
-                        # --- 楽天の処理 (必須列チェック & データ加工) ---
-                        if sheet_name == '楽天':
-                            # 1. 必須列チェック
-                            required_columns = {
-                                "商品管理番号（商品URL）", "商品番号", "商品名", "倉庫指定",
-                                "サーチ表示", "販売期間指定（開始日時）", "販売期間指定（終了日時）",
-                                "注文ボタン", "SKU管理番号", "システム連携用SKU番号",
-                                "在庫数", "SKU倉庫指定"
-                            }
-                            missing_cols = required_columns - set(df.columns)
-                            if missing_cols:
-                                st.error(f"⚠️ **{file.name}** はインポートできませんでした。以下の必須列が不足しています: {', '.join(missing_cols)}")
-                                continue  # このファイルの処理をスキップして次のファイルへ
-                            
-                            # 2. データ加工: 先頭行のデータを同グループの下行へコピー (fill-down)
-                            # ★ 親判定のために「商品番号」をfill-downしてはいけないため、リストから除外
-                            fill_targets = ['商品名', 'サーチ表示', '販売期間指定（開始日時）', '販売期間指定（終了日時）', '注文ボタン']
-                            
-                            grouped_first = df.groupby('商品管理番号（商品URL）')[fill_targets].first()
-                            
-                            for col in fill_targets:
-                                # マッピング実行
-                                df[col] = df['商品管理番号（商品URL）'].map(grouped_first[col])
-
-                            # 3. 親判定処理（グループ>=3 の場合、先頭行を親とする）
-                            # fill-down直後に実行することで、商品番号が埋まった状態で判定可能（ただしSKU上書き前）
-                            
-                            # グループごとの件数を計算
-                            group_counts = df['商品管理番号（商品URL）'].value_counts()
-                            # 3行以上のグループURLを抽出
-                            large_group_urls = group_counts[group_counts >= 3].index
-                            
-                            # 処理対象の行をフィルタリングしてループ処理（高速化のため）
-                            if not large_group_urls.empty:
-                                mask_large = df['商品管理番号（商品URL）'].isin(large_group_urls)
-                                df_large = df[mask_large]
-                                
-                                # 変更対象のインデックスリスト
-                                indices_to_modify = []
-                                
-                                for url, group in df_large.groupby('商品管理番号（商品URL）'):
-                                    # グループ先頭行のインデックス
-                                    first_idx = group.index[0]
-                                    indices_to_modify.append(first_idx)
-                                
-                                # 対象行の商品番号に「（楽天親）」を付与
-                                if indices_to_modify:
-                                    df.loc[indices_to_modify, '商品番号'] = df.loc[indices_to_modify, '商品番号'].astype(str) + '（楽天親）'
-
-                            # 4. データ加工: 「システム連携用SKU番号」に値がある場合のみ、「商品番号」にコピー
-                            # (空文字でない場合のみ上書きする)
-                            # ★ 親判定後に実行することで、SKU行はSKU番号になり、親行（SKUなし）は変更後の商品番号（楽天親）が維持される
-                            mask_sku = df['システム連携用SKU番号'] != ''
-                            df.loc[mask_sku, '商品番号'] = df.loc[mask_sku, 'システム連携用SKU番号']
-
-                            # 5. データ加工: 「SKU倉庫指定」に値がある場合のみ、「倉庫指定」にコピー
-                            # (空文字でない場合のみ上書きする)
-                            mask_warehouse = df['SKU倉庫指定'] != ''
-                            df.loc[mask_warehouse, '倉庫指定'] = df.loc[mask_warehouse, 'SKU倉庫指定']
-                        
-                        # --- ★ チョイスの親判定・前処理 ★ ---
-                        if sheet_name == 'チョイス':
-                            # 必要な列が存在するか確認 (A列=0, CW列=100, 返礼品コード列=102)
-                            max_col_idx = max(CHOICE_ID_COL_IDX, CHOICE_PARENT_COL_IDX, CHOICE_CODE_COL_IDX)
-                            if df.shape[1] > max_col_idx:
-                                # データ型を文字列に統一してスペース除去
-                                id_series = df[CHOICE_ID_COL_IDX].astype(str).str.strip()
-                                parent_series = df[CHOICE_PARENT_COL_IDX].astype(str).str.strip()
-                                
-                                # 親IDとして参照されているIDのセットを作成
-                                # (CW列に値があり、かつ空文字でないもの)
-                                parent_ids_referenced = set(parent_series[parent_series != ''].unique())
-                                
-                                # A列の値が「親IDセット」に含まれる行を特定（＝親行）
-                                is_parent_row = id_series.isin(parent_ids_referenced)
-                                
-                                # 親行の「返礼品コード(102列目)」に (チョイス親) を付与
-                                df.loc[is_parent_row, CHOICE_CODE_COL_IDX] = df.loc[is_parent_row, CHOICE_CODE_COL_IDX].astype(str) + '（チョイス親）'
-
-                                # ★ ソート用グループマップの作成
-                                # キー: 返礼品コード(サフィックスなし), 値: グループID(親のA列の値)
-                                # 1. 親行: 自分自身がグループID
-                                # 2. 子行: CW列の値がグループID
-                                temp_group_map = {}
-                                
-                                # A列と返礼品コード(102)のマッピング（サフィックス付与後なので注意）
-                                # 子行のために、コード(102) -> 親ID(CW) の関係を取得
-                                child_rows = df[parent_series != '']
-                                for idx, row in child_rows.iterrows():
-                                    code_val = str(row[CHOICE_CODE_COL_IDX]).strip()
-                                    parent_val = str(row[CHOICE_PARENT_COL_IDX]).strip()
-                                    if code_val and parent_val:
-                                        temp_group_map[code_val] = parent_val
-                                
-                                # 親行のために、コード(102) -> 自分自身(A) の関係を取得
-                                # (この時点でコードには '（チョイス親）' がついているので除去してキーにする)
-                                parent_rows = df[is_parent_row]
-                                for idx, row in parent_rows.iterrows():
-                                    code_val_full = str(row[CHOICE_CODE_COL_IDX]).strip()
-                                    code_val_clean = code_val_full.replace('（チョイス親）', '')
-                                    self_id = str(row[CHOICE_ID_COL_IDX]).strip()
-                                    if code_val_clean:
-                                        temp_group_map[code_val_clean] = self_id
-
-                                st.session_state.choice_group_map = temp_group_map
-
-                        # -----------------------------------
-
-                        if sheet_name not in SKIP_FILTERING_SHEETS:
-                            df = filter_dataframe(df, sheet_name, item_codes_list, vendor_codes_list)
-                        
-                        st.session_state.dataframes[sheet_name] = df
-                        st.session_state.dataframes[file_key] = current_metadata # メタデータを保存
+                    files_to_load.append((file, sheet_name, file_key, current_metadata))
+
+            # 4. 読み込みと前処理を並列実行 (ファイル同士は独立しているためスレッドプールで処理)
+            load_results = []
+            if files_to_load:
+                max_workers = max(1, min(IMPORT_MAX_WORKERS, len(files_to_load)))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [
+                        executor.submit(load_portal_file, file.name, file.getvalue(), sheet_name)
+                        for file, sheet_name, _, _ in files_to_load
+                    ]
+                    # 完了順ではなくアップロード順で結果を受け取る
+                    load_results = [future.result() for future in futures]
+
+            # 5. 結果をアップロード順にセッションステートへ反映 (エラーはファイルごとに表示)
+            for (file, sheet_name, file_key, current_metadata), result in zip(files_to_load, load_results):
+                for error_message in result['errors']:
+                    st.error(error_message)
+
+                if result['read_info']:
+                    st.session_state.file_read_info[sheet_name] = result['read_info']
+
+                df = result['df']
+                if df is None:
+                    continue
+
+                if result['choice_group_table'] is not None:
+                    choice_group_table = result['choice_group_table']
+                    # コードは ID に変換して保持する (結果作成時に ID で結合するため)
+                    choice_group_table['code_id'] = st.session_state.code_dict.encode(choice_group_table['code'])
+                    st.session_state.choice_group_table = choice_group_table
+
+                if sheet_name not in SKIP_FILTERING_SHEETS:
+                    df = filter_dataframe(df, sheet_name, item_codes_list, vendor_codes_list)
 
-                        new_file_processed = True # ★ 新規ファイル処理フラグを立てる
+                # 検索キーを全ポータル共通の ID に変換する (ポータル間の突き合わせは ID で行う)
+                if KEY_COL in df.columns:
+                    df = df.assign(**{KEY_ID_COL: st.session_state.code_dict.encode(df[KEY_COL])})
+                
+                st.session_state.dataframes[sheet_name] = df
+                st.session_state.dataframes[file_key] = current_metadata # メタデータを保存
+                # 基準日以外の処理結果の再利用判定用 (ファイル内容のハッシュと、取り込み時の絞り込み条件)
+                st.session_state.data_hashes[sheet_name] = (result['content_key'], tuple(item_codes_list), tuple(vendor_codes_list))
+
+                new_file_processed = True # ★ 新規ファイル処理フラグを立てる
 
-                        # 前処理フラグのリセット
-                        if sheet_name == 'チョイス在庫': st.session_state['choice_stock_processed'] = False
+                # 前処理フラグのリセット
+                if sheet_name == 'チョイス在庫': st.session_state['choice_stock_processed'] = False
 
             # --- チョイス在庫データの前処理 ---
             # チョイスとチョイス在庫の両方が読み込まれていて、まだ前処理がされていない場合
@@ -869,7 +1500,7 @@ else:
                     df_choice_stock = st.session_state.dataframes["チョイス在庫"].copy()
                     # データフレームに必要な列が存在するか確認
                     # (チョイス: index 1, 102), (チョイス在庫: index 1)
-                    if df_choice.shape[1] > 102 and df_choice_stock.shape[1] > 1:
+                    if {1, 102}.issubset(df_choice.columns) and 1 in df_choice_stock.columns:
                         # チョイスデータから 商品管理番号(1) と 返礼品コード(102) を抽出
                         df_map_source = df_choice[[1, 102]].dropna().copy()
                         # 文字列型にして前後の空白を除去
@@ -877,18 +1508,24 @@ else:
                         df_map_source[102] = df_map_source[102].astype(str).str.strip()
                         # 商品管理番号で重複を除去 (最初の一つを残す)
                         df_map_source = df_map_source.drop_duplicates(subset=[1], keep='first')
-                        # 商品管理番号をキー、返礼品コードを値とする辞書を作成
-                        id_map = df_map_source.set_index(1)[102].to_dict()
+                        # 商品管理番号をキー、返礼品コードを値とする対応表を作成 (辞書を経由せず Series のまま結合する)
+                        code_by_mgmt_id = df_map_source.set_index(1)[102]
                         # チョイス在庫の 商品管理番号(1) 列を取得し、文字列型に変換
                         lookup_keys = df_choice_stock[1].astype(str).str.strip()
-                        # map関数を使って返礼品コードを紐付け
-                        mapped_codes = lookup_keys.map(id_map)
+                        # 商品管理番号で結合して返礼品コードを紐付け
+                        mapped_codes = lookup_keys.map(code_by_mgmt_id)
                         # 紐付けた返礼品コードを先頭列(0列目)に挿入
                         df_choice_stock.insert(0, 'generated_code', mapped_codes)
-                        # 列名をリセット (0, 1, 2, ...)
-                        df_choice_stock.columns = range(df_choice_stock.shape[1])
+                        # 列名を元の列番号 +1 に振り直す (0: 返礼品コード, 1, 2, ...)
+                        # (列の絞り込み読み込み時も、元ファイルの列位置に基づく番号を維持する)
+                        df_choice_stock.columns = [0] + [c + 1 for c in df_choice_stock.columns[1:]]
+                        # 検索キー (紐付けた返礼品コードを正規化)
+                        df_choice_stock[KEY_COL] = normalize_keys(mapped_codes)
+                        df_choice_stock[KEY_ID_COL] = st.session_state.code_dict.encode(df_choice_stock[KEY_COL])
                         # 処理済みのデータフレームをセッションステートに保存
                         st.session_state.dataframes["チョイス在庫"] = df_choice_stock
+                        # 紐付けに使ったチョイスのデータもハッシュに含める
+                        st.session_state.data_hashes["チョイス在庫"] = (st.session_state.data_hashes.get("チョイス在庫"), st.session_state.data_hashes.get("チョイス"))
                         # 前処理済みフラグを立てる
                         st.session_state['choice_stock_processed'] = True
 
@@ -915,7 +1552,7 @@ else:
                         sheet_name = get_sheet_name_from_filename(file.name)
                         # 前処理の結果、データフレームが存在するか確認
                         if sheet_name in st.session_state.dataframes:
-                            show_file_preview(file, st.session_state.dataframes[sheet_name])
+                            show_file_preview(file, st.session_state.dataframes[sheet_name], read_info=st.session_state.file_read_info.get(sheet_name))
                             processed_files_count += 1
                 # もしアップロードファイルはあるのに、処理されたものがなければメッセージ表示
                 if processed_files_count == 0 and any(all_uploaded_files):
@@ -970,6 +1607,26 @@ else:
                 help="ステータス判定の基準となる日付を選択します。"
             )
 
+        # 複数日付の一括判定 (期間・日付を指定した場合、基準日ごとの結果も作成する)
+        with st.expander("複数日付の一括判定"):
+            batch_date_range = st.date_input(
+                label="期間",
+                value=(),
+                disabled=not files_uploaded,
+                help="開始日と終了日を選択すると、その期間の日付を下の間隔で判定します。"
+            )
+            batch_date_interval = st.selectbox(
+                label="間隔",
+                options=list(BATCH_DATE_INTERVALS),
+                disabled=not files_uploaded
+            )
+            batch_dates_text = st.text_area(
+                label="日付を個別に指定",
+                placeholder="2025/12/01\n2026/01/01",
+                disabled=not files_uploaded,
+                help="1行に1つずつ日付を入力します (キャンペーン日など)。"
+            )
+
         # --- 「掲載状況を表示」ボタン ---
         st.markdown('<div class="button-container" style="margin-top: 10px;">', unsafe_allow_html=True)
         
@@ -1031,6 +1688,16 @@ else:
             st.session_state.current_select_date_str = select_date_str
             st.session_state.current_base_portal = selected_base_portal
 
+            # 複数日付の一括判定の基準日 (前回の一括判定の結果は破棄する)
+            batch_date_strs, invalid_batch_dates = parse_batch_dates(batch_date_range, batch_date_interval, batch_dates_text)
+            if invalid_batch_dates:
+                st.warning(f"日付として解釈できない行は無視しました: {', '.join(invalid_batch_dates)}")
+            if len(batch_date_strs) > BATCH_MAX_DATES:
+                st.warning(f"一括判定の基準日は{BATCH_MAX_DATES}日付までです。先頭の{BATCH_MAX_DATES}日付のみ判定します。")
+                batch_date_strs = batch_date_strs[:BATCH_MAX_DATES]
+            st.session_state.pop('batch_sheets', None)
+            st.session_state.pop('batch_long_df', None)
+
             # ログ用にインポートファイル名リストを作成
             log_imported_files = []
             for key, val in st.session_state.dataframes.items():
@@ -1061,566 +1728,261 @@ else:
 
                     # _id -> _metadata
                     full_data = {k: v for k, v in st.session_state.dataframes.items() if not k.endswith('_metadata')}
+
+                    # 同じ入力 (ファイルの内容・ベースポータル・基準日・定期便DB/事業者DBの内容) で計算済みの結果があれば、そのまま使う
+                    # (ハッシュのないシートがある場合はキャッシュを使わない)
+                    sheet_hashes = [(name, st.session_state.data_hashes.get(name)) for name in sorted(full_data)]
+                    result_key = None
+                    if all(sheet_hash is not None for _, sheet_hash in sheet_hashes):
+                        result_key = ResultCache.make_key(
+                            sheet_hashes, selected_base_portal, select_date_str, STATUS_ENGINE, TODAY_STR,
+                            sorted(teiki_bin_codes), ResultCache.frame_digest(df_business)
+                        )
+                    # (一括判定の基準日がある場合は、基準日ごとの結果を作るため計算する)
+                    cached_result = result_cache.get(result_key) if result_key and not batch_date_strs else None
+
+                    if cached_result is not None:
+                        st.session_state.results_df, cached_extra = cached_result
+                        log_displayed_portals = cached_extra.get('displayed_portals', [])
+                    else:
+                        # 返礼品コードの辞書 (ポータル間の突き合わせは返礼品コードの ID で行い、文字列に戻すのは表示用のみ)
+                        code_dict = st.session_state.code_dict
                     
-                    master_items = {}
-                    base_portal_name = selected_base_portal
-                    df_base = full_data.get(base_portal_name)
-                    
-                    # ベースポータルから返礼品コードと名称のリストを作成
-                    df_base_data = df_base # robust_read_fileでヘッダー処理済み
-                    
-                    if df_base_data is not None:
-                        code_col = KEY_COLUMN_MAP.get(base_portal_name)
-                        name_col = PORTAL_NAME_COLUMN_MAP.get(base_portal_name)
-
-                        if code_col is not None:
-                            # gspread と googleapiclient で .dropna() の挙動が異なる可能性があるため
-                            # キー列が存在することを確認してから subset を指定する
-                            subset_col = [code_col] if code_col in df_base_data.columns or isinstance(code_col, int) else None
-                            if subset_col:
-                                df_master_source = df_base_data.dropna(subset=subset_col).copy()
-                            else:
-                                df_master_source = df_base_data.copy() # subset なし (万が一の場合)
-
-                            
-                            # --- キー列の型（int or str）で処理を分岐 ---
-                            if isinstance(code_col, int):
-                                # (チョイス系: インデックス番号で参照)
-                                # (lookup_maps側とクレンジング処理を合わせる)
-                                # すべて .str.upper() に統一
-                                df_master_source['key'] = df_master_source[code_col].astype(str).str.replace('\ufeff', '', regex=False).str.replace(r'\.0$', '', regex=True).str.strip().str.upper()
-                            
-                            elif isinstance(code_col, str):
-                                df_master_source['key'] = df_master_source[code_col].astype(str).str.replace('\ufeff', '', regex=False).str.replace(r'\.0$', '', regex=True).str.strip().str.upper()
-                                
-                            # 重複を除去
-                            unique_items = df_master_source[df_master_source['key'] != ''].drop_duplicates(subset=['key'], keep='first')
-
-                            # マスター辞書を作成
-                            for _, row in unique_items.iterrows():
-                                item_code = row['key']
-                                item_name = ""
-                                if name_col is not None:
-                                    try:
-                                        item_name = str(row[name_col]).strip()
-                                    except KeyError:
-                                        item_name = ""
-                                master_items[item_code] = item_name
-                        
-                        # --- 親コードをマスターに追加（楽天・チョイス） ---
-                        for p_name in ['楽天', 'チョイス']:
-                            if base_portal_name != p_name and p_name in full_data:
-                                df_check = full_data[p_name]
-                                p_key_col = KEY_COLUMN_MAP[p_name]
-                                suffix = f'（{p_name}親）'
-                                
-                                # キー列データの取得
-                                if isinstance(p_key_col, int):
-                                    check_series = df_check.iloc[:, p_key_col].astype(str)
-                                else:
-                                    check_series = df_check[p_key_col].astype(str)
-                                
-                                parent_codes = check_series[check_series.str.endswith(suffix)].unique()
-                                for p_code in parent_codes:
-                                    p_code_str = str(p_code).strip().upper()
-                                    if p_code_str not in master_items:
-                                        master_items[p_code_str] = ""
+                        base_portal_name = selected_base_portal
+
+                        # 基準日以外の処理結果は、処理段階ごとに入力ファイル (内容のハッシュ) が前回と同じなら再利用する
+                        # (1ポータルのファイルを追加・差し替えた場合は、そのポータルの列のみ計算し直す)
+                        run_cache = st.session_state.run_cache
+                        data_hashes = {name: st.session_state.data_hashes.get(name) for name in full_data}
+                        uploaded_portals = [p for p in PORTAL_ORDER if p in full_data]
+
+                        # シート名 -> LookupIndex (シートごとに、そのシートのデータが変わった場合のみ作り直す)
+                        lookup_maps = {}
+                        for name, df in full_data.items():
+                            lookup_index = cached_step(run_cache, ('lookup', name), data_hashes[name], lambda: build_lookup_index(name, df))
+                            if lookup_index is not None:
+                                lookup_maps[name] = lookup_index
+
+                        # --- 楽天ステータス判定用のデータ準備 ---
+                        # ※ 楽天の代表行の選択は当日 (TODAY_STR) を基準とするため、日付が変わった場合は作り直す
+                        rakuten_key = (data_hashes.get('楽天'), TODAY_STR)
+                        rakuten_maps = cached_step(run_cache, 'rakuten', rakuten_key, lambda: build_rakuten_maps(full_data.get('楽天')))
+                        item_code_to_mgmt_id_map = rakuten_maps['mgmt_id_by_code_id']
+
+                        # --- 1. 各返礼品コードの親子判定 (マスターの列として一括で作成) ---
+                        # マスターはベースポータルと、親コード・名称を参照する楽天・チョイスのデータから作成する
+                        master_key = (base_portal_name, data_hashes.get(base_portal_name), data_hashes.get('楽天'), data_hashes.get('チョイス'))
+                        master_table = cached_step(run_cache, 'master', master_key, lambda: build_master_table(
+                            build_master_items(full_data, base_portal_name, code_dict), lookup_maps, code_dict
+                        ))
+
+                        code_ids = master_table['code_id'].to_numpy()
+                        target_ids = master_table['target_id'].to_numpy()
+                        is_rakuten_parent_row = master_table['is_rakuten_parent'].to_numpy()
+                        is_choice_parent_row = master_table['is_choice_parent'].to_numpy()
+
+                        # --- 2. ポータルごとにステータス列を計算 ---
+                        # ステータスは (返礼品コード × ポータル) の uint8 のコード行列で保持する (コード表: STATUS_LABELS)
+                        # 各列は「マスター + そのポータル (と在庫ファイル) のデータ」が変わった場合のみ準備し直し、
+                        # 基準日の条件はさらに基準日が変わった場合のみ評価し直す
+                        status_matrix = np.zeros((len(master_table), len(uploaded_portals)), dtype=np.uint8)
+                        # 一括判定: (返礼品コード × ポータル × 基準日) のコード行列 (基準日の軸はまとめて評価する)
+                        status_cube = np.zeros((len(master_table), len(uploaded_portals), len(batch_date_strs)), dtype=np.uint8)
+                        # 次回のステータス変更 (変更日と変更後のステータスのコード行列)
+                        next_dates = np.zeros((len(master_table), len(uploaded_portals)), dtype=np.int64)
+                        next_statuses = np.zeros((len(master_table), len(uploaded_portals)), dtype=np.uint8)
+                        for portal_idx, portal in enumerate(uploaded_portals):
+                            input_hashes = tuple(data_hashes.get(name) for name in STATUS_INPUT_SHEETS.get(portal, (portal,)))
+                            column_key = (master_key, STATUS_ENGINE, input_hashes, rakuten_key if portal == '楽天' else None)
+                            column = cached_step(run_cache, ('column', portal), column_key, lambda: prepare_portal_column(
+                                portal, master_table, lookup_maps, rakuten_maps, code_dict
+                            ))
+                            status_matrix[:, portal_idx] = cached_step(run_cache, ('status', portal), (column_key, select_date_str), lambda: evaluate_portal_column(
+                                column, portal, select_date_str, lookup_maps, rakuten_maps, code_dict
+                            ))
+                            next_dates[:, portal_idx], next_statuses[:, portal_idx] = cached_step(run_cache, ('next', portal), (column_key, select_date_str), lambda: next_portal_change(
+                                column, portal, select_date_str, lookup_maps, rakuten_maps, code_dict
+                            ))
+                            if batch_date_strs:
+                                status_cube[:, portal_idx, :] = evaluate_portal_column_dates(
+                                    column, portal, batch_date_strs, lookup_maps, rakuten_maps, code_dict
+                                )
 
-                    lookup_maps, parent_lookup_maps = {}, {}
+                        # 取り込まれていないシート・ポータルの結果は破棄する
+                        for name in [name for name in run_cache if isinstance(name, tuple) and name[1] not in full_data]:
+                            del run_cache[name]
 
-                    # --- 楽天ステータス判定用のデータ準備 ---
-                    # ★ 商品管理DB廃止に伴い、memo_map も廃止（空辞書とする）
-                    memo_map = {}
+                        # --- 3. 親行の調整 (コード行列で一括処理) ---
+                        adjust_parent_rows(status_matrix, uploaded_portals, master_table)
+                        # 対象外・空白にしたセルは次回の変更なしとする
+                        no_next_change = (status_matrix == STATUS_NOT_APPLICABLE) | (status_matrix == STATUS_BLANK)
+                        next_dates[no_next_change] = 0
+                        next_statuses[no_next_change] = STATUS_BLANK
+                        for date_idx in range(len(batch_date_strs)):
+                            adjust_parent_rows(status_cube[:, :, date_idx], uploaded_portals, master_table)
 
-                    # 楽天データから各種対応辞書を作成 (ヘッダー名で参照)
-                    rakuten_product_id_map = {} # 商品番号 -> 行データ
-                    rakuten_management_id_map = {} # 商品管理番号（商品URL） -> 行データ
-                    
-                    # 楽天のグループマップ作成 (商品管理番号 -> 行リスト)
-                    rakuten_group_map = {}
-                    
-                    # ソート用のURLマップ（商品番号 -> 商品管理番号）
-                    item_code_to_mgmt_id_map = {}
+                        # 公開中の数 (行ごとの「公開中」のポータル数)
+                        public_counts = (status_matrix == STATUS_PUBLIC).sum(axis=1)
+
+                        # --- 4. チェック判定 ---
+                        # チェック列 (ステータスのコード行列から全行まとめて判定する)
+                        check_values = calculate_check_column(status_matrix, uploaded_portals, is_rakuten_parent_row, is_choice_parent_row)
 
-                    if '楽天' in full_data:
-                        df_rakuten = full_data['楽天']
-                        # robust_read_fileでヘッダー処理済みのため、iloc[1:] は不要
-                        df_rakuten_data = df_rakuten
+                        # 定期便フラグ (サフィックスなしコードの ID が定期便番号の ID に含まれるか)
+                        teiki_bin_ids = code_dict.lookup(list(teiki_bin_codes))
+                        teiki_bin_ids = teiki_bin_ids[teiki_bin_ids != NO_CODE]
+                        teiki_bin_flags = np.where(np.isin(target_ids, teiki_bin_ids), '〇', '×')
+
+                        # --- 5. ソート用の列を作成 ---
+                        # ソート順: ①商品管理番号(URL) -> ②返礼品コード(サフィックスなし) -> ③親コード優先(0:親, 1:子)
+                        target_codes = master_table['target_code']
+
+                        # 1. URL (楽天の商品管理番号)
+                        sort_urls = pd.Series(code_ids).map(item_code_to_mgmt_id_map).fillna('')
+
+                        # ★ チョイスがベースの場合、グループ表から一括で取得したグループIDを使用
+                        # 検索キーはサフィックスなしのコードの ID、表にない場合はコード自体をグループIDとする
+                        if base_portal_name == 'チョイス' and 'choice_group_table' in st.session_state:
+                            choice_group_table = st.session_state.choice_group_table
+                            group_code_ids = choice_group_table['code_id'] if 'code_id' in choice_group_table.columns else code_dict.encode(choice_group_table['code'])
+                            group_id_by_code_id = pd.Series(choice_group_table['group_id'].to_numpy(), index=group_code_ids)
+                            sort_urls = pd.Series(target_ids).map(group_id_by_code_id).fillna(target_codes)
+
+                        # 楽天親コードでマップにない場合は、サフィックスなしで検索する
+                        sort_urls = sort_urls.mask((sort_urls == '') & is_rakuten_parent_row, pd.Series(target_ids).map(item_code_to_mgmt_id_map).fillna(''))
+                        # それでもなければ、返礼品コード自体をグループキーとして代用し、末尾に回す
+                        sort_urls = sort_urls.mask(sort_urls == '', target_codes)
+
+                        if len(master_table):
+                            df_results = pd.DataFrame({
+                                '返礼品コード': master_table['code'],
+                                '返礼品名': master_table['display_name'],
+                                '事業者コード': target_codes.apply(generate_vendor_code),
+                                # 隠しソート列
+                                '_sort_url': sort_urls,
+                                '_sort_code_clean': target_codes,
+                                '_sort_rank': np.where(is_rakuten_parent_row | is_choice_parent_row, 0, 1), # 親判定ランク (0: 親, 1: 子)
+                                # マスターの行番号 (一括判定の結果を並べ替え後の行に対応させる。表示列には含めない)
+                                '_master_row': np.arange(len(master_table))
+                            })
+
+                            # ステータス列はコード行列から Categorical 列として作成する (カテゴリ: STATUS_LABELS)
+                            for portal_idx, portal in enumerate(uploaded_portals):
+                                df_results[portal] = status_categorical(status_matrix[:, portal_idx])
+                            df_results['チェック'] = check_values
+                            df_results['定期便フラグ'] = teiki_bin_flags
+                            df_results['公開中の数'] = public_counts
+
+                            # 次回のステータス変更 (全体はポータルのうち最も早い変更日と、基準日からの日数)
+                            no_date = np.iinfo(np.int64).max
+                            earliest_next_dates = np.where(next_dates > 0, next_dates, no_date).min(axis=1, initial=no_date)
+                            earliest_next_dates = np.where(earliest_next_dates == no_date, 0, earliest_next_dates)
+                            df_results['次回変更日'] = format_date_ints(earliest_next_dates)
+                            days_until_change = (pd.to_datetime(pd.Series(earliest_next_dates).astype(str), format='%Y%m%d', errors='coerce')
+                                                 - pd.to_datetime(select_date_str, format='%Y%m%d')).dt.days
+                            df_results['変更までの日数'] = days_until_change.astype('Int64')
+                            for portal_idx, portal in enumerate(uploaded_portals):
+                                df_results[portal + NEXT_CHANGE_DATE_SUFFIX] = format_date_ints(next_dates[:, portal_idx])
+                                df_results[portal + NEXT_CHANGE_STATUS_SUFFIX] = status_categorical(next_statuses[:, portal_idx])
                         
-                        # ★「商品番号」列のソート -> 行データ
-                        if '商品番号' in df_rakuten_data.columns:
-                            # まず商品番号がある行を抽出
-                            df_rakuten_b = df_rakuten_data.dropna(subset=['商品番号']).copy()
-                            
-                            # --- 分割ソート ---
-
-                            # 1. SKU有無の判定（フラグ作成）
-                            # 「システム連携用SKU番号」に値がある（空文字でない）場合はTrue
-                            if 'システム連携用SKU番号' in df_rakuten_b.columns:
-                                has_sku_mask = (df_rakuten_b['システム連携用SKU番号'].astype(str).str.strip() != '')
+                            # df_business は Gsheetから取得済みのものを使用
+                            if not df_business.empty:
+                                df_business_names = df_business[['事業者コード', '事業者名']]
+                                df_results = pd.merge(df_results, df_business_names, on='事業者コード', how='left')
+                                df_results['事業者名'] = df_results['事業者名'].fillna('')
                             else:
-                                has_sku_mask = pd.Series(False, index=df_rakuten_b.index)
-
-                            # --- ランク計算用ロジック（全行に対して計算だけ行う） ---
-                            # ※計算自体は全行に行うが、ソートに使うのはSKUありの行だけにする
-
-                            # 日付処理用の関数
-                            def _get_date_str(x):
-                                s = str(x).strip()
-                                return re.sub(r'[^0-9]', '', s)[:8]
-
-                            # 列名の定義
-                            col_warehouse = '倉庫指定' if '倉庫指定' in df_rakuten_b.columns else None
-                            col_search = 'サーチ表示' if 'サーチ表示' in df_rakuten_b.columns else None
-                            col_order = '注文ボタン' if '注文ボタン' in df_rakuten_b.columns else None
-                            col_start = '販売期間指定（開始日時）' if '販売期間指定（開始日時）' in df_rakuten_b.columns else None
-                            col_end = '販売期間指定（終了日時）' if '販売期間指定（終了日時）' in df_rakuten_b.columns else None
-                            col_stock = '在庫数' if '在庫数' in df_rakuten_b.columns else None
-                            
-                            current_date_str = TODAY_STR
-
-                            # 【1】「倉庫指定」: '0' が優先 -> 昇順
-                            def _calc_warehouse_rank(x):
-                                if col_warehouse and str(x).strip() == '0': return 0
-                                return 1
-                            df_rakuten_b['p_rank_1'] = df_rakuten_b[col_warehouse].apply(_calc_warehouse_rank) if col_warehouse else 1
-
-                            # 【2】「サーチ表示」: '1' が優先 -> 降順
-                            df_rakuten_b['p_rank_2'] = pd.to_numeric(df_rakuten_b[col_search], errors='coerce').fillna(0) if col_search else 0
-
-                            # 【3】「注文ボタン」: '1' が優先 -> 降順
-                            df_rakuten_b['p_rank_3'] = pd.to_numeric(df_rakuten_b[col_order], errors='coerce').fillna(0) if col_order else 0
-
-                            # 【4】「開始日時」
-                            s_start_dates = df_rakuten_b[col_start].apply(_get_date_str) if col_start else pd.Series('', index=df_rakuten_b.index)
-                            def _calc_start_cat(d):
-                                if not d: return 0      # ① 空
-                                if d <= current_date_str: return 1 # ② 過去
-                                return 2                # ③ 未来
-                            df_rakuten_b['p_rank_4_cat'] = s_start_dates.apply(_calc_start_cat)
-                            df_rakuten_b['p_rank_4_val'] = s_start_dates
-
-                            # 【5】「終了日時」
-                            s_end_dates = df_rakuten_b[col_end].apply(_get_date_str) if col_end else pd.Series('', index=df_rakuten_b.index)
-                            def _calc_end_cat(d):
-                                if not d: return 0      # ① 空
-                                if d >= current_date_str: return 1 # ② 未来
-                                return 2                # ③ 過去
-                            df_rakuten_b['p_rank_5_cat'] = s_end_dates.apply(_calc_end_cat)
-                            df_rakuten_b['p_rank_5_val'] = s_end_dates
-
-                            # 【6】「在庫数」: 多い方が優先 -> 降順
-                            df_rakuten_b['p_rank_6'] = pd.to_numeric(df_rakuten_b[col_stock], errors='coerce').fillna(0) if col_stock else 0
-
-                            # --- データの分割とソート ---
-                            
-                            # SKUありのグループ
-                            df_sku = df_rakuten_b[has_sku_mask].copy()
-                            # SKUなしのグループ (親コード含む)
-                            df_no_sku = df_rakuten_b[~has_sku_mask].copy()
-
-                            # SKUありグループのみ、優先度順にソートする
-                            if not df_sku.empty:
-                                sort_columns = [
-                                    'p_rank_1',     # 【1】倉庫 (0優先 -> 昇順)
-                                    'p_rank_2',     # 【2】サーチ (1優先 -> 降順)
-                                    'p_rank_3',     # 【3】注文 (1優先 -> 降順)
-                                    'p_rank_4_cat', # 【4】開始区分 (空<過去<未来 -> 昇順)
-                                    'p_rank_4_val', # 【4】開始日値 (古い日付優先 -> 昇順)
-                                    'p_rank_5_cat', # 【5】終了区分 (空<未来<過去 -> 昇順)
-                                    'p_rank_5_val', # 【5】終了日値 (新しい日付優先 -> 降順)
-                                    'p_rank_6'      # 【6】在庫 (多い順 -> 降順)
-                                ]
-                                asc_settings = [True, False, False, True, True, True, False, False]
-                                df_sku = df_sku.sort_values(by=sort_columns, ascending=asc_settings)
-                            
-                            # SKUなしグループはソートしない（元のファイル順序を維持）
-                            # 何もしない
-
-                            # 結合（SKUありを上に）
-                            df_rakuten_b = pd.concat([df_sku, df_no_sku])
-
-                            # ★ 重複排除の前に、商品番号を大文字化して同一キーとみなさせる
-                            df_rakuten_b['商品番号'] = df_rakuten_b['商品番号'].astype(str).str.strip().str.upper()
-
-                            # 重複排除 (keep='first'なので、SKUありが優先され、同グループ内ではソート上位/ファイル上位が残る)
-                            # ※ 親コード（楽天親）はコード自体が異なるため、子コード（SKU）とは別物として残る
-                            df_rakuten_b = df_rakuten_b.drop_duplicates(subset=['商品番号'], keep='first')
-                            
-                            # 辞書化
-                            rakuten_product_id_map = {str(row['商品番号']).strip().upper(): row.to_dict() for _, row in df_rakuten_b.iterrows()}
-                            
-                            # ソート用のマップ作成 (商品番号 -> 商品管理番号)
-                            if '商品管理番号（商品URL）' in df_rakuten_b.columns:
-                                item_code_to_mgmt_id_map = {
-                                    str(row['商品番号']).strip().upper(): str(row['商品管理番号（商品URL）']).strip() 
-                                    for _, row in df_rakuten_b.iterrows()
-                                }
+                                df_results['事業者名'] = ''
                         
-                        # A列(商品管理番号（商品URL）) -> 行データ
-                        if '商品管理番号（商品URL）' in df_rakuten_data.columns:
-                            df_rakuten_a = df_rakuten_data.dropna(subset=['商品管理番号（商品URL）']).drop_duplicates(subset=['商品管理番号（商品URL）'], keep='first')
-                            # .upper() に統一
-                            rakuten_management_id_map = {str(row['商品管理番号（商品URL）']).strip().upper(): row.to_dict() for _, row in df_rakuten_a.iterrows()}
-
-                        # グループマップの構築
-                        if '商品管理番号（商品URL）' in df_rakuten_data.columns:
-                            for _, row in df_rakuten_data.iterrows():
-                                mid = str(row['商品管理番号（商品URL）']).strip().upper()
-                                if mid:
-                                    if mid not in rakuten_group_map: rakuten_group_map[mid] = []
-                                    rakuten_group_map[mid].append(row.to_dict())
-                    
-                    # --- 他ポータルのデータ準備 (lookup_maps 作成) ---
-                    for name, df in full_data.items():
-                        key_col = KEY_COLUMN_MAP.get(name)
-                        
-                        if key_col is None:
-                            continue # キー列が未定義のシートはスキップ
+                            # ★ ここから追加：Web表示用データそのものをExcel形式（判定列分離）に合わせる
                         
-                        df_data_only = df # robust_read_fileでヘッダー処理済み
+                            # 1. 楽天親判定列の追加とコードのクリーニング
+                            if '楽天' in uploaded_portals:
+                                # 判定列を初期化
+                                df_results['楽天親判定'] = ''
+                                # サフィックスがある行を特定
+                                mask_rakuten = df_results['返礼品コード'].astype(str).str.endswith('（楽天親）')
+                                # 判定列に「親」を入力
+                                df_results.loc[mask_rakuten, '楽天親判定'] = '親'
+                                # 返礼品コードからサフィックスを除去
+                                df_results['返礼品コード'] = df_results['返礼品コード'].str.replace('（楽天親）', '')
+
+                            # 2. チョイス親判定列の追加とコードのクリーニング
+                            if 'チョイス' in uploaded_portals:
+                                # 判定列を初期化
+                                df_results['チョイス親判定'] = ''
+                                # サフィックスがある行を特定
+                                mask_choice = df_results['返礼品コード'].astype(str).str.endswith('（チョイス親）')
+                                # 判定列に「親」を入力
+                                df_results.loc[mask_choice, 'チョイス親判定'] = '親'
+                                # 返礼品コードからサフィックスを除去
+                                df_results['返礼品コード'] = df_results['返礼品コード'].str.replace('（チョイス親）', '')
+
+                            # 3. 表示用の基本列定義を更新
+                            base_columns = ['返礼品コード']
                         
-                        # --- キー列の型（int or str）で処理を分岐 ---
-                        if isinstance(key_col, int):
-                            # (チョイス系: インデックス番号で参照)
-                            if df.shape[1] <= key_col:
-                                st.error(f"ファイル '{name}' の列数が不足しています。キー列 {key_col} が存在しません。")
-                                continue
+                            # uploaded_portals の順序に基づいて判定列を追加
+                            for p in uploaded_portals:
+                                if p == 'チョイス':
+                                    base_columns.append('チョイス親判定')
+                                elif p == '楽天':
+                                    base_columns.append('楽天親判定')
                                 
-                            df_cleaned = df_data_only.dropna(subset=[key_col]).copy()
-                            # BOM等の除去、.0除去、空白除去
-                            # .str.upper() に統一
-                            df_cleaned['key_col_str'] = df_cleaned[key_col].astype(str).str.replace('\ufeff', '', regex=False).str.replace(r'\.0$', '', regex=True).str.strip().str.upper()
-                            df_cleaned = df_cleaned[df_cleaned['key_col_str'] != '']
-                            
-                            unique_data = df_cleaned.drop_duplicates(subset=['key_col_str'], keep='first')
-                            # キーがインデックス番号(0, 1...)の辞書を作成
-                            lookup_maps[name] = {row['key_col_str']: row.to_dict() for _, row in unique_data.iterrows()}
-
-                        elif isinstance(key_col, str):
-                            # (その他: ヘッダー名で参照)
-                            if key_col not in df.columns:
-                                st.error(f"ファイル '{name}' に必要なヘッダー '{key_col}' が見つかりません。")
-                                continue
-                            
-                            df_cleaned = df_data_only.dropna(subset=[key_col]).copy()
-                            
-                            # BOM等の除去、.0除去、空白除去
-                            # すべて .str.upper() に統一
-                            df_cleaned['key_col_str'] = df_cleaned[key_col].astype(str).str.replace('\ufeff', '', regex=False).str.replace(r'\.0$', '', regex=True).str.strip().str.upper()
-                            df_cleaned = df_cleaned[df_cleaned['key_col_str'] != '']
-                            
-                            unique_data = df_cleaned.drop_duplicates(subset=['key_col_str'], keep='first')
-                            # キーがヘッダー名('商品番号', '商品名'...)の辞書を作成
-                            lookup_maps[name] = {row['key_col_str']: row.to_dict() for _, row in unique_data.iterrows()}
-
-                    results_data = []
-                    uploaded_portals = [p for p in PORTAL_ORDER if p in full_data]
-
-                    for code, name in master_items.items():
+                            base_columns.extend(['返礼品名', '事業者コード', '事業者名'])
+                            base_portal_column_list = [base_portal_name] if base_portal_name in df_results.columns else []
+                            other_portal_columns = [
+                                p for p in PORTAL_ORDER 
+                                if p in df_results.columns and p != base_portal_name
+                            ]
+                            utility_columns = ['チェック', '定期便フラグ', '公開中の数']
+                            # 次回のステータス変更の列 (ポータルの列と同じ順序)
+                            next_change_display_columns = NEXT_CHANGE_COLUMNS + [
+                                p + suffix for p in base_portal_column_list + other_portal_columns
+                                for suffix in (NEXT_CHANGE_DATE_SUFFIX, NEXT_CHANGE_STATUS_SUFFIX)
+                            ]
+                            # ソート用カラムを保持
+                            sort_columns = ['_sort_url', '_sort_code_clean', '_sort_rank']
                         
-                        # 親コード判定と名称処理
-                        is_rakuten_parent = code.endswith('（楽天親）')
-                        is_choice_parent = code.endswith('（チョイス親）') # ★ チョイス親フラグ
+                            display_columns = base_columns + base_portal_column_list + other_portal_columns + utility_columns + next_change_display_columns + sort_columns
+                            final_display_columns = [col for col in display_columns if col in df_results.columns]
                         
-                        target_code_for_name = code
-                        if is_rakuten_parent: target_code_for_name = code.replace('（楽天親）', '')
-                        if is_choice_parent: target_code_for_name = code.replace('（チョイス親）', '') # ★ 除去
+                            # ソート順序の適用
+                            # URL(Asc) -> Code(Asc) -> Parent(Asc:0->1)
+                            df_results = df_results.sort_values(by=['_sort_url', '_sort_code_clean', '_sort_rank'], ascending=[True, True, True])
                         
-                        # 親コードの場合、名称を再取得（接尾辞なしのコードで）
-                        display_name = name
-                        if is_rakuten_parent or is_choice_parent:
-                            # マスターアイテムに接尾辞なしのコードがあればその名前を使う
-                            if target_code_for_name in master_items and master_items[target_code_for_name]:
-                                display_name = master_items[target_code_for_name]
-                            # なければ、元データから名称を取得を試みる
-                            else:
-                                p_source = '楽天' if is_rakuten_parent else 'チョイス'
-                                if p_source in lookup_maps and code in lookup_maps[p_source]:
-                                    nm_col = PORTAL_NAME_COLUMN_MAP[p_source]
-                                    # チョイスはint, 楽天はstr
-                                    if isinstance(nm_col, int):
-                                        display_name = lookup_maps[p_source][code].get(nm_col, '')
-                                    else:
-                                        display_name = lookup_maps[p_source][code].get(nm_col, '')
-
-                        # ★「子行」がデータ内に存在するかチェック
-                        child_exists_exact_match = False
-                        if is_rakuten_parent and '楽天' in lookup_maps and target_code_for_name in lookup_maps['楽天']:
-                            child_exists_exact_match = True
-                        # ★ チョイスも同様にチェック (リネームされているので、元のIDがマップにあるかどうか)
-                        # ただし、チョイスの場合は「子優先」なので、ここで子がいる＝親行は計算スキップ、というロジックは使わない（検索時に切り替えるため）
-
-                        statuses = {}
-                        for portal in uploaded_portals:
-                            
-                            # 検索に使うコードを決定
-                            lookup_code = code
-                            skip_calculation = False
-
-                            if is_rakuten_parent:
-                                if portal == '楽天':
-                                    lookup_code = code # 親はそのまま（楽天親）で検索
-                                else:
-                                    # 楽天以外のポータル
-                                    if child_exists_exact_match:
-                                        # 子行が存在する場合 -> 親行の結果は空白にする (子行側に出るため)
-                                        skip_calculation = True
-                                    else:
-                                        # 子行が存在しない場合 -> 親行に結果を表示する (サフィックスなしで検索)
-                                        lookup_code = target_code_for_name
-                            
-                            # ★ チョイス親の場合の検索ロジック
-                            elif is_choice_parent:
-                                if portal == 'チョイス':
-                                    lookup_code = code # 自分自身は親コードで検索
-                                else:
-                                    # 他ポータル検索時は、サフィックスなしで検索
-                                    lookup_code = target_code_for_name
-                            
-                            # ★ 通常コード(または他ポータルの親)からチョイスを検索する場合のロジック
-                            # 「子もAYG055の時は、子のステータスを優先」
-                            if portal == 'チョイス' and not is_choice_parent:
-                                # まずそのままのコード(子)で検索
-                                if code in lookup_maps.get('チョイス', {}):
-                                    lookup_code = code
-                                else:
-                                    # なければ親コードを試す
-                                    lookup_code = code + '（チョイス親）'
-
-                            if skip_calculation:
-                                statuses[portal] = ''
-                            else:
-                                statuses[portal] = calculate_status(
-                                    portal, lookup_code, lookup_maps, parent_lookup_maps,
-                                    
-                                    # 基準日(文字列)をキーワード引数として渡す
-                                    select_date_str=select_date_str,
-                                    
-                                    # 楽天用の辞書をキーワード引数として渡す
-                                    memo_map=memo_map,
-                                    rakuten_product_id_map=rakuten_product_id_map,
-                                    rakuten_management_id_map=rakuten_management_id_map,
-                                    
-                                    # 楽天のグループマップを渡す
-                                    rakuten_group_map=rakuten_group_map
+                            # ソート用カラムを削除してセッションステートに保存
+                            st.session_state.results_df = df_results.drop(columns=sort_columns).reindex(columns=[c for c in final_display_columns if c not in sort_columns])
+
+                            # 複数日付の一括判定: 基準日ごとの結果の表と、縦持ちの表を作成する
+                            if batch_date_strs:
+                                batch_sheets = build_batch_sheets(
+                                    st.session_state.results_df, df_results['_master_row'].to_numpy(), status_cube,
+                                    uploaded_portals, master_table, batch_date_strs
                                 )
-                            
-                            # ★ 親行における他ポータル検索結果の調整
-                            if (is_choice_parent and portal != 'チョイス') or (is_rakuten_parent and portal != '楽天'):
-                                # 子行（サフィックスなし）が一覧（master_items）に存在する場合は、
-                                # 親行側で他ポータルのステータスを表示すると重複するため '-' とする
-                                if target_code_for_name in master_items:
-                                    statuses[portal] = '-'
-                                # 検索結果が「未登録」の場合も '-' とする（ベースポータル由来ではないため）
-                                elif statuses[portal] == '未登録':
-                                    statuses[portal] = '-'
-
-                        status_values = list(statuses.values())
-                        
-                        # --- チェックロジック ---
-                        unique_statuses = set(status_values)
-                        
-                        # 「非表示」「在庫0」「受付終了」「倉庫」「注文不可」を「グレーゾーン」と定義
-                        # ★ '-' (対象外) もグレーゾーンに含める (チェック対象外にするため)
-                        allowed_gray_statuses = {'非表示', '在庫0', '受付終了', '倉庫', '注文不可', '-'}
-                        
-                        # グレーゾーン以外のステータス（公開中、未登録など）を抽出
-                        # 空白（親コードの他ポータル分）は無視する
-                        main_statuses = {s for s in unique_statuses if s not in allowed_gray_statuses and s != ''}
+                                st.session_state.batch_sheets = batch_sheets
+                                st.session_state.batch_long_df = build_batch_long_form(batch_sheets, uploaded_portals)
                         
-                        # グレーゾーンのステータスを抽出
-                        gray_statuses = unique_statuses.intersection(allowed_gray_statuses)
-                        
-                        check_val = "OK" # デフォルトをOKに設定
-                        
-                        # [New Logic] 1ファイルのみインポート時のチェック（ポータル問わず共通）
-                        if len(uploaded_portals) == 1:
-                            # 1ファイルのみの場合は、そのポータルが「公開中」なら「公開」、それ以外は「要確認」
-                            if '公開中' in status_values:
-                                check_val = '公開'
-                            else:
-                                check_val = '要確認'
+                            # ログ用に表示できたポータル一覧を取得
+                            log_displayed_portals = uploaded_portals
+
+                            # ログ書き込み (成功時) 
+                            # ★以下コメントアウトして無効化
+                            # write_log(
+                            #      service=sheets_service,
+                            #      log_spreadsheet_id=LOG_GSHEET_KEY,
+                            #      user_name=log_user_name,
+                            #      imported_files=log_imported_files,
+                            #      base_portal=selected_base_portal,
+                            #      base_date=select_date_str,
+                            #      displayed_portals=log_displayed_portals,
+                            #      error_msg=""
+                            # )
 
-                        # [Existing Logic] 複数ファイルインポート時のチェック
-                        else:
-                            # ★特例判定フラグ
-                            apply_special_rule = False
-
-                            # ★ヘルパー関数: 対象ポータル以外が全て「-」または「空」かチェックする
-                            def is_single_portal_row(target_name):
-                                for p in uploaded_portals:
-                                    if p == target_name: continue
-                                    val = statuses.get(p, '')
-                                    # 「-」でも「空」でもない値がある ＝ 他ポータルのステータスが存在する
-                                    if val != '-' and val != '':
-                                        return False
-                                return True
-
-                            # 1. 楽天親の特例判定
-                            # (楽天親行で、かつ他ポータルが全てハイフンの場合)
-                            if is_rakuten_parent and is_single_portal_row('楽天'):
-                                apply_special_rule = True
-                                if statuses.get('楽天') == '公開中':
-                                    check_val = 'OK'
-                                else:
-                                    check_val = '要確認'
-
-                            # 2. チョイス親の特例判定
-                            # (チョイス親行で、かつ他ポータルが全てハイフンの場合)
-                            elif is_choice_parent and is_single_portal_row('チョイス'):
-                                apply_special_rule = True
-                                if statuses.get('チョイス') == '公開中':
-                                    check_val = 'OK'
-                                else:
-                                    check_val = '要確認'
-
-                            # 3. 通常判定 (特例に当てはまらない場合)
-                            if not apply_special_rule:
-                                # パターン1: グレーゾーン以外のステータスが2種類以上ある場合 (例: '公開中'と'未登録')
-                                if len(main_statuses) >= 2:
-                                    check_val = "要確認"
-                                # パターン2: グレーゾーン以外のステータスが1種類あり、かつグレーゾーンのステータスも1種類以上ある場合 (例: '公開中'と'在庫0')
-                                elif len(main_statuses) == 1 and len(gray_statuses) >= 1:
-                                    check_val = "要確認"
-                        
-                        # 複数ポータルの場合で、判定がOKの場合の文言書き換え
-                        if check_val == "OK" and len(uploaded_portals) > 1:
-                            
-                            # 1. 「公開中」が含まれている場合 -> 公開
-                            # (通常判定で全員公開中の場合、または特例で親が公開中の場合)
-                            if '公開中' in unique_statuses:
-                                check_val = "公開"
-                            
-                            # 2. アクティブなステータス(公開中、未登録など)がなく、グレーゾーンのみの場合 -> 非表示
-                            # (main_statusesはアクティブなものを抽出した集合)
-                            elif len(main_statuses) == 0 and len(gray_statuses) > 0:
-                                check_val = "非公開"
-
-                        public_count = sum(1 for s in status_values if s == '公開中')
-                        
-                        teiki_bin_flag = '〇' if target_code_for_name in teiki_bin_codes else '×'
-                        
-                        # ソート用のデータを収集
-                        # ソート順: ①商品管理番号(URL) -> ②返礼品コード(サフィックスなし) -> ③親コード優先(0:親, 1:子)
-                        
-                        # 1. URL取得
-                        mgmt_id = item_code_to_mgmt_id_map.get(code, '')
-                        
-                        # ★ チョイスがベースの場合、グループマップを使用
-                        if base_portal_name == 'チョイス' and 'choice_group_map' in st.session_state:
-                            # 検索キーは target_code_for_name (サフィックスなし) を使用
-                            mgmt_id = st.session_state.choice_group_map.get(target_code_for_name, target_code_for_name)
-
-                        if not mgmt_id:
-                            if is_rakuten_parent:
-                                 # 親コードでマップにない場合、サフィックスなしで検索トライ
-                                 mgmt_id = item_code_to_mgmt_id_map.get(target_code_for_name, '')
-                            # それでもなければ、返礼品コード自体をグループキーとして代用し、末尾に回す
-                            if not mgmt_id:
-                                mgmt_id = target_code_for_name
-
-                        # 2. 親判定ランク (0: 親, 1: 子)
-                        rank_val = 0 if (is_rakuten_parent or is_choice_parent) else 1
-
-                        result_row = {
-                            '返礼品コード': code, 
-                            '返礼品名': display_name, 
-                            '事業者コード': generate_vendor_code(target_code_for_name), 
-                            **statuses,
-                            'チェック': check_val, 
-                            '定期便フラグ': teiki_bin_flag, 
-                            '公開中の数': public_count,
-                            # 隠しソート列
-                            '_sort_url': mgmt_id,
-                            '_sort_code_clean': target_code_for_name,
-                            '_sort_rank': rank_val
-                        }
-                        results_data.append(result_row)
-                    
-                    if results_data:
-                        df_results = pd.DataFrame(results_data)
-                        
-                        # df_business は Gsheetから取得済みのものを使用
-                        if not df_business.empty:
-                            df_business_names = df_business[['事業者コード', '事業者名']]
-                            df_results = pd.merge(df_results, df_business_names, on='事業者コード', how='left')
-                            df_results['事業者名'] = df_results['事業者名'].fillna('')
                         else:
-                            df_results['事業者名'] = ''
-                        
-                        # ★ ここから追加：Web表示用データそのものをExcel形式（判定列分離）に合わせる
-                        
-                        # 1. 楽天親判定列の追加とコードのクリーニング
-                        if '楽天' in uploaded_portals:
-                            # 判定列を初期化
-                            df_results['楽天親判定'] = ''
-                            # サフィックスがある行を特定
-                            mask_rakuten = df_results['返礼品コード'].astype(str).str.endswith('（楽天親）')
-                            # 判定列に「親」を入力
-                            df_results.loc[mask_rakuten, '楽天親判定'] = '親'
-                            # 返礼品コードからサフィックスを除去
-                            df_results['返礼品コード'] = df_results['返礼品コード'].str.replace('（楽天親）', '')
-
-                        # 2. チョイス親判定列の追加とコードのクリーニング
-                        if 'チョイス' in uploaded_portals:
-                            # 判定列を初期化
-                            df_results['チョイス親判定'] = ''
-                            # サフィックスがある行を特定
-                            mask_choice = df_results['返礼品コード'].astype(str).str.endswith('（チョイス親）')
-                            # 判定列に「親」を入力
-                            df_results.loc[mask_choice, 'チョイス親判定'] = '親'
-                            # 返礼品コードからサフィックスを除去
-                            df_results['返礼品コード'] = df_results['返礼品コード'].str.replace('（チョイス親）', '')
-
-                        # 3. 表示用の基本列定義を更新
-                        base_columns = ['返礼品コード']
-                        
-                        # uploaded_portals の順序に基づいて判定列を追加
-                        for p in uploaded_portals:
-                            if p == 'チョイス':
-                                base_columns.append('チョイス親判定')
-                            elif p == '楽天':
-                                base_columns.append('楽天親判定')
-                                
-                        base_columns.extend(['返礼品名', '事業者コード', '事業者名'])
-                        base_portal_column_list = [base_portal_name] if base_portal_name in df_results.columns else []
-                        other_portal_columns = [
-                            p for p in PORTAL_ORDER 
-                            if p in df_results.columns and p != base_portal_name
-                        ]
-                        utility_columns = ['チェック', '定期便フラグ', '公開中の数']
-                        # ソート用カラムを保持
-                        sort_columns = ['_sort_url', '_sort_code_clean', '_sort_rank']
-                        
-                        display_columns = base_columns + base_portal_column_list + other_portal_columns + utility_columns + sort_columns
-                        final_display_columns = [col for col in display_columns if col in df_results.columns]
-                        
-                        # ソート順序の適用
-                        # URL(Asc) -> Code(Asc) -> Parent(Asc:0->1)
-                        df_results = df_results.sort_values(by=['_sort_url', '_sort_code_clean', '_sort_rank'], ascending=[True, True, True])
-                        
-                        # ソート用カラムを削除してセッションステートに保存
-                        st.session_state.results_df = df_results.drop(columns=sort_columns).reindex(columns=[c for c in final_display_columns if c not in sort_columns])
-                        
-                        # ログ用に表示できたポータル一覧を取得
-                        log_displayed_portals = uploaded_portals
-
-                        # ログ書き込み (成功時) 
-                        # ★以下コメントアウトして無効化
-                        # write_log(
-                        #      service=sheets_service,
-                        #      log_spreadsheet_id=LOG_GSHEET_KEY,
-                        #      user_name=log_user_name,
-                        #      imported_files=log_imported_files,
-                        #      base_portal=selected_base_portal,
-                        #      base_date=select_date_str,
-                        #      displayed_portals=log_displayed_portals,
-                        #      error_msg=""
-                        # )
+                            st.session_state.results_df = pd.DataFrame()
 
-                    else:
-                        st.session_state.results_df = pd.DataFrame()
+                        # 結果をキャッシュに保存する
+                        if result_key:
+                            result_cache.put(result_key, st.session_state.results_df, {'displayed_portals': log_displayed_portals})
                     
                 except Exception as e:
                     error_msg = str(e)
@@ -1644,9 +2006,9 @@ else:
             # 1. もう使わない大きな変数を明示的に削除 (メモリ上の参照を切る)
             # ※ locals() にある場合のみ削除する安全策
             vars_to_delete = [
-                'full_data', 'master_items', 'lookup_maps', 'parent_lookup_maps',
-                'rakuten_product_id_map', 'rakuten_management_id_map', 'rakuten_group_map',
-                'df_base', 'df_business', 'teiki_bin_codes', 'df_results', 'item_code_to_mgmt_id_map'
+                'full_data', 'run_cache', 'lookup_maps', 'rakuten_maps',
+                'master_table', 'status_matrix', 'status_cube', 'batch_sheets', 'next_dates', 'next_statuses', 'sort_urls',
+                'df_business', 'teiki_bin_codes', 'teiki_bin_ids', 'df_results', 'item_code_to_mgmt_id_map'
             ]
             
             for var_name in vars_to_delete:
@@ -1726,6 +2088,11 @@ else:
         if st.session_state.f_teiki != "すべて":
             mask_teiki = df_source['定期便フラグ'] == st.session_state.f_teiki
 
+        # (6) 次回のステータス変更マスク (基準日から N 日以内にステータスが変わる行)
+        mask_change = pd.Series(True, index=df_source.index)
+        if st.session_state.f_change_days and '変更までの日数' in df_source.columns:
+            mask_change = (df_source['変更までの日数'] <= st.session_state.f_change_days).fillna(False).astype(bool)
+
         # --- 2. 各フィルターの選択肢を生成 ---
 
         # 返礼品コードの選択肢 (全量から作成)
@@ -1776,6 +2143,8 @@ else:
         def update_f_vendor(): st.session_state.f_vendor = st.session_state.w_vendor
         def update_f_check(): st.session_state.f_check = st.session_state.w_check
         def update_f_teiki(): st.session_state.f_teiki = st.session_state.w_teiki
+        def update_f_change_days(): st.session_state.f_change_days = st.session_state.w_change_days
+        def update_f_show_next_change(): st.session_state.f_show_next_change = st.session_state.w_show_next_change
 
         filter_cols = st.columns(5)
 
@@ -1852,6 +2221,28 @@ else:
                 key="w_teiki",
                 on_change=update_f_teiki
             )
+
+        # 次回のステータス変更 (N日以内に変更がある行のみ、変更日の近い順に表示)
+        change_cols = st.columns([1, 2, 2])
+        with change_cols[0]:
+            st.number_input(
+                "N日以内に変更:",
+                min_value=0,
+                value=st.session_state.f_change_days,
+                step=1,
+                key="w_change_days",
+                on_change=update_f_change_days,
+                help="基準日から指定した日数以内にステータスが変わる行のみを、変更日の近い順に表示します (0 はすべて)。"
+            )
+        with change_cols[1]:
+            st.write("")
+            st.checkbox(
+                "次回変更日の列を表示",
+                value=st.session_state.f_show_next_change,
+                key="w_show_next_change",
+                on_change=update_f_show_next_change,
+                help="ポータルごとに、次にステータスが変わる日と変更後のステータスの列を表示します。"
+            )
         
         # --- コード一括設定ツール ---
         with st.expander("コード一括設定"):
@@ -1883,7 +2274,12 @@ else:
         
         # --- 4. 最終的な表示データの作成 ---
         # すべてのマスクを適用して絞り込む
-        df_to_display = df_source[mask_search & mask_item & mask_vendor & mask_check & mask_teiki]
+        df_to_display = df_source[mask_search & mask_item & mask_vendor & mask_check & mask_teiki & mask_change]
+        if st.session_state.f_change_days and '変更までの日数' in df_to_display.columns:
+            df_to_display = df_to_display.sort_values('変更までの日数', kind='stable')
+        if not st.session_state.f_show_next_change:
+            # 次回のステータス変更の列は表示しない (エクスポートも表示中の列のみ)
+            df_to_display = df_to_display.drop(columns=next_change_columns(df_to_display))
 
         # --- ページネーション設定 (★ DataFrame描画前に計算処理を移動 ★) ---
         # 1ページあたりの表示件数
@@ -1961,13 +2357,13 @@ else:
 
         # --- to_excel 関数 ---
         def to_excel(df):
-            # ★ エクスポート用にデータを加工
-            df_processed = prepare_df_for_export(df)
-            
+            return to_excel_sheets({'Sheet1': df})
+
+        def to_excel_sheets(sheets):
+            """シート名 -> DataFrame の辞書を、1シート1表の Excel ファイル (書式つき) に変換する"""
             output = BytesIO()
             # XlsxWriter をエンジンとして指定
             with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                sheet_name = 'Sheet1'
                 workbook = writer.book
                 
                 # --- 1. 書式(フォーマット)の定義 ---
@@ -1993,79 +2389,74 @@ else:
                         'font_color': font_color
                     })
                 
-                # --- 2. DataFrameをExcelに書き込む (データのみ) ---
-                # to_excelでデータのみ書き込む (ヘッダーは後で手動描画)
-                df_processed.to_excel(writer, sheet_name=sheet_name, index=False, header=False, startrow=1)
-                
-                # ワークシートオブジェクトを取得
-                worksheet = writer.sheets[sheet_name]
+                for sheet_name, df in sheets.items():
+                    # ★ エクスポート用にデータを加工
+                    df_processed = prepare_df_for_export(df)
 
-                # --- 3. ヘッダーを手動で書き込む (書式適用のため) ---
-                for col_num, value in enumerate(df_processed.columns.values):
-                    worksheet.write(0, col_num, value, header_format)
+                    # --- 2. ヘッダーを書き込む (書式適用のため) ---
+                    worksheet = workbook.add_worksheet(sheet_name)
+                    worksheet.write_row(0, 0, [str(col) for col in df_processed.columns], header_format)
 
-                # --- 4. データセルに書式を適用 ---
-                # (to_excelはデフォルト書式しか適用できないため、色付けのために上書き)
-                
-                # PORTAL_ORDER は L.263 付近で定義済み
-                portal_cols = [p for p in PORTAL_ORDER if p in df_processed.columns]
-                check_col_name = 'チェック'
-                
-                # データ行をイテレート
-                for row_num in range(len(df_processed)):
-                    # データ行の開始は1行目 (0行目はヘッダー)
-                    excel_row_idx = row_num + 1 
-                    
-                    # カラムをイテレート
+                    # --- 3. データを列ごとに一括で書き込む ---
+                    # セルには書式を付けず、列の書式 (5. で設定するデフォルト書式) を適用する
                     for col_num, col_name in enumerate(df_processed.columns):
-                        value = df_processed.iloc[row_num, col_num]
-                        
-                        # デフォルト書式をまず適用
-                        cell_format = default_format
-                        
-                        # 色付け対象列か判定
-                        if col_name in portal_cols and value in color_formats:
-                            cell_format = color_formats.get(value, default_format)
-                        elif col_name == check_col_name and value == '要確認':
-                            cell_format = color_formats.get('要確認', default_format)
-                        
-                        # セルに値と書式を書き込む
-                        # (to_excelで既に書かれた値を上書き)
-                        worksheet.write(excel_row_idx, col_num, value, cell_format)
-
-                # --- 5. 列幅を自動調整 ---
-                # DataFrameの列名とインデックス番号の辞書を作成
-                col_indices = {col_name: i for i, col_name in enumerate(df_processed.columns)}
-
-                # PORTAL_ORDER は L.263 付近で定義済み
-                portal_cols = [p for p in PORTAL_ORDER if p in col_indices]
-                utility_cols = ['チェック', '定期便フラグ', '公開中の数']
-
-                # デフォルト幅
-                default_width = 13 # (ステータス列やコードなど)
-
-                # 列ごとに幅を設定
-                for col_name, col_idx in col_indices.items():
-                    width = default_width # デフォルト幅をセット
+                        column = df_processed[col_name]
+                        # 欠損値 (変更までの日数など) は空欄にする
+                        worksheet.write_column(1, col_num, column.astype(object).where(column.notna(), None).tolist())
+
+                    # --- 4. ステータス列・チェック列の色付け (条件付き書式) ---
+                    # ステータス列はコード表の番号から列に出現するステータスを求め、ステータスごとに1つの条件付き書式を設定する
+                    last_row = len(df_processed)
+                    if last_row > 0:
+                        # PORTAL_ORDER は L.263 付近で定義済み
+                        portal_cols = [p for p in PORTAL_ORDER if p in df_processed.columns]
+                        for col_name in portal_cols:
+                            col_num = df_processed.columns.get_loc(col_name)
+                            for code in np.unique(encode_statuses(df_processed[col_name])):
+                                label = STATUS_LABELS[code]
+                                if label in color_formats:
+                                    worksheet.conditional_format(1, col_num, last_row, col_num, {
+                                        'type': 'cell', 'criteria': '==', 'value': f'"{label}"', 'format': color_formats[label]
+                                    })
+                        if 'チェック' in df_processed.columns:
+                            col_num = df_processed.columns.get_loc('チェック')
+                            worksheet.conditional_format(1, col_num, last_row, col_num, {
+                                'type': 'cell', 'criteria': '==', 'value': '"要確認"', 'format': color_formats['要確認']
+                            })
+
+                    # --- 5. 列幅を自動調整 ---
+                    # DataFrameの列名とインデックス番号の辞書を作成
+                    col_indices = {col_name: i for i, col_name in enumerate(df_processed.columns)}
+
+                    # PORTAL_ORDER は L.263 付近で定義済み
+                    portal_cols = [p for p in PORTAL_ORDER if p in col_indices]
+                    utility_cols = ['チェック', '定期便フラグ', '公開中の数']
+
+                    # デフォルト幅
+                    default_width = 13 # (ステータス列やコードなど)
+
+                    # 列ごとに幅を設定
+                    for col_name, col_idx in col_indices.items():
+                        width = default_width # デフォルト幅をセット
                     
-                    if col_name == '返礼品名':
-                        # ★ 返礼品名を 60 に設定 (現在の約2/3を想定)
-                        width = 60 
-                    elif col_name == '事業者名':
-                        # ★ 事業者名を 25 に設定 (少し広げる)
-                        width = 25 
-                    elif col_name == '事業者コード':
-                        width = 15 # 事業者コードは少し広め
-                    elif col_name == '楽天親判定': # ★追加された列
-                        width = 10
-                    elif col_name == 'チョイス親判定': # ★追加された列
-                        width = 12
-                    elif col_name not in portal_cols and col_name not in utility_cols:
-                        # ステータス列以外 (返礼品コードなど)
-                        width = 15 
+                        if col_name == '返礼品名':
+                            # ★ 返礼品名を 60 に設定 (現在の約2/3を想定)
+                            width = 60 
+                        elif col_name == '事業者名':
+                            # ★ 事業者名を 25 に設定 (少し広げる)
+                            width = 25 
+                        elif col_name == '事業者コード':
+                            width = 15 # 事業者コードは少し広め
+                        elif col_name == '楽天親判定': # ★追加された列
+                            width = 10
+                        elif col_name == 'チョイス親判定': # ★追加された列
+                            width = 12
+                        elif col_name not in portal_cols and col_name not in utility_cols:
+                            # ステータス列以外 (返礼品コードなど)
+                            width = 15 
                     
-                    # set_column(first_col, last_col, width)
-                    worksheet.set_column(col_idx, col_idx, width)
+                        # set_column(first_col, last_col, width, 列の書式)
+                        worksheet.set_column(col_idx, col_idx, width, default_format)
                 
             # writer.close() は with ブロックが自動で処理
             return output.getvalue()
@@ -2136,10 +2527,13 @@ else:
                      '非表示': 'background-color: #6c757d; color: white;', '在庫0': 'background-color: #6c757d; color: white;', '倉庫': 'background-color: #6c757d; color: white;',
                      '注文不可': 'background-color: #6c757d; color: white;', '未受付': 'background-color: #ffc107; color: black;', '-': 'background-color: white; color: #333333;'}
         
+        # ステータスのコード表の番号 -> スタイル
+        status_styles = np.array([color_map.get(label, '') for label in STATUS_LABELS], dtype=object)
+        
         def style_dataframe(df):
             style = pd.DataFrame('', index=df.index, columns=df.columns)
             portal_cols = [p for p in PORTAL_ORDER if p in df.columns]
-            for col in portal_cols: style[col] = df[col].map(color_map).fillna('')
+            for col in portal_cols: style[col] = status_styles[encode_statuses(df[col])]
             if 'チェック' in df.columns: style['チェック'] = df['チェック'].apply(lambda x: 'background-color: #fa6c78; color: black;' if x == '要確認' else '')
             return style
 
@@ -2223,6 +2617,41 @@ else:
                     unsafe_allow_html=True
                 )
 
+        # --- 複数日付の一括判定の結果 ---
+        # 縦持ちの表 (返礼品コード × ポータル × 基準日) と、基準日ごとに1シートの Excel を保存できる (フィルターは適用しない)
+        @st.cache_data
+        def batch_to_excel(sheets):
+            return to_excel_sheets({f"{d[:4]}-{d[4:6]}-{d[6:]}": df for d, df in sheets.items()})
+
+        batch_sheets = st.session_state.get('batch_sheets')
+        if batch_sheets:
+            batch_long_df = st.session_state.batch_long_df
+            batch_date_list = list(batch_sheets)
+            with st.expander(f"複数日付の一括判定 ({len(batch_date_list)}日付: {batch_date_list[0]} 〜 {batch_date_list[-1]})"):
+                st.dataframe(batch_long_df, hide_index=True, width='stretch')
+
+                base_portal_for_name = st.session_state.get('current_base_portal', 'N/A')
+                batch_name = f"掲載状況データ_{TODAY_STR}（target_{base_portal_for_name}_{batch_date_list[0]}-{batch_date_list[-1]}）"
+                batch_excel_col, batch_csv_col, _ = st.columns([2, 2, 6], gap="small")
+                with batch_excel_col:
+                    st.download_button(
+                        label="Excel保存 (基準日ごと)",
+                        data=batch_to_excel(batch_sheets),
+                        file_name=f"{batch_name}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key="batch_excel_download",
+                        width='stretch'
+                    )
+                with batch_csv_col:
+                    st.download_button(
+                        label="CSV保存 (縦持ち)",
+                        data=to_csv(batch_long_df),
+                        file_name=f"{batch_name}.csv",
+                        mime="text/csv",
+                        key="batch_csv_download",
+                        width='stretch'
+                    )
+
         st.markdown("---")
         
         # リセットボタンの確認ダイアログ
@@ -2245,8 +2674,12 @@ else:
                     keys_to_clear = [
                         'results_df', 'dataframes', 'choice_stock_processed', 'rakuten_merged',
                         'current_select_date_str', 'current_base_portal',
-                        'f_search', 'f_vendor', 'f_item_code', 'f_check', 'f_teiki', # ★ フィルター設定もクリア
-                        'choice_group_map' # ★ チョイスのグループ情報
+                        'f_search', 'f_vendor', 'f_item_code', 'f_check', 'f_teiki', 'f_change_days', 'f_show_next_change', # ★ フィルター設定もクリア
+                        'choice_group_table', # ★ チョイスのグループ情報
+                        'code_dict', # 返礼品コードの辞書 (IDはインポートしたデータと対応するためクリア)
+                        'file_read_info',
+                        'data_hashes', 'run_cache', # 基準日以外の処理結果 (再利用判定用のハッシュを含む)
+                        'batch_sheets', 'batch_long_df' # 複数日付の一括判定の結果
                     ]
                     for key in keys_to_clear:
                         if key in st.session_state:
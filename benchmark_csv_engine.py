@@ -0,0 +1,107 @@
+"""
+CSVパースエンジンのベンチマーク (C パーサー / pyarrow)
+
+大きな楽天・チョイス形式の合成CSVを作成し、file_reader の読み込み処理を
+エンジン別・列の絞り込み有無別に計測する。両エンジンの結果が一致することも確認する。
+
+使い方:
+    python benchmark_csv_engine.py [--rows 200000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+
+from file_reader import detect_encoding, parse_csv_text, CSV_ENGINE_C, CSV_ENGINE_PYARROW
+
+RAKUTEN_COLUMNS = [
+    "商品管理番号（商品URL）", "商品番号", "商品名", "倉庫指定",
+    "サーチ表示", "販売期間指定（開始日時）", "販売期間指定（終了日時）",
+    "注文ボタン", "SKU管理番号", "システム連携用SKU番号",
+    "在庫数", "SKU倉庫指定"
+] + [f"項目{i}" for i in range(40)] # 判定に使用しない列
+
+# app.py の列の絞り込み (get_usecols) と同じ列
+RAKUTEN_PROJECTION = set(RAKUTEN_COLUMNS[:12])
+CHOICE_PROJECTION = {0, 1, 2, 97, 98, 99, 100, 102}
+CHOICE_N_COLS = 110
+
+
+def make_rakuten_csv(n_rows, rng):
+    """楽天形式 (ヘッダーあり・cp932) の合成データを作成する"""
+    lines = [','.join(RAKUTEN_COLUMNS)]
+    row_idx = 0
+    while row_idx < n_rows:
+        url = f"abcd{row_idx:07d}"
+        group_size = rng.choice([1, 2, 3, 4])
+        for i in range(group_size):
+            first = i == 0
+            values = [
+                url,
+                url.upper() if first else '',
+                f"【ふるさと納税】テスト返礼品 {row_idx} 1kg" if first else '',
+                rng.choice(['0', '1']),
+                '1' if first else '',
+                '2025/01/01 00:00' if first else '',
+                rng.choice(['2099/12/31 23:59', '']) if first else '',
+                '1' if first else '',
+                f"sku{i}" if not first else '',
+                f"ABCD{row_idx:07d}-{i}" if not first else '',
+                str(rng.randint(0, 50)),
+                '',
+            ] + [f"値{rng.randint(0, 9999)}" for _ in range(40)]
+            lines.append(','.join(values))
+            row_idx += 1
+    return ('\r\n'.join(lines) + '\r\n').encode('cp932')
+
+
+def make_choice_csv(n_rows, rng):
+    """チョイス形式 (ヘッダーなし・utf-8-sig) の合成データを作成する"""
+    lines = []
+    for row_idx in range(n_rows):
+        values = [f"説明{rng.randint(0, 9999)}" for _ in range(CHOICE_N_COLS)]
+        values[0] = str(100000 + row_idx)
+        values[1] = f"M{row_idx:07d}"
+        values[2] = f"\"テスト返礼品, {row_idx}\""
+        values[97] = rng.choice(['0', '1'])
+        values[98] = rng.choice(['', '2025/01/01'])
+        values[99] = rng.choice(['', '2099/12/31'])
+        values[100] = str(100000 + row_idx - 1) if row_idx % 5 else ''
+        values[102] = f"ABCD{row_idx:07d}"
+        lines.append(','.join(values))
+    return ('﻿' + '\n'.join(lines) + '\n').encode('utf-8')
+
+
+def bench(label, bytes_data, encodings, header, projection, repeat):
+    encoding, text, detect_sec = detect_encoding(bytes_data, encodings)
+    print(f"\n[{label}] {len(bytes_data) / 1024 / 1024:.1f} MB / 文字コード {encoding} (判定 {detect_sec:.3f} 秒)")
+
+    for cols_label, cols in [("全列", None), ("絞り込み", projection)]:
+        results = {}
+        for engine in (CSV_ENGINE_C, CSV_ENGINE_PYARROW):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                df, engine_used = parse_csv_text(text, header, ',', cols, engine)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[engine] = df
+            print(f"  {cols_label:<5} {engine:<8} (使用: {engine_used:<8}) {best:7.3f} 秒  {df.shape[0]} 行 x {df.shape[1]} 列")
+
+        same = results[CSV_ENGINE_C].equals(results[CSV_ENGINE_PYARROW])
+        print(f"  {cols_label:<5} 結果の一致: {'OK' if same else 'NG'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='合成データの行数')
+    parser.add_argument('--repeat', type=int, default=3, help='計測の繰り返し回数 (最速値を表示)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bench("楽天", make_rakuten_csv(args.rows, rng), ['cp932', 'shift_jis', 'utf-8'], 0, RAKUTEN_PROJECTION, args.repeat)
+    bench("チョイス", make_choice_csv(args.rows, rng), ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis'], None, CHOICE_PROJECTION, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
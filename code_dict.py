@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# --- 返礼品コードの辞書 (セッション全体で共有) ---
+# ポータルごとの表・マスター・定期便リスト・楽天の商品管理番号マップがそれぞれ同じ返礼品コードの文字列を保持し、
+# ポータル間の突き合わせも文字列のハッシュ検索で行っていた。
+# CodeDictionary は正規化済みの返礼品コード (KEY_COL) に連番の int32 ID を割り当て、
+# ポータル間の突き合わせを整数の配列参照で行う。文字列に戻すのは表示・出力時のみ。
+# ※ コードの追加 (encode) はメインスレッドからのみ行う (スレッドセーフではない)
+
+# 返礼品コードの ID を保存する列
+KEY_ID_COL = '_key_id'
+# コードなし (空欄・辞書にないコード) を表す ID
+NO_CODE = -1
+
+
+def _object_array(codes):
+    if isinstance(codes, pd.Series):
+        return codes.to_numpy(dtype=object)
+    return np.asarray(codes, dtype=object)
+
+
+class CodeDictionary:
+    """正規化済みの返礼品コード <-> int32 ID の対応表 (ID は 0 からの連番)"""
+
+    def __init__(self):
+        self._codes = [] # ID -> コード
+        self._ids = {} # コード -> ID
+        self._code_index = None # 一括検索用 (コード追加後の初回検索時に作り直す)
+        self._code_array = None # 一括変換用 (コード追加後の初回変換時に作り直す)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return code in self._ids
+
+    def encode(self, codes):
+        """コードの配列を ID 配列 (int32) に変換する。辞書にないコードは新しい ID を割り当てる (空文字は NO_CODE)"""
+        values = _object_array(codes)
+        ids = self.lookup(values)
+        is_new = (ids == NO_CODE) & (values != '')
+        if is_new.any():
+            new_codes = pd.unique(values[is_new]).tolist()
+            start = len(self._codes)
+            self._codes.extend(new_codes)
+            self._ids.update(zip(new_codes, range(start, start + len(new_codes))))
+            self._code_index = None
+            self._code_array = None
+            ids = self.lookup(values)
+        return ids
+
+    def lookup(self, codes):
+        """コードの配列を ID 配列 (int32) に変換する。辞書にないコードは NO_CODE (辞書は変更しない)"""
+        values = _object_array(codes)
+        if not self._codes:
+            return np.full(len(values), NO_CODE, dtype=np.int32)
+        if self._code_index is None:
+            self._code_index = pd.Index(self._codes, dtype=object)
+        return self._code_index.get_indexer(values).astype(np.int32)
+
+    def lookup_one(self, code):
+        """1件のコードの ID を返す。辞書にない場合は NO_CODE"""
+        return self._ids.get(code, NO_CODE)
+
+    def decode(self, ids):
+        """ID 配列をコードの配列 (object) に変換する。NO_CODE は空文字"""
+        if self._code_array is None:
+            self._code_array = np.array(self._codes + [''], dtype=object)
+        ids = np.asarray(ids, dtype=np.int64)
+        # 末尾の空文字は NO_CODE 用
+        return self._code_array[np.where(ids >= 0, ids, len(self._codes))]
+
+    def decode_one(self, code_id):
+        """1件の ID をコードに戻す。NO_CODE は空文字"""
+        return self._codes[code_id] if code_id >= 0 else ''
@@ -0,0 +1,255 @@
+import time
+from datetime import date, datetime
+from io import BytesIO, StringIO
+
+import pandas as pd
+
+# --- ファイル読み込み用のヘルパー ---
+# 以前はエンコーディング候補ごとに pd.read_csv を実行していたため、
+# 想定外の文字コードのファイルでは同じファイルを最大4回パースしていた。
+# ここでは文字コードの判定（デコード）とパースを分離し、パースは1回だけ行う。
+
+# CSVのパースエンジン
+CSV_ENGINE_C = 'c'             # pandas 標準の C パーサー
+CSV_ENGINE_PYARROW = 'pyarrow' # pyarrow.csv (マルチスレッドでパース)
+
+
+def detect_encoding(bytes_data, encodings_to_try):
+    """
+    候補のエンコーディングでファイル全体を順にデコードし、最初に成功したものを採用する。
+    (一部だけのサンプル判定では、後半にだけ現れる文字で誤判定するため全体をデコードする)
+    戻り値: (エンコーディング, デコード済みテキスト, 判定にかかった秒数)
+    どの候補でもデコードできない場合は (None, None, 秒数) を返す。
+    """
+    start = time.perf_counter()
+    for encoding in encodings_to_try:
+        try:
+            text = bytes_data.decode(encoding, errors='strict')
+        except (UnicodeDecodeError, LookupError):
+            # エンコーディング不一致の場合は次を試す
+            continue
+        return encoding, text, time.perf_counter() - start
+    return None, None, time.perf_counter() - start
+
+
+def format_read_info(encoding, elapsed_sec, engine=None):
+    """プレビューに表示する読み込み情報の文字列を作成する"""
+    info = f"文字コード: {encoding}（判定 {elapsed_sec:.2f} 秒）"
+    if engine:
+        info += f" / パーサー: {engine}"
+    return info
+
+
+def _read_csv_c(text, header, sep, projected_cols):
+    """pandas の C パーサーで読み込む (全列文字列・欠損値は空文字)"""
+    usecols = None
+    if projected_cols is not None:
+        if header is None:
+            # ヘッダーなしの場合は列番号のリストで指定する
+            # (header=None では callable 指定が正しく動作しないため)
+            # 存在しない列番号を指定するとエラーになるため、1行目の列数で絞る
+            n_cols = pd.read_csv(StringIO(text), header=None, nrows=1, dtype=str, sep=sep).shape[1]
+            usecols = sorted(c for c in projected_cols if c < n_cols)
+        else:
+            usecols = lambda c: c in projected_cols
+
+    df = pd.read_csv(
+        StringIO(text),
+        header=header,
+        dtype=str,
+        usecols=usecols,
+        sep=sep,
+        on_bad_lines='warn'
+    )
+    return df.fillna('')
+
+
+def _read_csv_pyarrow(text, header, sep, projected_cols):
+    """
+    pyarrow.csv で読み込む。C パーサーと同じ結果にならない可能性がある場合は None を返す。
+    (pandas の engine="pyarrow" は dtype=str でも型推論後に文字列化するため '3.0' や 'nan' になる。
+     ここでは列の型をすべて文字列に固定し、欠損値の判定も pandas の既定値に合わせる)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        from pandas._libs.parsers import STR_NA_VALUES
+    except ImportError:
+        return None
+
+    # 列名は C パーサーで先頭行だけ読んで決める (重複列名の「.1」付与などを合わせるため)
+    if header is None:
+        n_cols = pd.read_csv(StringIO(text), header=None, nrows=1, dtype=str, sep=sep).shape[1]
+        labels = list(range(n_cols))
+    else:
+        labels = list(pd.read_csv(StringIO(text), nrows=0, sep=sep).columns)
+    names = [f'c{i}' for i in range(len(labels))]
+    label_of = dict(zip(names, labels))
+
+    include = [n for n in names if projected_cols is None or label_of[n] in projected_cols]
+
+    invalid_rows = []
+    def on_invalid_row(row):
+        # 列数が合わない行がある場合は C パーサーでの読み込みに切り替える
+        invalid_rows.append(row.number)
+        return 'skip'
+
+    # BOM は C パーサーと同様に除去する (utf-8 で判定された場合はテキストの先頭に残るため)
+    if text.startswith('\ufeff'):
+        text = text[1:]
+
+    table = pa_csv.read_csv(
+        BytesIO(text.encode('utf-8')),
+        read_options=pa_csv.ReadOptions(
+            column_names=names,
+            skip_rows=0 if header is None else 1,
+            use_threads=True
+        ),
+        parse_options=pa_csv.ParseOptions(
+            delimiter=sep,
+            newlines_in_values=True,
+            invalid_row_handler=on_invalid_row
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={n: pa.string() for n in names},
+            include_columns=include,
+            null_values=list(STR_NA_VALUES),
+            strings_can_be_null=True
+        )
+    )
+    if invalid_rows:
+        return None
+
+    df = table.to_pandas()
+    df.columns = [label_of[n] for n in include]
+    return df.fillna('')
+
+
+def _convert_excel_cell(value):
+    """
+    Excel のセル値を pd.read_excel (openpyxl) と同じ規則で変換する
+    (空セルは空文字、整数値の小数は整数、日付は日時)
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _iter_excel_rows(bytes_data):
+    """
+    Excel ファイルの先頭シートの行を1行ずつ返す。
+    python-calamine がインストールされている場合はそちらを使用する (openpyxl より大幅に高速)。
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        CalamineWorkbook = None
+
+    if CalamineWorkbook is not None:
+        sheet = CalamineWorkbook.from_filelike(BytesIO(bytes_data)).get_sheet_by_index(0)
+        # calamine は使用範囲の左端の列から返すため、A列から始まるように空の列を補う
+        # (行は1行目から返される)
+        start_col = sheet.start[1] if sheet.start else 0
+        pad = [''] * start_col
+        for row in sheet.iter_rows():
+            yield pad + row if start_col else row
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(BytesIO(bytes_data), read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_excel_streaming(bytes_data, header, projected_cols=None):
+    """
+    Excel ファイルの先頭シートを1行ずつ読み込む (calamine または openpyxl の読み取り専用モード)。
+    pd.read_excel はブック全体のオブジェクトを作成するため、大きなファイルでは遅くメモリも多く使う。
+    ここでは必要な列の値だけを保持し、最後に pandas の TextParser で DataFrame に変換する
+    (欠損値・重複列名・文字列変換の扱いは pd.read_excel と同じ)。
+    """
+    from pandas.io.parsers import TextParser
+
+    source = _iter_excel_rows(bytes_data)
+    rows = source
+    try:
+        # 読み込む列位置 (None の場合は全列)
+        col_positions = None
+        if projected_cols is not None:
+            if header is None:
+                col_positions = sorted(projected_cols)
+            else:
+                # 列名は pandas と同じ規則 (重複列名の「.1」付与、空の列名の「Unnamed: n」) で決めてから判定する
+                header_row = [_convert_excel_cell(v) for v in (next(rows, None) or ())]
+                header_names = list(TextParser([header_row], header=0).read().columns) if header_row else []
+                col_positions = [i for i, v in enumerate(header_names) if v in projected_cols]
+                rows = _chain_first(tuple(header_names), rows)
+
+        data = []
+        max_width = 0
+        last_row_with_data = -1
+        for row in rows:
+            # pd.read_excel と同様に行末の空セルを除去する
+            width = len(row)
+            while width and row[width - 1] in (None, ''):
+                width -= 1
+            max_width = max(max_width, width)
+            if width:
+                last_row_with_data = len(data)
+
+            if col_positions is None:
+                data.append([_convert_excel_cell(v) for v in row[:width]])
+            else:
+                data.append([_convert_excel_cell(row[i]) if i < width else '' for i in col_positions])
+    finally:
+        source.close()
+
+    # 末尾の空行を除去し、列数を揃える
+    data = data[:last_row_with_data + 1]
+    if col_positions is None:
+        data = [r + [''] * (max_width - len(r)) for r in data]
+    else:
+        # ファイルに存在しない列位置は除外する (CSV の列の絞り込みと同じ)
+        keep = [j for j, i in enumerate(col_positions) if i < max_width]
+        if len(keep) < len(col_positions):
+            col_positions = [col_positions[j] for j in keep]
+            data = [[r[j] for j in keep] for r in data]
+
+    if not data:
+        return pd.DataFrame()
+
+    # 途中の空行は残す (pd.read_excel と同じ)
+    df = TextParser(data, header=header, dtype=str, skip_blank_lines=False).read()
+    if header is None and col_positions is not None:
+        # ヘッダーなしの場合、列番号を元ファイルの列位置に合わせる
+        df.columns = col_positions
+    return df.fillna('')
+
+
+def _chain_first(first, rest):
+    """先頭行を戻したイテレータを作成する"""
+    yield first
+    yield from rest
+
+
+def parse_csv_text(text, header, sep, projected_cols=None, engine=CSV_ENGINE_C):
+    """
+    デコード済みのテキストを DataFrame に変換する (全列文字列・欠損値は空文字)。
+    projected_cols を指定した場合はその列だけを読み込む。
+    pyarrow で読み込めない場合は C パーサーで読み込む。
+    戻り値: (DataFrame, 実際に使用したエンジン)
+    """
+    if engine == CSV_ENGINE_PYARROW:
+        try:
+            df = _read_csv_pyarrow(text, header, sep, projected_cols)
+        except Exception:
+            df = None
+        if df is not None:
+            return df, CSV_ENGINE_PYARROW
+    return _read_csv_c(text, header, sep, projected_cols), CSV_ENGINE_C
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# --- 列指向の検索インデックス ---
+# 従来の {キー: row.to_dict()} 形式の検索マップは、1行ごとにPython辞書を作るため
+# 作成が遅く、メモリもDataFrameの数倍を消費していた。
+# LookupIndex は「正規化済みキー -> 行位置」の辞書と、列ごとの連続した配列だけを保持する。
+# 返礼品コードの ID (code_dict.CodeDictionary) を持たせた場合は、ID 配列から配列参照で行位置を引ける。
+
+
+def _column_values(series):
+    """列の値を object 配列にする (型変換済みの列の欠損値 <NA> は空文字とする)"""
+    arr = series.to_numpy(dtype=object)
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        arr[pd.isna(arr)] = ''
+    return arr
+
+
+class LookupRow:
+    """LookupIndex の1行分を辞書のように参照するための軽量ビュー"""
+
+    __slots__ = ('_index', '_pos')
+
+    def __init__(self, index, pos):
+        self._index = index
+        self._pos = pos
+
+    def get(self, col_key, default=None):
+        column = self._index.columns.get(col_key)
+        if column is None:
+            return default
+        return column[self._pos]
+
+    def __getitem__(self, col_key):
+        column = self._index.columns.get(col_key)
+        if column is None:
+            raise KeyError(col_key)
+        return column[self._pos]
+
+    def __contains__(self, col_key):
+        return col_key in self._index.columns
+
+    def __bool__(self):
+        # 行が見つかった時点で「データあり」とみなす (従来の row 辞書と同じ扱い)
+        return True
+
+    def keys(self):
+        return self._index.columns.keys()
+
+    def to_dict(self):
+        return {c: arr[self._pos] for c, arr in self._index.columns.items()}
+
+
+class LookupIndex:
+    """
+    正規化済みキーから行位置を引き、列配列から値を取り出す検索インデックス。
+    キーは重複なし（drop_duplicates 済み）であることを前提とする。
+    """
+
+    def __init__(self, keys, columns, ids=None):
+        self._keys = np.asarray(keys, dtype=object)
+        self.columns = columns # 列名 -> np.ndarray (行位置でアクセス)
+        # 返礼品コードの ID (code_dict.CodeDictionary)。指定した場合は ID (整数) でも検索できる
+        self._ids = None if ids is None else np.asarray(ids, dtype=np.int64)
+        self._positions = None # キー -> 行位置 (初回の文字列検索時に作成)
+        self._key_index = None # 一括検索用 (初回の take 時に作成)
+        self._id_positions = None # ID -> 行位置 の配列 (初回の ID 検索時に作成)
+
+    @classmethod
+    def from_frame(cls, df, key_col, columns=None, id_col=None):
+        """
+        DataFrame から作成する。columns を指定した場合はその列のみ保持する。
+        id_col を指定した場合はその列 (返礼品コードの ID) でも検索できる。
+        """
+        cols = list(df.columns) if columns is None else [c for c in columns if c in df.columns]
+        return cls(
+            df[key_col].to_numpy(dtype=object),
+            {c: _column_values(df[c]) for c in cols},
+            ids=df[id_col].to_numpy() if id_col is not None else None
+        )
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def _position_map(self):
+        if self._positions is None:
+            self._positions = {k: i for i, k in enumerate(self._keys)}
+        return self._positions
+
+    def _positions_of_ids(self, ids):
+        """ID 配列に対応する行位置の配列を返す (見つからない場合は -1)"""
+        if self._id_positions is None:
+            valid_ids = self._ids >= 0
+            size = int(self._ids.max()) + 1 if valid_ids.any() else 0
+            self._id_positions = np.full(size, -1, dtype=np.int64)
+            # キーは重複なしのため、行位置をそのまま書き込む
+            self._id_positions[self._ids[valid_ids]] = np.flatnonzero(valid_ids)
+        ids = np.asarray(ids, dtype=np.int64)
+        valid = (ids >= 0) & (ids < len(self._id_positions))
+        if not valid.any():
+            return np.full(len(ids), -1, dtype=np.int64)
+        return np.where(valid, self._id_positions[np.where(valid, ids, 0)], -1)
+
+    def get(self, key, default=None):
+        """キー (または ID) に完全一致する行を返す (dict.get と同じ挙動)"""
+        pos = self.find(key)
+        if pos < 0:
+            return default
+        return LookupRow(self, pos)
+
+    def find(self, key):
+        """
+        キー (または ID) の行位置を返す。見つからない場合は -1。
+        キーは取り込み時に正規化済み (typed_columns.normalize_keys) のため、完全一致で検索する。
+        """
+        if self._ids is not None and isinstance(key, (int, np.integer)):
+            return int(self._positions_of_ids([key])[0])
+        return self._position_map().get(key, -1)
+
+    def value_at(self, pos, col_key, default=''):
+        """行位置と列名から値を取得する"""
+        column = self.columns.get(col_key)
+        if column is None:
+            return default
+        return column[pos]
+
+    def take(self, keys, cols):
+        """
+        キー配列 (または ID 配列) に対応する行の値を列ごとにまとめて取り出す。
+        戻り値: (列名 -> 値配列 の辞書, 行が見つかったかのマスク)
+        見つからない行・存在しない列・欠損値は空文字とする。
+        """
+        n = len(keys)
+        if len(self._keys) == 0:
+            return {c: np.full(n, '', dtype=object) for c in cols}, np.zeros(n, dtype=bool)
+
+        keys = np.asarray(keys)
+        if self._ids is not None and keys.dtype.kind in 'iu':
+            # ID 配列は配列参照で行位置に変換する
+            positions = self._positions_of_ids(keys)
+        else:
+            if self._key_index is None:
+                self._key_index = pd.Index(self._keys)
+            positions = self._key_index.get_indexer(np.asarray(keys, dtype=object))
+        found = positions >= 0
+        take = np.where(found, positions, 0)
+
+        values = {}
+        for c in cols:
+            column = self.columns.get(c)
+            if column is None:
+                values[c] = np.full(n, '', dtype=object)
+                continue
+            arr = column[take]
+            arr[~found] = ''
+            arr[pd.isna(arr)] = ''
+            values[c] = arr
+        return values, found
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+# --- 読み込み結果のディスクキャッシュ ---
+# ファイルの再読み込み要否はセッション内の (ファイル名, サイズ, 種類) でしか判定していないため、
+# 新しいセッションでは同じエクスポートファイルでも毎回パースし直していた。
+# ParseCache は「ファイル内容のハッシュ + ポータル名 + 読み込み条件」をキーとして、
+# 前処理済みの DataFrame を Parquet 形式でローカルディスクに保存する。
+# 合計サイズが上限を超えた場合は、最後に参照されたのが古いものから削除する (LRU)。
+
+# 前処理の内容を変更した場合はこの値を上げて、古いキャッシュを無効にする
+CACHE_FORMAT_VERSION = 5
+
+
+class ParseCache:
+    """前処理済み DataFrame のディスクキャッシュ (キャッシュの読み書きに失敗しても処理は継続する)"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock() # 削除処理 (evict) の同時実行を防ぐ
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir) and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(bytes_data, sheet_name, *params):
+        """ファイル内容・ポータル名・読み込み条件からキャッシュキーを作成する"""
+        h = hashlib.blake2b(bytes_data, digest_size=20)
+        h.update(json.dumps([CACHE_FORMAT_VERSION, sheet_name, *map(str, params)], ensure_ascii=False).encode('utf-8'))
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.parquet', base + '.json'
+
+    def get(self, key):
+        """
+        キャッシュから読み込む。
+        戻り値: (DataFrame, 付加情報の辞書)。キャッシュがない場合は None。
+        """
+        if not self.enabled:
+            return None
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            df = pd.read_parquet(data_path)
+        except (OSError, ValueError):
+            return None
+
+        # Parquet の列名は文字列のみのため、元の列名 (チョイス系は列番号) に戻す
+        df.columns = meta['columns']
+
+        # 参照日時を更新 (LRU 判定用)
+        try:
+            os.utime(data_path)
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return df, meta.get('extra', {})
+
+    def put(self, key, df, extra=None):
+        """DataFrame と付加情報 (JSON に変換できる値) を保存する"""
+        if not self.enabled:
+            return
+        data_path, meta_path = self._paths(key)
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_suffix = f'.tmp{os.getpid()}_{threading.get_ident()}'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df_to_save = df.copy(deep=False)
+            df_to_save.columns = [str(c) for c in df.columns]
+            df_to_save.to_parquet(data_path + tmp_suffix, index=False)
+            with open(meta_path + tmp_suffix, 'w', encoding='utf-8') as f:
+                json.dump({'columns': list(df.columns), 'extra': extra or {}}, f, ensure_ascii=False)
+            os.replace(data_path + tmp_suffix, data_path)
+            os.replace(meta_path + tmp_suffix, meta_path)
+        except (OSError, ValueError, TypeError, ImportError):
+            # キャッシュに保存できなくても読み込み結果はそのまま使用する
+            for path in (data_path + tmp_suffix, meta_path + tmp_suffix):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return
+        self.evict()
+
+    def evict(self):
+        """合計サイズが上限を超えている場合、参照日時が古いものから削除する"""
+        with self._lock:
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                return
+
+            entries = {} # キー -> [最終参照日時, 合計サイズ]
+            for name in names:
+                key, ext = os.path.splitext(name)
+                if ext not in ('.parquet', '.json'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entry = entries.setdefault(key, [0.0, 0])
+                entry[0] = max(entry[0], stat.st_mtime)
+                entry[1] += stat.st_size
+
+            total = sum(size for _, size in entries.values())
+            for key, (_, size) in sorted(entries.items(), key=lambda kv: kv[1][0]):
+                if total <= self.max_bytes:
+                    break
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
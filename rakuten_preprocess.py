@@ -0,0 +1,46 @@
+import pandas as pd
+
+# --- 楽天の取り込み時の前処理 ---
+# 楽天の商品データは、商品行の下に SKU 行 (商品番号・商品名などが空欄) が続く形式のため、
+# 商品管理番号ごとに先頭行の値を下の行へコピー (fill-down) し、3行以上のグループの先頭行を親とする。
+# いずれも列単位の一括処理 (groupby().transform) で行う。
+
+RAKUTEN_URL_COL = '商品管理番号（商品URL）'
+
+# 先頭行のデータを同グループの下行へコピーする列
+# ★ 親判定のために「商品番号」をfill-downしてはいけないため、リストから除外
+RAKUTEN_FILL_TARGETS = ['商品名', 'サーチ表示', '販売期間指定（開始日時）', '販売期間指定（終了日時）', '注文ボタン']
+
+# 親行の商品番号に付与するサフィックス
+RAKUTEN_PARENT_SUFFIX = '（楽天親）'
+
+
+def preprocess_rakuten(df):
+    """
+    楽天の商品データに fill-down・親判定・SKU番号/SKU倉庫指定の上書きを行い、df を返す (df を直接書き換える)。
+    必須列 (app.py の RAKUTEN_REQUIRED_COLUMNS) のチェックは呼び出し側で行う。
+    """
+    # 1. fill-down: グループ (商品管理番号) ごとの先頭の値を全行に展開する (列単位で一括処理)
+    url_groups = df.groupby(RAKUTEN_URL_COL, sort=False)
+    df[RAKUTEN_FILL_TARGETS] = url_groups[RAKUTEN_FILL_TARGETS].transform('first')
+
+    # 2. 親判定処理（グループ>=3 の場合、先頭行を親とする）
+    # fill-down直後に実行することで、商品番号が埋まった状態で判定可能（ただしSKU上書き前）
+    # 各行の所属グループの件数と、グループ先頭行かどうかを列として計算
+    group_sizes = url_groups[RAKUTEN_URL_COL].transform('size')
+    is_group_first = ~df[RAKUTEN_URL_COL].duplicated(keep='first')
+
+    # 3行以上のグループの先頭行の商品番号に「（楽天親）」を付与
+    mask_parent = is_group_first & (group_sizes >= 3)
+    if mask_parent.any():
+        df.loc[mask_parent, '商品番号'] = df.loc[mask_parent, '商品番号'].astype(str) + RAKUTEN_PARENT_SUFFIX
+
+    # 3. 「システム連携用SKU番号」に値がある場合のみ、「商品番号」にコピー (空文字でない場合のみ上書きする)
+    # ★ 親判定後に実行することで、SKU行はSKU番号になり、親行（SKUなし）は変更後の商品番号（楽天親）が維持される
+    mask_sku = df['システム連携用SKU番号'] != ''
+    df.loc[mask_sku, '商品番号'] = df.loc[mask_sku, 'システム連携用SKU番号']
+
+    # 4. 「SKU倉庫指定」に値がある場合のみ、「倉庫指定」にコピー (空文字でない場合のみ上書きする)
+    mask_warehouse = df['SKU倉庫指定'] != ''
+    df.loc[mask_warehouse, '倉庫指定'] = df.loc[mask_warehouse, 'SKU倉庫指定']
+    return df
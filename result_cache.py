@@ -0,0 +1,88 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# --- 掲載状況の結果のキャッシュ ---
+# 同じアップロードファイル・ベースポータル・基準日・DB(定期便/事業者)の内容で「掲載状況を表示」を再実行した場合、
+# 計算済みの結果の表 (results_df) をそのまま返す。
+# ResultCache はメモリ上の LRU (サーバー内の全セッションで共有) と、ディスクのキャッシュ (ParseCache) の2段で保持する。
+# メモリの合計サイズが上限を超えた場合は、最後に参照されたのが古いものから削除する (ディスク側は ParseCache が削除する)。
+
+# 結果の表の作り方を変更した場合はこの値を上げて、古いキャッシュを無効にする
+RESULT_CACHE_VERSION = 2
+
+
+class ResultCache:
+    """結果の表 (DataFrame) のキャッシュ (メモリ LRU + ディスク、スレッドセーフ)"""
+
+    def __init__(self, max_memory_bytes, disk_cache=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_cache = disk_cache # ParseCache (None でディスクに保存しない)
+        self._entries = OrderedDict() # キー -> (DataFrame, 付加情報, サイズ)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """入力の内容 (ファイルのハッシュ・ベースポータル・基準日・DBのハッシュなど) からキャッシュキーを作成する"""
+        payload = json.dumps([RESULT_CACHE_VERSION, *parts], ensure_ascii=False, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    @staticmethod
+    def frame_digest(df):
+        """DataFrame の内容 (列名・行の順序・値) のハッシュを返す (DB の内容をキャッシュキーに含める場合に使用)"""
+        h = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes(), digest_size=20)
+        h.update(json.dumps([str(col) for col in df.columns], ensure_ascii=False).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        キャッシュから結果を取り出す (呼び出し側で変更できるようコピーを返す)。
+        戻り値: (DataFrame, 付加情報の辞書)。キャッシュがない場合は None。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                df, extra, _ = entry
+                return df.copy(), dict(extra)
+
+        if self.disk_cache is None:
+            return None
+        cached = self.disk_cache.get(key)
+        if cached is None:
+            return None
+        df, extra = cached
+        # ディスクから読み込んだ結果はメモリにも載せる
+        self._remember(key, df, extra)
+        return df.copy(), dict(extra)
+
+    def put(self, key, df, extra=None):
+        """結果の表と付加情報 (JSON に変換できる値) を保存する"""
+        extra = extra or {}
+        self._remember(key, df.copy(), extra)
+        if self.disk_cache is not None:
+            self.disk_cache.put(key, df, extra)
+
+    def _remember(self, key, df, extra):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[2]
+            self._entries[key] = (df, extra, size)
+            self._total_bytes += size
+            # 上限を超えた分は、最後に参照されたのが古いものから削除する
+            while self._total_bytes > self.max_memory_bytes and self._entries:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
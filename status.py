@@ -1,6 +1,7 @@
-import re
 from datetime import datetime
 
+from typed_columns import to_date_int, to_number, to_stock_number, normalize_key, KEY_COL
+
 # --- 日付設定 ---
 # 基準日は app.py から引数で渡される
 
@@ -9,7 +10,8 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
     
     def get_val(p, c, col_key, is_parent_lookup=False):
         """
-        検索マップから指定したキー（列インデックス or ヘッダー名）の値を取得する (大文字・小文字を区別しない)
+        検索インデックス(LookupIndex)から指定したキー（列インデックス or ヘッダー名）の値を取得する
+        (キーは取り込み時に正規化済みのため、完全一致で検索する)
         col_key: チョイス系は int (0, 1, 97...)、その他は str ('在庫数', 'ステータス'...)
         """
         if not c: # 検索キー(c)が空なら空文字を返す
@@ -19,42 +21,28 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         if not lookup:
             return ''
 
-        # 1. 渡されたキー(c)でそのまま検索
-        row = lookup.get(c)
-        
-        # 2. 見つからない場合、c を str に変換して検索
-        if row is None and isinstance(c, (int, float)):
-            row = lookup.get(str(c))
-            
-        # 3. それでも見つからない場合、大文字・小文字バリエーションで検索 (str型のみ)
-        if row is None and isinstance(c, str):
-            c_upper = c.upper()
-            if c != c_upper: # cが小文字または混在の場合
-                row = lookup.get(c_upper) # 大文字で検索
-                
-            if row is None:
-                c_lower = c.lower()
-                if c != c_lower: # cが大文字または混在の場合
-                    row = lookup.get(c_lower) # 小文字で検索
+        # LookupIndex.find でキーの行位置を取得
+        pos = lookup.find(c)
 
-        # 最終的にrowが見つからなければ空文字を返す
-        if row is None:
+        # 最終的に行が見つからなければ空文字を返す
+        if pos < 0:
             return ''
             
-        # rowが見つかった場合、col_keyの値を取得
-        return row.get(col_key, '')
+        # 行が見つかった場合、col_keyの値を取得
+        return lookup.value_at(pos, col_key)
+
+    def format_date(date_value):
+        """日付を YYYYMMDD 形式の整数にする (取り込み時に変換済みの列はそのまま、空欄は None)"""
+        return to_date_int(date_value)
 
-    def format_date(date_str):
-        """日付文字列を'YYYYMMDD'形式に整形する"""
-        if not date_str: return ''
-        # ハイフンも除去するため、正規表現を [^0-9] に修正
-        return re.sub(r'[^0-9]', '', str(date_str))[:8]
+    # 基準日 (YYYYMMDD) も整数で比較する
+    select_date = int(select_date_str)
 
-    # app.pyから渡される row 辞書のキーが、ポータルによって
+    # app.pyから渡される row (LookupRow) の列キーが、ポータルによって
     # int (チョイス系) か str (その他) かが異なる
     
-    # チョイス系以外（ヘッダーあり）の場合、rowは { 'ヘッダー名1': '値1', ... }
-    # チョイス系（ヘッダーなし）の場合、rowは { 0: '値0', 1: '値1', ... }
+    # チョイス系以外（ヘッダーあり）の場合、row.get('ヘッダー名1') で値を取得
+    # チョイス系（ヘッダーなし）の場合、row.get(0) で値を取得
     
     # app.py側で code が .upper() されているため、大文字で検索
     row = lookup_maps.get(portal, {}).get(code)
@@ -82,7 +70,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         #    ここで使用する code も row に合わせて親キーにする必要があるか？
         #    → get_val は引数の code を使って再検索を行う仕様。
         #      row が親キーで取得された場合、code は子キーのままなので get_val でヒットしない可能性がある。
-        #      したがって、row から正しいキー(key_col_str)を取得して上書きするか、
+        #      したがって、row から正しいキー(KEY_COL)を取得して上書きするか、
         #      row自体から値を取得するように変更するのが理想だが、get_valはlookup_maps依存。
         #      ここでは簡易的に、もし row が見つかっていて、かつ元の code で get_val が失敗する（空文字）ようなら
         #      親キーで get_val を呼ぶ必要があるが、get_val は汎用関数のため、
@@ -90,10 +78,10 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         
         actual_code = code
         if row:
-            # row['key_col_str'] に検索に使ったキーが入っている（app.pyの読み込み時に設定済みと仮定）
+            # row[KEY_COL] に検索に使ったキーが入っている（app.pyの読み込み時に設定済みと仮定）
             # もし入っていなければ、parent_key を試す
-            if 'key_col_str' in row:
-                actual_code = row['key_col_str']
+            if KEY_COL in row:
+                actual_code = row[KEY_COL]
             elif str(code).strip() + '（チョイス親）' in lookup_maps.get(portal, {}):
                  # フォールバックしたと推測される場合
                  if not lookup_maps.get(portal, {}).get(code):
@@ -126,52 +114,54 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         #      よって、在庫ファイルのキーもサフィックス付きになっている。
         #      結論：在庫取得も `actual_code`（サフィックス付き）で行えばOK。
 
-        stock_lookup = get_val('チョイス在庫', actual_code, 4)
-        
-        stock_status = "" # (x_val)
-        if stock_lookup != "":
-            try:
-                if float(stock_lookup) == 0:
-                    stock_status = "在庫0"
-                else:
-                    stock_status = stock_lookup # 在庫あり (数値)
-            except (ValueError, TypeError):
-                stock_status = stock_lookup # "無制限" など
+        # 在庫数 (取り込み時に数値化済み。「在庫0」は 0、「無制限」などは 0 以外として扱う)
+        stock_count = to_stock_number(get_val('チョイス在庫', actual_code, 4))
 
         if display_flag == '':
             return '未登録'
         
-        try:
-            # 掲載フラグが 0 (または 0.0) なら「非表示」
-            if float(display_flag) == 0:
-                return '非表示'
-        except (ValueError, TypeError):
-            pass # "1" や "公開" などの場合は通過
+        # 掲載フラグが 0 (または 0.0) なら「非表示」 ("1" や "公開" などの場合は通過)
+        if to_number(display_flag) == 0:
+            return '非表示'
 
-        if stock_status == '在庫0':
+        if stock_count == 0:
             return '在庫0'
 
         if not start_date:
             if not end_date:
                 return '公開中'
             else:
-                return '受付終了' if end_date < select_date_str else '公開中'
+                return '受付終了' if end_date < select_date else '公開中'
         else:
-            if start_date > select_date_str:
+            if start_date > select_date:
                 return '未受付'
             else:
                 if not end_date:
                     return '公開中'
                 else:
-                    return '受付終了' if end_date < select_date_str else '公開中'
+                    return '受付終了' if end_date < select_date else '公開中'
     
     # --- 楽天のステータス判定ロジック ---
     if portal == '楽天':
         # 外部から渡された辞書を取得
         rakuten_product_id_map = kwargs.get('rakuten_product_id_map', {})
         rakuten_management_id_map = kwargs.get('rakuten_management_id_map', {})
-        # グループマップを取得
-        rakuten_group_map = kwargs.get('rakuten_group_map', {})
+        # グループ集計表を取得 (商品管理番号ごとの件数と、先頭2行の商品番号・在庫数・倉庫指定)
+        rakuten_group_table = kwargs.get('rakuten_group_table')
+
+        def get_group_partner(group_key):
+            """
+            グループが2件（ペア）の場合、自分自身（現在のproduct_id）でない方の行の (在庫数, 倉庫指定) を返す。
+            グループが2件以外、または相方がいない場合は None を返す。
+            ※ グループが3件以上の場合は判定をスキップする（イレギュラーケース）
+            """
+            group = rakuten_group_table.get(group_key) if rakuten_group_table else None
+            if not group or group['size'] != 2:
+                return None
+            for n in (1, 2):
+                if group[f'code_{n}'] != product_id:
+                    return group[f'stock_{n}'], group[f'warehouse_{n}']
+            return None
 
         # A列(code)は引数で渡ってくるベースポータルの商品番号
         # app.py側で大文字化済みのため、そのまま (大文字)
@@ -201,59 +191,28 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         
         # 2. 値がない場合、グループ情報を用いたフォールバックチェック
         else:
-            # 商品管理番号（URL）をキーにしてグループを取得
-            target_group_key = sku_parent_code.upper()
-            group_rows = rakuten_group_map.get(target_group_key, [])
-            group_len = len(group_rows)
-
-            if group_len == 2:
-                # グループが2件の場合、もう一方の行（すぐ下の行など）の在庫を参照する
-                for gr in group_rows:
-                    # 自分自身（現在のproduct_id）でない行を探す
-                    g_code = str(gr.get('商品番号', '')).strip().upper()
-                    if g_code != product_id:
-                        val = gr.get('在庫数', '')
-                        if val != '':
-                            stock_count_raw = val
-                        break # 値が見つかれば終了（あるいは相方を確認したら終了）
-            
-            elif group_len >= 3:
-                # グループが3件以上の場合、在庫チェックをスキップする
-                # (= stock_count_raw は空文字のまま -> 後続の判定で "在庫0" にならない)
-                pass
+            # 商品管理番号（URL）をキーにして、グループが2件の場合はもう一方の行（すぐ下の行など）の在庫を参照する
+            # (グループが3件以上の場合は stock_count_raw は空文字のまま -> 後続の判定で "在庫0" にならない)
+            partner = get_group_partner(sku_parent_code.upper())
+            if partner and partner[0] != '':
+                stock_count_raw = partner[0]
         
-        stock_status = "在庫0" if stock_count_raw == "0" or stock_count_raw == "在庫0" else stock_count_raw
+        stock_status = "在庫0" if to_stock_number(stock_count_raw) == 0 else stock_count_raw
 
         # ■ AA列 (倉庫指定)
         warehouse_status = ""
         
         # 1. まず自分自身（商品行）の倉庫指定を見る
-        if product_row and product_row.get("倉庫指定", "") == "1":
+        if product_row and to_number(product_row.get("倉庫指定", "")) == 1:
             warehouse_status = "1"
         
         # 2. 次に、グループ（在庫行）側の倉庫指定を見る
         else:
             if sku_parent_code != "なし":
-                # 商品管理番号（URL）をキーにしてグループを取得
-                target_group_key = sku_parent_code.upper()
-                group_rows = rakuten_group_map.get(target_group_key, [])
-                group_len = len(group_rows)
-
-                if group_len == 2:
-                    # グループが2件（ペア）の場合、もう一方の行を確認する
-                    for gr in group_rows:
-                        # 自分自身（現在のproduct_id）でない行を探す
-                        g_code = str(gr.get('商品番号', '')).strip().upper()
-                        if g_code != product_id:
-                            # 在庫行の「倉庫指定」または「SKU倉庫指定」が1なら倉庫扱いとする
-                            if gr.get("倉庫指定", "") == "1" or gr.get("SKU倉庫指定", "") == "1":
-                                warehouse_status = "1"
-                            break
-                
-                elif group_len >= 3:
-                    # グループが3件以上の場合、判定をスキップする（イレギュラーケース）
-                    # 必要に応じて全行チェックなどに拡張可能
-                    pass
+                # グループが2件（ペア）の場合、もう一方の行の「倉庫指定」または「SKU倉庫指定」が1なら倉庫扱いとする
+                partner = get_group_partner(sku_parent_code.upper())
+                if partner and partner[1]:
+                    warehouse_status = "1"
 
         # ■ AB列 (サーチ表示)
         search_display = ""
@@ -304,16 +263,8 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
 
         # 【4】非表示 (サーチ表示が0)
         # スプレッドシートの VALUE(AB4:AB)=0 に相当するロジック
-        is_hidden = False
-        if search_display != "": 
-            try:
-                # 文字列を数値(float)に変換
-                if float(search_display) == 0:
-                    is_hidden = True # "0" や "0.0" の場合は「非表示」
-            except ValueError:
-                pass
-        
-        if is_hidden:
+        # "0" や "0.0" の場合は「非表示」 (取り込み時に数値化済み)
+        if to_number(search_display) == 0:
             return "非表示"
 
         # 【5】注文ボタン (0なら未受付)
@@ -325,12 +276,8 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             if management_row:
                 order_button_val = management_row.get("注文ボタン", "")
 
-        if order_button_val != "":
-            try:
-                if float(order_button_val) == 0:
-                    return "注文不可"
-            except ValueError:
-                pass
+        if to_number(order_button_val) == 0:
+            return "注文不可"
 
         # --- 日付判定 ---
 
@@ -339,7 +286,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return "公開中"
 
         # 【7】販売開始日時が未来：未受付
-        if start_date_formatted and start_date_formatted > select_date_str:
+        if start_date_formatted and start_date_formatted > select_date:
             return "未受付"
 
         # 【8】販売終了日時なし：公開中
@@ -348,7 +295,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return "公開中"
 
         # 【9】販売終了日時が過去：受付終了
-        if end_date_formatted < select_date_str:
+        if end_date_formatted < select_date:
             return "受付終了"
 
         # 【10】上記以外：公開中
@@ -362,11 +309,12 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         sato_id = row.get('お礼品ID', '') if row else ''
 
         # 2. 在庫ファイル（さとふる在庫）の行データをIDで検索
-        stock_row = lookup_maps.get('さとふる在庫', {}).get(sato_id) if sato_id else None
+        # (在庫ファイルのキーと同じ規則で正規化して検索する)
+        stock_row = lookup_maps.get('さとふる在庫', {}).get(normalize_key(sato_id)) if sato_id else None
 
         # 3. 在庫ファイルから「在庫数」「日付」を取得
         # （※stock_rowが取得できた場合のみ値を取り出す）
-        stock_count = str(stock_row.get('全在庫数', '')) if stock_row else ''
+        stock_count = to_stock_number(stock_row.get('全在庫数', '')) if stock_row else None
         start_date = format_date(stock_row.get('受付開始日')) if stock_row else ''
         end_date = format_date(stock_row.get('受付終了日')) if stock_row else ''
 
@@ -374,10 +322,10 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         if not row or not stock_row: return '未登録'
 
         # 【2】公開フラグが 2
-        if pub_flag == '2': return '非表示'
+        if to_number(pub_flag) == 2: return '非表示'
 
         # 【3】全在庫数が 0
-        if stock_count == '0': return '在庫0'
+        if stock_count == 0: return '在庫0'
 
         # 【4】受付期間設定なし（開始・終了ともに空欄）：公開中
         # （他ポータルと挙動を合わせるため追加）
@@ -386,11 +334,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
 
         # 【5】受付開始日が未来：未受付
         # （★順序変更：終了日判定より先にチェックする）
-        if start_date and start_date > select_date_str:
+        if start_date and start_date > select_date:
             return '未受付'
 
         # 【6】受付終了日が過去：受付終了
-        if end_date and end_date < select_date_str:
+        if end_date and end_date < select_date:
             return '受付終了'
 
         # 【7】上記以外：公開中
@@ -418,14 +366,14 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
 
         # 【2】非表示（掲載ステータスNG または 掲載期間外）
         is_pub_ng = (pub_status == "掲載不可")
-        is_pub_future = (pub_start and pub_start > select_date_str)
-        is_pub_past = (pub_end and pub_end < select_date_str)
+        is_pub_future = (pub_start and pub_start > select_date)
+        is_pub_past = (pub_end and pub_end < select_date)
 
         if is_pub_ng or is_pub_future or is_pub_past:
             return '非表示'
 
         # 【3】在庫0
-        if stock_type != "無制限" and str(stock_count) == '0':
+        if stock_type != "無制限" and to_stock_number(stock_count) == 0:
             return '在庫0'
 
         # 【4】販売期間設定なし（開始・終了ともに空欄）：公開中
@@ -433,11 +381,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return '公開中'
 
         # 【5】販売期間(開始)が未来：未受付
-        if sales_start and sales_start > select_date_str:
+        if sales_start and sales_start > select_date:
             return '未受付'
 
         # 【6】販売期間(終了)が過去：受付終了
-        if sales_end and sales_end < select_date_str:
+        if sales_end and sales_end < select_date:
             return '受付終了'
 
         # 【7】上記以外：公開中
@@ -447,7 +395,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         status_flag = get_val('ANA', code, '状態(掲載フラグ)')
         stock_raw = get_val('ANA', code, '在庫数')
         
-        stock_status = "在庫0" if stock_raw == '0' else stock_raw
+        stock_status = "在庫0" if to_stock_number(stock_raw) == 0 else stock_raw
         
         # 掲載期間
         pub_start = format_date(get_val('ANA', code, '掲載開始日'))
@@ -462,25 +410,25 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
 
         # 【2】非表示
         # 1(非公開) または 9(終息) の場合
-        if status_flag == '1' or status_flag == '9': return '非表示'
+        if to_number(status_flag) in (1, 9): return '非表示'
 
         # 【3】在庫0
         if stock_status == '在庫0': return '在庫0'
         
         # 【4】掲載開始日が未来：未受付
-        if pub_start and pub_start > select_date_str:
+        if pub_start and pub_start > select_date:
             return '未受付'
 
         # 【5】掲載終了日が過去：受付終了
-        if pub_end and pub_end < select_date_str:
+        if pub_end and pub_end < select_date:
             return '受付終了'
 
         # 【6】販売開始日が未来：未受付
-        if sale_start and sale_start > select_date_str:
+        if sale_start and sale_start > select_date:
             return '未受付'
 
         # 【7】販売終了日が過去：受付終了
-        if sale_end and sale_end < select_date_str:
+        if sale_end and sale_end < select_date:
             return '受付終了'
 
         # 【8】上記以外：公開中
@@ -489,7 +437,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
     if portal == 'ふるなび':
         sales_flag = get_val('ふるなび', code, '販売フラグ')
         public_flag = get_val('ふるなび', code, '公開フラグ')
-        stock_status = "在庫0" if get_val('ふるなび', code, '在庫数') == '0' else ''
+        stock_status = "在庫0" if to_stock_number(get_val('ふるなび', code, '在庫数')) == 0 else ''
         start_date = format_date(get_val('ふるなび', code, '公開開始日'))
         end_date = format_date(get_val('ふるなび', code, '公開終了日'))
         
@@ -505,11 +453,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return '公開中'
 
         # 【5】公開開始日時が未来：未受付
-        if start_date and start_date > select_date_str:
+        if start_date and start_date > select_date:
             return '未受付'
 
         # 【6】公開終了日時が過去：受付終了
-        if end_date and end_date < select_date_str:
+        if end_date and end_date < select_date:
             return '受付終了'
 
         # 【7】上記以外：公開中
@@ -528,7 +476,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
                 stock_status = "無制限"
             else:
                 stock_status = stock_setting
-        elif str(stock_count) == '0':
+        elif to_stock_number(stock_count) == 0:
             stock_status = "在庫0"
         else:
             stock_status = stock_count
@@ -554,19 +502,19 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         if stock_status == "在庫0": return '在庫0'
         
         # 【6】表示開始日時が未来 (未受付)
-        if disp_start and disp_start > select_date_str:
+        if disp_start and disp_start > select_date:
             return '未受付'
             
         # 【7】表示終了日時が過去 (受付終了)
-        if disp_end and disp_end < select_date_str:
+        if disp_end and disp_end < select_date:
             return '受付終了'
             
         # 【8】寄附開始日時が未来 (未受付)
-        if kifu_start and kifu_start > select_date_str:
+        if kifu_start and kifu_start > select_date:
             return '未受付'
             
         # 【9】寄附終了日時が過去 (受付終了)
-        if kifu_end and kifu_end < select_date_str:
+        if kifu_end and kifu_end < select_date:
             return '受付終了'
             
         # 【10】いずれにも該当しない -> 公開中
@@ -595,22 +543,22 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         if display_setting == "非表示": return '非表示'
 
         # 【5】在庫数が 0
-        if stock_count_raw == '0': return '在庫0'
+        if to_stock_number(stock_count_raw) == 0: return '在庫0'
         
         # 【6】表示開始日時が未来
-        if display_start_date and display_start_date > select_date_str:
+        if display_start_date and display_start_date > select_date:
             return '未受付'
         
         # 【7】表示終了日時が過去
-        if display_end_date and display_end_date < select_date_str:
+        if display_end_date and display_end_date < select_date:
             return '受付終了'
         
         # 【8】寄附開始日時が未来
-        if kifu_start_date and kifu_start_date > select_date_str:
+        if kifu_start_date and kifu_start_date > select_date:
             return '未受付'
             
         # 【9】寄附終了日時が過去
-        if kifu_end_date and kifu_end_date < select_date_str:
+        if kifu_end_date and kifu_end_date < select_date:
             return '受付終了'
         
         # 【10】いずれにも該当しない -> 公開中
@@ -639,22 +587,22 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         if display_setting == "非表示": return '非表示'
 
         # 【5】在庫数が 0
-        if stock_count_raw == '0': return '在庫0'
+        if to_stock_number(stock_count_raw) == 0: return '在庫0'
 
         # 【6】表示開始日時が未来
-        if display_start_date and display_start_date > select_date_str:
+        if display_start_date and display_start_date > select_date:
             return '未受付'
 
         # 【7】表示終了日時が過去
-        if display_end_date and display_end_date < select_date_str:
+        if display_end_date and display_end_date < select_date:
             return '受付終了'
         
         # 【8】寄附開始日時が未来
-        if kifu_start_date and kifu_start_date > select_date_str:
+        if kifu_start_date and kifu_start_date > select_date:
             return '未受付'
             
         # 【9】寄附終了日時が過去
-        if kifu_end_date and kifu_end_date < select_date_str:
+        if kifu_end_date and kifu_end_date < select_date:
             return '受付終了'
 
         # 【10】いずれにも該当しない -> 公開中
@@ -675,7 +623,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return '非表示'
 
         # 【3】在庫0
-        if stock_count_raw == '0':
+        if to_stock_number(stock_count_raw) == 0:
             return '在庫0'
 
         # 【4】期間設定なし（開始・終了ともに空欄）：公開中
@@ -683,11 +631,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             return '公開中'
 
         # 【5】公開開始日が未来：未受付
-        if start_date and start_date > select_date_str:
+        if start_date and start_date > select_date:
             return '未受付'
 
         # 【6】公開終了日が過去：受付終了
-        if end_date and end_date < select_date_str:
+        if end_date and end_date < select_date:
             return '受付終了'
 
         # 【7】上記以外：公開中
@@ -699,7 +647,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         
         # 2. '数量' 列を取得し、'0' なら「在庫0」
         stock_count = get_val('Amazon', code, '数量')
-        stock_status = "在庫0" if stock_count == '0' else ''
+        stock_status = "在庫0" if to_stock_number(stock_count) == 0 else ''
         
         if stock_status == "在庫0": 
             return '在庫0'
@@ -724,25 +672,25 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         stock_count = get_val('百選在庫', code, '在庫数')
 
         # 【2】公開フラグが 0：非表示
-        if public_flag == '0': return '非表示'
+        if to_number(public_flag) == 0: return '非表示'
 
         # 【3】在庫数が 0：在庫0
-        if stock_count == '0': return '在庫0'
+        if to_stock_number(stock_count) == 0: return '在庫0'
 
         # 【4】公開開始日時が未来：未受付
-        if pub_start and pub_start > select_date_str:
+        if pub_start and pub_start > select_date:
             return '未受付'
 
         # 【5】公開終了日時が過去：受付終了
-        if pub_end and pub_end < select_date_str:
+        if pub_end and pub_end < select_date:
             return '受付終了'
 
         # 【6】申込開始日時が未来：未受付
-        if apply_start and apply_start > select_date_str:
+        if apply_start and apply_start > select_date:
             return '未受付'
 
         # 【7】申込終了日時が過去：受付終了
-        if apply_end and apply_end < select_date_str:
+        if apply_end and apply_end < select_date:
             return '受付終了'
 
         # 上記以外：公開中
@@ -765,25 +713,25 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
         sales_end = format_date(get_val('ぐるなび', code, '販売期間指定(終了日時)'))
 
         # 【2】表示設定が "非表示"：非表示 ("公開設定"が0の場合)
-        if str(public_setting) == '0': return '非表示'
+        if to_number(public_setting) == 0: return '非表示'
 
         # 【3】在庫数が 0：在庫0 ("在庫設定"が0ではなく、「在庫数」が0の場合)
-        if str(stock_setting) != '0' and str(stock_count) == '0': return '在庫0'
+        if to_number(stock_setting) != 0 and to_stock_number(stock_count) == 0: return '在庫0'
 
         # 【4】公開開始指定日時が未来：未受付
-        if pub_start and pub_start > select_date_str:
+        if pub_start and pub_start > select_date:
             return '未受付'
 
         # 【5】公開終了指定日時が過去：受付終了
-        if pub_end and pub_end < select_date_str:
+        if pub_end and pub_end < select_date:
             return '受付終了'
 
         # 【6】販売期間指定(開始日時)が未来：未受付
-        if sales_start and sales_start > select_date_str:
+        if sales_start and sales_start > select_date:
             return '未受付'
 
         # 【7】販売期間指定(終了日時)が過去：受付終了
-        if sales_end and sales_end < select_date_str:
+        if sales_end and sales_end < select_date:
             return '受付終了'
 
         # 上記以外：公開中
@@ -810,7 +758,7 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
                 return '非表示'
 
             # 【3】 在庫数が 0 ⇒ 在庫0
-            if stock_count_raw == '0':
+            if to_stock_number(stock_count_raw) == 0:
                 return '在庫0'
 
             # 【4】 受付期間設定なし ⇒ 公開中
@@ -818,11 +766,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
                 return '公開中'
 
             # 【5】 受付開始日時が未来 ⇒ 未受付
-            if start_date and start_date > select_date_str:
+            if start_date and start_date > select_date:
                 return '未受付'
 
             # 【6】 受付終了日時が過去 ⇒ 受付終了
-            if end_date and end_date < select_date_str:
+            if end_date and end_date < select_date:
                 return '受付終了'
 
             # 【7】 上記以外 ⇒ 公開中
@@ -833,11 +781,11 @@ def calculate_status(portal, code, lookup_maps, parent_lookup_maps, select_date_
             target_col = '表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)'
             public_setting = get_val('あとギフ', code, target_col)
             
-            s_val = str(public_setting).strip()
+            s_val = to_number(public_setting)
             
-            if s_val == '0' or s_val == '0.0':
+            if s_val == 0:
                 return '非表示'
-            elif s_val == '1' or s_val == '1.0':
+            elif s_val == 1:
                 return '公開中'
                 
             return '公開中'
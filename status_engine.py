@@ -0,0 +1,795 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from lookup_index import LookupIndex
+from typed_columns import parse_date_column, number_array, normalize_keys, to_date_int, to_number, to_stock_number, STOCK_ZERO_WORDS, KEY_COL
+from code_dict import NO_CODE
+
+# --- ベクトル化ステータス判定エンジン ---
+# status.calculate_status と同じ判定順序を、ポータル1列分まとめて配列演算で計算する。
+# 返礼品コード×ポータルごとの関数呼び出しをなくし、列単位の boolean マスクと np.select で判定する。
+
+STATUS_ENGINE_LEGACY = 'legacy'         # status.calculate_status を1件ずつ呼び出す（従来方式）
+STATUS_ENGINE_VECTORIZED = 'vectorized' # 本モジュールで列単位に計算する
+
+# --- ステータスのコード表 ---
+# 結果の表はステータスを (返礼品コード × ポータル) の uint8 のコード行列で保持し、
+# 画面表示・出力時はこのコード表をカテゴリとする Categorical 列に変換する。
+STATUS_LABELS = ('', '-', '公開中', '未登録', '非表示', '倉庫', '在庫0', '注文不可', '未受付', '受付終了', '未実装')
+STATUS_BLANK = 0 # 空白 (子行が存在する楽天親行の他ポータル分)
+STATUS_NOT_APPLICABLE = 1 # '-' (対象外)
+STATUS_PUBLIC = 2 # 公開中
+STATUS_UNREGISTERED = 3 # 未登録
+
+
+def encode_statuses(values):
+    """ステータス文字列の配列 (または Categorical 列) をコード表の番号 (uint8) の配列に変換する"""
+    codes = pd.Categorical(values, categories=STATUS_LABELS).codes
+    if (codes < 0).any():
+        unknown = sorted({str(v) for v, c in zip(values, codes) if c < 0})
+        raise ValueError(f"ステータスのコード表にない値があります: {', '.join(unknown)}")
+    return codes.astype(np.uint8)
+
+
+def status_categorical(codes):
+    """コード表の番号の配列を Categorical 列 (カテゴリ: STATUS_LABELS) に変換する"""
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int8), categories=list(STATUS_LABELS))
+
+
+# --- チェック判定 (ステータスのコード行列から一括で判定する) ---
+# 行ごとに出現したステータスをビット (1 << コード) の論理和で集計し、
+# 「グレーゾーン以外」「グレーゾーン」のステータスの種類数をビット数で数える。
+
+def _status_bits(labels):
+    return sum(1 << STATUS_LABELS.index(label) for label in labels)
+
+
+# 「非表示」「在庫0」「受付終了」「倉庫」「注文不可」と '-' (対象外) をグレーゾーンとする
+_GRAY_BITS = _status_bits(['非表示', '在庫0', '受付終了', '倉庫', '注文不可', '-'])
+# グレーゾーン以外 (公開中、未登録など)。空白 (親コードの他ポータル分) は含めない
+_MAIN_BITS = _status_bits(STATUS_LABELS) & ~_GRAY_BITS & ~_status_bits([''])
+# 「他ポータルのステータスがない」とみなす値 ('-' と空白)
+_EMPTY_BITS = _status_bits(['-', ''])
+
+
+def _row_status_bits(status_matrix):
+    """行ごとに出現したステータスのビットの論理和"""
+    bits = np.zeros(len(status_matrix), dtype=np.int64)
+    for col in range(status_matrix.shape[1]):
+        bits |= np.left_shift(1, status_matrix[:, col].astype(np.int64))
+    return bits
+
+
+def _count_bits(bits, mask):
+    """mask に含まれるビットの数 (ステータスの種類数)"""
+    masked = bits & mask
+    return sum((masked >> code) & 1 for code in range(len(STATUS_LABELS)))
+
+
+def calculate_check_column(status_matrix, portals, is_rakuten_parent, is_choice_parent):
+    """
+    チェック列 ('公開' / '非公開' / '要確認' / 'OK') を全行まとめて計算する。
+    status_matrix: (返礼品コード × ポータル) のステータスのコード行列 (親行の '-' 調整済み)
+    portals: status_matrix の列に対応するポータル名のリスト
+    is_rakuten_parent / is_choice_parent: 行ごとの楽天親・チョイス親フラグ
+    """
+    status_matrix = np.asarray(status_matrix)
+    n_rows = len(status_matrix)
+    public = STATUS_LABELS.index('公開中')
+    row_bits = _row_status_bits(status_matrix)
+    has_public = (row_bits >> public) & 1 == 1
+
+    # 1ファイルのみの場合は、そのポータルが「公開中」なら「公開」、それ以外は「要確認」
+    if len(portals) == 1:
+        return np.where(has_public, '公開', '要確認').astype(object)
+
+    n_main = _count_bits(row_bits, _MAIN_BITS)
+    n_gray = _count_bits(row_bits, _GRAY_BITS)
+
+    def _special_rule(target):
+        """対象ポータル以外が全て '-' または空白の行と、その行の対象ポータルが「公開中」か"""
+        others = [i for i, p in enumerate(portals) if p != target]
+        single = (_row_status_bits(status_matrix[:, others]) & ~_EMPTY_BITS) == 0
+        target_public = status_matrix[:, portals.index(target)] == public if target in portals else np.zeros(n_rows, dtype=bool)
+        return single, target_public
+
+    # 楽天親・チョイス親の特例 (他ポータルが全てハイフンの場合は、親ポータルが「公開中」なら OK)
+    rakuten_single, rakuten_public = _special_rule('楽天')
+    choice_single, choice_public = _special_rule('チョイス')
+    rakuten_rule = np.asarray(is_rakuten_parent, dtype=bool) & rakuten_single
+    choice_rule = np.asarray(is_choice_parent, dtype=bool) & choice_single & ~rakuten_rule
+    special_ok = rakuten_rule & rakuten_public | choice_rule & choice_public
+    special_rule = rakuten_rule | choice_rule
+
+    # 通常判定: グレーゾーン以外が2種類以上、または1種類とグレーゾーンが混在する場合は要確認
+    needs_check = np.where(special_rule, ~special_ok, (n_main >= 2) | (n_main == 1) & (n_gray >= 1))
+
+    return np.select(
+        [needs_check, has_public, (n_main == 0) & (n_gray > 0)],
+        ['要確認', '公開', '非公開'],
+        'OK'
+    ).astype(object)
+
+
+def _code_array(codes):
+    """検索コードの配列にする (返礼品コードの ID 配列は整数のまま、それ以外は object 配列)"""
+    arr = np.asarray(codes)
+    return arr if arr.dtype.kind in 'iu' else np.asarray(codes, dtype=object)
+
+
+def _is_id_array(codes):
+    return codes.dtype.kind in 'iu'
+
+
+def _gather(index, codes, cols):
+    """
+    検索キー配列(codes)に対応する行を LookupIndex から取り出す。
+    戻り値: (列名 -> 値配列 の辞書, 行が見つかったかのマスク)
+    見つからない行・存在しない列の値は空文字とする（get_val と同じ）。
+    """
+    if not index:
+        n = len(codes)
+        return {c: np.full(n, '', dtype=object) for c in cols}, np.zeros(n, dtype=bool)
+    return index.take(codes, cols)
+
+
+def _date(arr):
+    """日付の配列を YYYYMMDD 形式の整数配列にする (format_date のベクトル版、空欄は 0)"""
+    return parse_date_column(arr).fillna(0).to_numpy(dtype=np.int64)
+
+
+def _num(arr):
+    """フラグ列の値を float 配列にする (to_number のベクトル版、空欄は NaN)"""
+    return number_array(arr)
+
+
+def _stock(arr):
+    """在庫数列の値を float 配列にする (to_stock_number のベクトル版、空欄は NaN)"""
+    return number_array(arr, STOCK_ZERO_WORDS)
+
+
+def _eq(arr, value):
+    """配列の各要素が value と一致するかのマスクを返す"""
+    return np.asarray(arr, dtype=object) == value
+
+
+def _select(conditions, default='公開中'):
+    """(条件マスク, ステータス) のリストを上から順に評価する"""
+    conds = [c for c, _ in conditions]
+    choices = [s for _, s in conditions]
+    return np.select(conds, choices, default=default).astype(object)
+
+
+def build_rakuten_group_table(rakuten_data):
+    """
+    楽天データから商品管理番号（商品URL）ごとのグループ集計表を作成する (キー: 商品管理番号の大文字)。
+    列: size (グループの行数), code_n / stock_n / warehouse_n (グループの n 行目の商品番号・在庫数・倉庫指定)
+    ステータス判定では2件グループの「相方の行」しか参照しないため、先頭2行分のみ保持する。
+    """
+    url_col = '商品管理番号（商品URL）'
+    if rakuten_data is None or rakuten_data.empty or url_col not in rakuten_data.columns:
+        return LookupIndex([], {})
+
+    # 商品番号は検索キー (取り込み時に正規化済み) で比較する
+    if KEY_COL in rakuten_data.columns:
+        codes = rakuten_data[KEY_COL]
+    elif '商品番号' in rakuten_data.columns:
+        codes = normalize_keys(rakuten_data['商品番号'])
+    else:
+        codes = ''
+
+    df = pd.DataFrame({
+        'mid': rakuten_data[url_col].astype(str).str.strip().str.upper(),
+        'code': codes,
+        # 在庫数は数値 (空欄は NaN)
+        'stock': _stock(rakuten_data['在庫数']) if '在庫数' in rakuten_data.columns else np.nan,
+        # 在庫行の「倉庫指定」または「SKU倉庫指定」が1なら倉庫扱い
+        'warehouse': (_num(rakuten_data['倉庫指定']) == 1) if '倉庫指定' in rakuten_data.columns else False,
+    }, index=rakuten_data.index)
+    if 'SKU倉庫指定' in rakuten_data.columns:
+        df['warehouse'] = df['warehouse'] | (_num(rakuten_data['SKU倉庫指定']) == 1)
+    df = df[df['mid'] != '']
+
+    grouped = df.groupby('mid', sort=False)
+    table = grouped.size().rename('size').to_frame()
+    for n in (1, 2):
+        nth_rows = grouped.nth(n - 1).set_index('mid')[['code', 'stock', 'warehouse']]
+        nth_rows.columns = [f'code_{n}', f'stock_{n}', f'warehouse_{n}']
+        table = table.join(nth_rows)
+
+    # 1件のみのグループは2行目を空とする (在庫数は NaN のまま)
+    table['code_2'] = table['code_2'].fillna('')
+    table['warehouse_2'] = table['warehouse_2'].eq(True)
+    return LookupIndex.from_frame(table.reset_index(), 'mid')
+
+
+def _rakuten_group_partner(codes, group_keys, group_table):
+    """
+    グループ(商品管理番号)が2件の場合の「相方の行」の在庫数・倉庫指定を返す。
+    グループが2件以外、または相方がいない場合は None 相当(見つからない)とする。
+    """
+    group, group_found = _gather(group_table, group_keys,
+                                 ['size', 'code_1', 'stock_1', 'warehouse_1', 'code_2', 'stock_2', 'warehouse_2'])
+    group_len = np.where(group_found, group['size'], 0).astype(np.int64)
+    pair = group_len == 2
+
+    # 自分自身(現在の商品番号)でない最初の行が相方
+    use_first = pair & (group['code_1'] != codes)
+    use_second = pair & ~use_first & (group['code_2'] != codes)
+
+    partner_found = use_first | use_second
+    partner_stock = np.where(use_first, _stock(group['stock_1']), np.where(use_second, _stock(group['stock_2']), np.nan))
+    partner_warehouse = np.where(use_first, group['warehouse_1'], np.where(use_second, group['warehouse_2'], False)).astype(bool)
+    return group_len, partner_found, partner_stock, partner_warehouse
+
+
+# --- 判定ルール表 ---
+# ポータルごとの判定を (条件, ステータス) の順序つきリストで宣言する (上から順に評価し、最初に当てはまったものを採用)。
+# PortalRules がルール表を1回だけコンパイルし、列単位のベクトル版 (evaluate) と
+# 1件ずつのスカラー版 (evaluate_one: どのルールで決まったかも返すデバッグ用) の判定関数を作る。
+# 条件は次のタプルで書く (col はルール表の検索先シートの列名):
+#   ('missing',)               行が見つからない
+#   ('blank', col)             値が空欄
+#   ('eq', col, value)         値が value と一致する
+#   ('zero', col)              フラグが数値の 0
+#   ('num_in', col, numbers)   フラグの数値が numbers のいずれか
+#   ('stock_zero', col)        在庫数が 0 (「在庫0」という値を含む)
+#   ('future', col)            日付が設定済みで、基準日より後
+#   ('past', col)              日付が設定済みで、基準日より前
+#   ('flag', col)              解決関数 (resolve) が作成した真偽値の列が True
+#   ('any', cond, ...) / ('all', cond, ...) / ('not', cond)
+
+
+def _scalar_date(value):
+    return to_date_int(value) or 0
+
+
+_VALUE_PARSERS = {
+    # 種類 -> (ベクトル版, スカラー版)
+    'raw': (lambda arr: np.asarray(arr, dtype=object), lambda value: value),
+    'num': (_num, to_number),
+    'stock': (_stock, to_stock_number),
+    'date': (_date, _scalar_date),
+    'flag': (lambda arr: np.asarray(arr, dtype=bool), bool),
+}
+
+
+class _RuleContext:
+    """1回の判定で参照する列の値 (同じ列の変換は1回だけ行う)"""
+
+    def __init__(self, values, found, select_date, index=None):
+        self.values = values
+        self.found = found
+        self.select_date = select_date
+        self.index = index # スカラー版で参照する行 (ベクトル版は None)
+        self._parsed = {}
+
+    def get(self, kind, col):
+        key = (kind, col)
+        if key not in self._parsed:
+            vector_parser, scalar_parser = _VALUE_PARSERS[kind]
+            arr = self.values[col]
+            if self.index is None:
+                self._parsed[key] = vector_parser(arr)
+            else:
+                self._parsed[key] = scalar_parser(arr[self.index])
+        return self._parsed[key]
+
+
+def _date_axis(values, select_date):
+    """基準日が配列 (複数日付) の場合、列の値を (行数, 1) にして日付の軸でブロードキャストできるようにする"""
+    if isinstance(select_date, np.ndarray) and isinstance(values, np.ndarray) and values.ndim == 1:
+        return values[:, None]
+    return values
+
+
+def _compile_condition(cond):
+    """条件のタプルを (ベクトル版, スカラー版) の関数の組に変換する"""
+    op, args = cond[0], cond[1:]
+    if op == 'missing':
+        return (lambda ctx: ~ctx.found), (lambda ctx: not ctx.found[ctx.index])
+    if op == 'blank':
+        col, = args
+        return (lambda ctx: ctx.get('raw', col) == ''), (lambda ctx: ctx.get('raw', col) == '')
+    if op == 'eq':
+        col, value = args
+        return (lambda ctx: ctx.get('raw', col) == value), (lambda ctx: ctx.get('raw', col) == value)
+    if op == 'zero':
+        col, = args
+        return (lambda ctx: ctx.get('num', col) == 0), (lambda ctx: ctx.get('num', col) == 0)
+    if op == 'num_in':
+        col, numbers = args
+        return ((lambda ctx: np.isin(ctx.get('num', col), numbers)),
+                (lambda ctx: ctx.get('num', col) in numbers))
+    if op == 'stock_zero':
+        col, = args
+        return (lambda ctx: ctx.get('stock', col) == 0), (lambda ctx: ctx.get('stock', col) == 0)
+    if op in ('future', 'past'):
+        col, = args
+        if op == 'future':
+            compare = lambda date, select_date: (date > 0) & (date > select_date)
+        else:
+            compare = lambda date, select_date: (date > 0) & (date < select_date)
+        return ((lambda ctx: compare(_date_axis(ctx.get('date', col), ctx.select_date), ctx.select_date)),
+                (lambda ctx: bool(compare(ctx.get('date', col), ctx.select_date))))
+    if op == 'flag':
+        col, = args
+        return (lambda ctx: ctx.get('flag', col)), (lambda ctx: ctx.get('flag', col))
+    if op in ('any', 'all', 'not'):
+        compiled = [_compile_condition(c) for c in args]
+        vectors = [v for v, _ in compiled]
+        scalars = [s for _, s in compiled]
+        if op == 'not':
+            (vector, scalar), = compiled
+            return (lambda ctx: ~vector(ctx)), (lambda ctx: not scalar(ctx))
+        # 基準日が複数の場合は (行数, 1) と (行数, 日付数) のマスクが混ざるため、ブロードキャストして結合する
+        if op == 'any':
+            return ((lambda ctx: reduce(np.logical_or, [_date_axis(v(ctx), ctx.select_date) for v in vectors])),
+                    (lambda ctx: any(s(ctx) for s in scalars)))
+        return ((lambda ctx: reduce(np.logical_and, [_date_axis(v(ctx), ctx.select_date) for v in vectors])),
+                (lambda ctx: all(s(ctx) for s in scalars)))
+    raise ValueError(f'不明な判定条件です: {cond!r}')
+
+
+def _uses_date(cond):
+    """条件が基準日に依存するか (future / past を含むか)"""
+    op, args = cond[0], cond[1:]
+    if op in ('any', 'all', 'not'):
+        return any(_uses_date(c) for c in args)
+    return op in ('future', 'past')
+
+
+def _date_conditions(cond):
+    """条件に含まれる日付の条件 (future / past, 列名) のリストを返す"""
+    op, args = cond[0], cond[1:]
+    if op in ('any', 'all', 'not'):
+        return [date_cond for c in args for date_cond in _date_conditions(c)]
+    if op in ('future', 'past'):
+        return [(op, args[0])]
+    return []
+
+
+def _next_day(dates):
+    """YYYYMMDD 形式の整数配列の翌日を返す (0 は 0 のまま)"""
+    months = ((dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (dates % 100) # 月初 + 日数 = 翌日
+    next_months = days.astype('datetime64[M]')
+    next_dates = ((next_months.astype(np.int64) // 12 + 1970) * 10000
+                  + (next_months.astype(np.int64) % 12 + 1) * 100
+                  + (days - next_months.astype('datetime64[D]')).astype(np.int64) + 1)
+    return np.where(dates > 0, next_dates, 0)
+
+
+def _condition_columns(cond):
+    """条件が参照する列名を返す"""
+    op, args = cond[0], cond[1:]
+    if op in ('any', 'all', 'not'):
+        return [col for c in args for col in _condition_columns(c)]
+    if op == 'missing':
+        return []
+    return [args[0]]
+
+
+class PortalRules:
+    """
+    ポータル1つ分の判定ルール表をコンパイルしたもの。
+    variants: ルール表のリスト。各ルール表は次のキーを持つ辞書。
+      rules    : (条件, ステータス) のリスト (上から順に評価)
+      sheet    : 検索先のシート名 (省略時はポータル名)
+      joins    : 同じ返礼品コードで検索する別シート -> 列名のリスト (例: 百選在庫の在庫数)
+      resolve  : 列の値を独自に作る関数 (codes, lookup_maps, **kwargs) -> (列名 -> 値配列, 行が見つかったかのマスク)
+      requires : 検索先シートにこの列がある場合のみ使うルール表 (データの形式が複数あるポータル用)
+    """
+
+    def __init__(self, portal, variants, default='公開中'):
+        self.portal = portal
+        self.default = default
+        self.variants = []
+        for variant in variants:
+            rules = list(variant['rules'])
+            columns = list(dict.fromkeys(col for cond, _ in rules for col in _condition_columns(cond)))
+            joins = variant.get('joins', {})
+            joined = {col for cols in joins.values() for col in cols}
+            self.variants.append({
+                'sheet': variant.get('sheet', portal),
+                'joins': joins,
+                'resolve': variant.get('resolve'),
+                'requires': variant.get('requires'),
+                'rules': rules,
+                'columns': [col for col in columns if col not in joined],
+                'compiled': [_compile_condition(cond) for cond, _ in rules],
+                'uses_date': [_uses_date(cond) for cond, _ in rules],
+                'date_conditions': list(dict.fromkeys(dc for cond, _ in rules for dc in _date_conditions(cond))),
+                'statuses': [status for _, status in rules],
+            })
+
+    def _variant(self, lookup_maps):
+        """検索先シートの列から使うルール表を選ぶ"""
+        for variant in self.variants:
+            requires = variant['requires']
+            table = lookup_maps.get(variant['sheet'])
+            if requires is None or (table is not None and requires in table.columns):
+                return variant
+        return self.variants[-1]
+
+    def _context(self, variant, codes, lookup_maps, select_date_str, kwargs, index=None):
+        if variant['resolve'] is not None:
+            values, found = variant['resolve'](codes, lookup_maps, **kwargs)
+        else:
+            values, found = _gather(lookup_maps.get(variant['sheet']), codes, variant['columns'])
+            for sheet, cols in variant['joins'].items():
+                joined, _ = _gather(lookup_maps.get(sheet), codes, cols)
+                values.update(joined)
+        return _RuleContext(values, found, int(select_date_str) if select_date_str else None, index)
+
+    def prepare(self, codes, lookup_maps, **kwargs):
+        """ベクトル版の前処理: 基準日に依存しない条件を評価した PreparedStatusColumn を返す"""
+        variant = self._variant(lookup_maps)
+        ctx = self._context(variant, _code_array(codes), lookup_maps, None, kwargs)
+        static_masks = [None if uses_date else vector(ctx)
+                        for (vector, _), uses_date in zip(variant['compiled'], variant['uses_date'])]
+        return PreparedStatusColumn(len(codes), self.default, variant, ctx, static_masks)
+
+    def evaluate(self, codes, lookup_maps, select_date_str, **kwargs):
+        """ベクトル版: codes (検索キーまたは ID の配列) のステータス配列を返す"""
+        return self.prepare(codes, lookup_maps, **kwargs).evaluate(select_date_str)
+
+    def evaluate_one(self, code, lookup_maps, select_date_str, **kwargs):
+        """
+        スカラー版: 1件のコードのステータスと、決め手になったルールを返す (デバッグ用)
+        戻り値: (ステータス, ルール (条件, ステータス)、どれにも当てはまらない場合は None)
+        """
+        variant = self._variant(lookup_maps)
+        ctx = self._context(variant, _code_array([code]), lookup_maps, select_date_str, kwargs, index=0)
+        for (_, scalar), rule in zip(variant['compiled'], variant['rules']):
+            if scalar(ctx):
+                return rule[1], rule
+        return self.default, None
+
+
+class PreparedStatusColumn:
+    """
+    ポータル1列分の判定の途中結果 (検索済みの列の値と、基準日に依存しない条件のマスク)。
+    基準日だけを変えて再計算する場合は、日付の条件 (future / past) のみ評価し直す。
+    """
+
+    def __init__(self, size, default, variant=None, ctx=None, static_masks=None):
+        self.size = size
+        self.default = default
+        self._variant = variant
+        self._ctx = ctx
+        self._static_masks = static_masks
+
+    def evaluate(self, select_date_str):
+        """基準日 (YYYYMMDD) のステータス配列を返す"""
+        if self._variant is None:
+            return np.full(self.size, self.default, dtype=object)
+        self._ctx.select_date = int(select_date_str)
+        masks = [mask if mask is not None else vector(self._ctx)
+                 for mask, (vector, _) in zip(self._static_masks, self._variant['compiled'])]
+        return _select(list(zip(masks, self._variant['statuses'])), default=self.default)
+
+    def evaluate_dates(self, select_date_strs):
+        """
+        複数の基準日 (YYYYMMDD のリスト) のステータスを一度に評価する。
+        日付の条件は (行数, 日付数) に、日付以外の条件のマスクは日付の軸にブロードキャストする。
+        戻り値: (行数, 日付数) のステータス配列
+        """
+        if self._variant is None:
+            return np.full((self.size, len(select_date_strs)), self.default, dtype=object)
+        return self._evaluate_at(np.array([int(d) for d in select_date_strs], dtype=np.int64))
+
+    def _evaluate_at(self, select_dates):
+        """基準日の配列 (日付数,) または行ごとの基準日 (行数, 日付数) で評価し、(行数, 日付数) のステータス配列を返す"""
+        self._ctx.select_date = select_dates
+        try:
+            masks = [mask[:, None] if mask is not None else vector(self._ctx)
+                     for mask, (vector, _) in zip(self._static_masks, self._variant['compiled'])]
+        finally:
+            self._ctx.select_date = None
+        statuses = _select(list(zip(masks, self._variant['statuses'])), default=self.default)
+        return np.broadcast_to(statuses, (self.size, select_dates.shape[-1])).copy()
+
+    def next_change(self, select_date_str):
+        """
+        基準日より後で最初にステータスが変わる日と、変わった後のステータスを返す。
+        ステータスが変わりうるのは日付の条件の境目 (future: 日付の当日、past: 日付の翌日) のみのため、
+        行ごとの境目をそれぞれ基準日として評価し、基準日のステータスと異なる最初の境目を選ぶ。
+        戻り値: (次回変更日 (YYYYMMDD、変更がなければ 0) の配列, 変更後のステータスの配列 (変更がなければ ''))
+        """
+        next_dates = np.zeros(self.size, dtype=np.int64)
+        next_statuses = np.full(self.size, '', dtype=object)
+        if self._variant is None or not self._variant['date_conditions'] or self.size == 0:
+            return next_dates, next_statuses
+
+        select_date = int(select_date_str)
+        no_date = np.iinfo(np.int64).max
+        boundaries = []
+        for op, col in self._variant['date_conditions']:
+            dates = self._ctx.get('date', col)
+            boundary = dates if op == 'future' else _next_day(dates)
+            boundaries.append(np.where((dates > 0) & (boundary > select_date), boundary, no_date))
+        boundaries = np.sort(np.stack(boundaries, axis=1), axis=1) # 行ごとに境目の日付を昇順に並べる
+        has_boundary = boundaries != no_date
+
+        current = self.evaluate(select_date_str)
+        statuses = self._evaluate_at(np.where(has_boundary, boundaries, select_date))
+        changed = has_boundary & (statuses != current[:, None])
+        rows = np.flatnonzero(changed.any(axis=1))
+        first = changed[rows].argmax(axis=1)
+        next_dates[rows] = boundaries[rows, first]
+        next_statuses[rows] = statuses[rows, first]
+        return next_dates, next_statuses
+
+
+# --- 列の値を独自に作るポータル (resolve) ---
+
+def _resolve_choice(codes, lookup_maps, **kwargs):
+    """チョイス: 子コードで見つからない場合は親コード(サフィックスあり)で再検索し、在庫は在庫ファイルから取得する"""
+    table = lookup_maps.get('チョイス')
+
+    _, found = _gather(table, codes, [])
+    if _is_id_array(codes):
+        # ID の場合は辞書で親コードの ID を引く (辞書がなければ再検索しない)
+        code_dictionary = kwargs.get('code_dictionary')
+        if code_dictionary is not None:
+            parent_codes = code_dictionary.lookup(code_dictionary.decode(codes) + '（チョイス親）')
+        else:
+            parent_codes = np.full(len(codes), NO_CODE, dtype=np.int32)
+    else:
+        parent_codes = np.array([str(c).strip() + '（チョイス親）' for c in codes], dtype=object)
+    actual_codes = np.where(found, codes, parent_codes)
+    values, found = _gather(table, actual_codes, [97, 98, 99])
+
+    stock_values, _ = _gather(lookup_maps.get('チョイス在庫'), actual_codes, [4])
+    values['在庫数'] = stock_values[4]
+    return values, found
+
+
+def _resolve_rakuten(codes, lookup_maps, **kwargs):
+    """楽天: 商品行・親情報の管理行・商品管理番号のグループ (2件の場合の相方の行) から判定に使う値を作る"""
+    product_table = kwargs.get('rakuten_product_id_map')
+    management_table = kwargs.get('rakuten_management_id_map')
+    group_table = kwargs.get('rakuten_group_table')
+
+    product_cols = ['商品管理番号（商品URL）', '在庫数', '倉庫指定', 'サーチ表示', '注文ボタン',
+                    '販売期間指定（開始日時）', '販売期間指定（終了日時）', KEY_COL]
+    product, product_found = _gather(product_table, codes, product_cols)
+    # グループ集計表の商品番号 (検索キー) と比較するコード (ID の場合は商品行の検索キー)
+    own_codes = product[KEY_COL] if _is_id_array(codes) else codes
+
+    # ■ Z列 (SKU親コード)
+    sku_parent_raw = product['商品管理番号（商品URL）']
+    sku_parent_code = pd.Series(sku_parent_raw, dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    is_unregistered = ~product_found | _eq(sku_parent_raw, '') | _eq(sku_parent_raw, 'なし') | _eq(sku_parent_code, 'なし')
+    has_parent_code = sku_parent_code != ''
+    group_keys = pd.Series(sku_parent_code, dtype=object).str.upper().to_numpy(dtype=object)
+
+    # 親情報の管理行 (商品管理番号が空の場合は参照しない)
+    management_cols = ['サーチ表示', '注文ボタン', '販売期間指定（開始日時）', '販売期間指定（終了日時）']
+    management, _ = _gather(management_table, np.where(has_parent_code, group_keys, None), management_cols)
+
+    group_len, partner_found, partner_stock, partner_warehouse = _rakuten_group_partner(own_codes, group_keys, group_table)
+
+    # ■ 在庫数: 自身の値がなければ、ペア(2件)グループの相方の値を使う
+    own_stock = _stock(product['在庫数'])
+    stock = np.where(~np.isnan(own_stock), own_stock, np.where(partner_found, partner_stock, np.nan))
+
+    # ■ 倉庫指定: 自身が1、またはペア(2件)グループの相方が倉庫
+    warehouse = (_num(product['倉庫指定']) == 1) | partner_found & partner_warehouse
+
+    def _own_or_management(col):
+        return np.where(product[col] != '', product[col], management[col])
+
+    values = {
+        '在庫数': stock,
+        '倉庫': warehouse,
+        # ■ サーチ表示 (商品管理番号があれば管理行、なければ商品行)
+        'サーチ表示': np.where(has_parent_code, management['サーチ表示'], product['サーチ表示']),
+        '注文ボタン': _own_or_management('注文ボタン'),
+        '販売期間指定（開始日時）': _own_or_management('販売期間指定（開始日時）'),
+        '販売期間指定（終了日時）': _own_or_management('販売期間指定（終了日時）'),
+    }
+    # 商品管理番号が空・「なし」の行も未登録とする
+    return values, ~is_unregistered
+
+
+def _resolve_satofuru(codes, lookup_maps, **kwargs):
+    """さとふる: 在庫ファイルは「お礼品ID」の値で検索する (どちらかで見つからなければ未登録)"""
+    values, found = _gather(lookup_maps.get('さとふる'), codes, ['公開フラグ', 'お礼品ID'])
+    sato_ids = normalize_keys(values['お礼品ID']).to_numpy(dtype=object)
+    sato_ids = np.where(sato_ids != '', sato_ids, None)
+    stock, stock_found = _gather(lookup_maps.get('さとふる在庫'), sato_ids, ['全在庫数', '受付開始日', '受付終了日'])
+    values.update(stock)
+    return values, found & stock_found
+
+
+# --- ポータル別のルール表 ---
+# 各ルール表は calculate_status の該当ブロックと同じ順序で条件を並べている。
+
+def _window_rules(sold_out_label, display_col, stock_setting_col=None):
+    """JAL・まいふる・マイナビ共通のルール表（ステータス＋表示設定＋在庫＋表示期間＋寄附期間）"""
+    stock_zero = ('stock_zero', '在庫数')
+    if stock_setting_col:
+        # 在庫数の値、または在庫数が空欄の場合の在庫設定の値をそのまま在庫ステータスとする (JAL)
+        stock_zero = ('any', stock_zero, ('all', ('blank', '在庫数'), ('eq', stock_setting_col, '在庫0')))
+    return [
+        (('missing',), '未登録'),
+        (('blank', 'ステータス'), '未登録'),
+        (('any', ('eq', 'ステータス', sold_out_label), ('eq', 'ステータス', '受付終了')), '受付終了'),
+        (('eq', display_col, '非表示'), '非表示'),
+        (stock_zero, '在庫0'),
+        (('future', '表示開始日時'), '未受付'),
+        (('past', '表示終了日時'), '受付終了'),
+        (('future', '寄附開始日時'), '未受付'),
+        (('past', '寄附終了日時'), '受付終了'),
+    ]
+
+
+PORTAL_RULES = {
+    'チョイス': [{
+        'resolve': _resolve_choice,
+        'rules': [
+            (('missing',), '未登録'),
+            (('blank', 97), '未登録'),
+            (('zero', 97), '非表示'),
+            # 数値の0、または「在庫0」という値そのもの
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('future', 98), '未受付'),
+            (('past', 99), '受付終了'),
+        ],
+    }],
+    '楽天': [{
+        'resolve': _resolve_rakuten,
+        'rules': [
+            (('missing',), '未登録'),
+            (('flag', '倉庫'), '倉庫'),
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('zero', 'サーチ表示'), '非表示'),
+            (('zero', '注文ボタン'), '注文不可'),
+            (('future', '販売期間指定（開始日時）'), '未受付'),
+            (('past', '販売期間指定（終了日時）'), '受付終了'),
+        ],
+    }],
+    'さとふる': [{
+        'resolve': _resolve_satofuru,
+        'rules': [
+            (('missing',), '未登録'),
+            (('num_in', '公開フラグ', (2,)), '非表示'),
+            (('stock_zero', '全在庫数'), '在庫0'),
+            (('future', '受付開始日'), '未受付'),
+            (('past', '受付終了日'), '受付終了'),
+        ],
+    }],
+    'JRE': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('any', ('eq', '掲載ステータス', '掲載不可'), ('future', '掲載期間（開始）'), ('past', '掲載期間（終了）')), '非表示'),
+            (('all', ('not', ('eq', '在庫扱いの種別', '無制限')), ('stock_zero', '在庫数')), '在庫0'),
+            (('future', '販売期間（開始）'), '未受付'),
+            (('past', '販売期間（終了）'), '受付終了'),
+        ],
+    }],
+    'ANA': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('blank', '状態(掲載フラグ)'), '未登録'),
+            (('num_in', '状態(掲載フラグ)', (1, 9)), '非表示'),
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('future', '掲載開始日'), '未受付'),
+            (('past', '掲載終了日'), '受付終了'),
+            (('future', '販売開始日'), '未受付'),
+            (('past', '販売終了日'), '受付終了'),
+        ],
+    }],
+    'ふるなび': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('blank', '販売フラグ'), '未登録'),
+            (('any', ('eq', '販売フラグ', 'off'), ('eq', '公開フラグ', 'off')), '非表示'),
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('future', '公開開始日'), '未受付'),
+            (('past', '公開終了日'), '受付終了'),
+        ],
+    }],
+    'JAL': [{'rules': _window_rules('品切れ', '表示設定', stock_setting_col='在庫設定')}],
+    'まいふる': [{'rules': _window_rules('売り切れ', '状態')}],
+    'マイナビ': [{'rules': _window_rules('売り切れ', '表示設定')}],
+    'プレミアム': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('blank', '公開ステータス'), '未登録'),
+            (('eq', '公開ステータス', '非公開/下書き'), '非表示'),
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('future', '公開開始日時'), '未受付'),
+            (('past', '公開終了日時'), '受付終了'),
+        ],
+    }],
+    'Amazon': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('stock_zero', '数量'), '在庫0'),
+        ],
+    }],
+    '百選': [{
+        'joins': {'百選在庫': ['在庫数']},
+        'rules': [
+            (('missing',), '未登録'),
+            (('zero', '公開フラグ'), '非表示'),
+            (('stock_zero', '在庫数'), '在庫0'),
+            (('future', '公開開始日時'), '未受付'),
+            (('past', '公開終了日時'), '受付終了'),
+            (('future', '申込開始日時'), '未受付'),
+            (('past', '申込終了日時'), '受付終了'),
+        ],
+    }],
+    'ぐるなび': [{
+        'rules': [
+            (('missing',), '未登録'),
+            (('zero', '公開設定'), '非表示'),
+            (('all', ('not', ('zero', '在庫設定')), ('stock_zero', '在庫数')), '在庫0'),
+            (('future', '公開開始指定日時'), '未受付'),
+            (('past', '公開終了指定日時'), '受付終了'),
+            (('future', '販売期間指定(開始日時)'), '未受付'),
+            (('past', '販売期間指定(終了日時)'), '受付終了'),
+        ],
+    }],
+    'あとギフ': [
+        # データ（列）で判断: 「販売フラグ」列があればふるなび形式
+        {
+            'requires': '販売フラグ',
+            'rules': [
+                (('missing',), '未登録'),
+                (('any', ('eq', '販売フラグ', 'off'), ('eq', '公開フラグ', 'off')), '非表示'),
+                (('stock_zero', '在庫数'), '在庫0'),
+                (('future', '受付開始日時'), '未受付'),
+                (('past', '受付終了日時'), '受付終了'),
+            ],
+        },
+        # チョイス形式
+        {
+            'rules': [
+                (('missing',), '未登録'),
+                (('zero', '表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)'), '非表示'),
+            ],
+        },
+    ],
+}
+
+# ルール表はモジュール読み込み時に1回だけコンパイルする
+_COMPILED_RULES = {portal: PortalRules(portal, variants) for portal, variants in PORTAL_RULES.items()}
+
+
+def calculate_status_column(portal, codes, lookup_maps, select_date_str, **kwargs):
+    """
+    ポータル1列分の掲載ステータスを計算する (calculate_status のベクトル版)
+    codes: 検索に使う返礼品コード (検索キー KEY_COL) または返礼品コードの ID (KEY_ID_COL) の配列（1要素 = 結果1行）
+    lookup_maps: シート名 -> LookupIndex (キー: 正規化済みの検索キー KEY_COL、ID で検索する場合は id_col 指定で作成したもの)
+    kwargs: ID で検索する場合、チョイスの親コードの再検索用に code_dictionary (CodeDictionary) を渡す
+    戻り値: codes と同じ長さのステータス文字列配列
+    """
+    return prepare_status_column(portal, codes, lookup_maps, **kwargs).evaluate(select_date_str)
+
+
+def prepare_status_column(portal, codes, lookup_maps, **kwargs):
+    """
+    calculate_status_column の基準日に依存しない部分 (検索と、日付以外の条件) を先に計算する。
+    戻り値の PreparedStatusColumn.evaluate(select_date_str) でステータス配列を返す (引数は calculate_status_column と同じ)
+    """
+    rules = _COMPILED_RULES.get(portal)
+    if rules is None:
+        return PreparedStatusColumn(len(codes), '未実装')
+    return rules.prepare(codes, lookup_maps, **kwargs)
+
+
+def explain_status(portal, code, lookup_maps, select_date_str, **kwargs):
+    """
+    1件の返礼品コードのステータスと、決め手になったルール (条件, ステータス) を返す (判定のデバッグ用)
+    引数は calculate_status_column と同じ (code は1件のコードまたは ID)
+    """
+    rules = _COMPILED_RULES.get(portal)
+    if rules is None:
+        return '未実装', None
+    return rules.evaluate_one(code, lookup_maps, select_date_str, **kwargs)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# リポジトリ直下のモジュール (rakuten_preprocess など) をテストから import できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
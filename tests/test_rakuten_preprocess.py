@@ -0,0 +1,133 @@
+"""
+楽天の前処理 (fill-down・親判定) の回帰テスト。
+rakuten_preprocess.preprocess_rakuten (transform による一括処理) と、
+書き換え前の処理 (groupby().first() + map、グループごとのループ) の出力が一致することを確認する。
+"""
+import random
+
+import pandas as pd
+import pytest
+
+from rakuten_preprocess import preprocess_rakuten, RAKUTEN_FILL_TARGETS, RAKUTEN_URL_COL as URL_COL
+
+RAKUTEN_COLUMNS = [
+    URL_COL, '商品番号', '商品名', '倉庫指定', 'サーチ表示', '販売期間指定（開始日時）', '販売期間指定（終了日時）',
+    '注文ボタン', 'SKU管理番号', 'システム連携用SKU番号', '在庫数', 'SKU倉庫指定',
+]
+
+
+def legacy_rakuten_branch(df):
+    """書き換え前の楽天の前処理 (groupby().first() の map と、3行以上のグループの先頭行を探すループ)"""
+    grouped_first = df.groupby(URL_COL)[RAKUTEN_FILL_TARGETS].first()
+    for col in RAKUTEN_FILL_TARGETS:
+        df[col] = df[URL_COL].map(grouped_first[col])
+
+    group_counts = df[URL_COL].value_counts()
+    large_group_urls = group_counts[group_counts >= 3].index
+    if not large_group_urls.empty:
+        df_large = df[df[URL_COL].isin(large_group_urls)]
+        indices_to_modify = [group.index[0] for _, group in df_large.groupby(URL_COL)]
+        if indices_to_modify:
+            df.loc[indices_to_modify, '商品番号'] = df.loc[indices_to_modify, '商品番号'].astype(str) + '（楽天親）'
+
+    mask_sku = df['システム連携用SKU番号'] != ''
+    df.loc[mask_sku, '商品番号'] = df.loc[mask_sku, 'システム連携用SKU番号']
+    mask_warehouse = df['SKU倉庫指定'] != ''
+    df.loc[mask_warehouse, '倉庫指定'] = df.loc[mask_warehouse, 'SKU倉庫指定']
+    return df
+
+
+def _frame(rows):
+    """楽天のダウンロードデータと同じく、全列を文字列 (空欄は '') とした DataFrame を作る"""
+    return pd.DataFrame([{col: row.get(col, '') for col in RAKUTEN_COLUMNS} for row in rows], dtype=object)
+
+
+def _assert_same_output(df):
+    expected = legacy_rakuten_branch(df.copy())
+    actual = preprocess_rakuten(df.copy())
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+# 商品行の下に SKU 行 (商品番号・商品名などが空欄) が続く、楽天の商品データの並び
+FIXTURES = {
+    # 親行 + 子 (SKU) 行2件 -> 3行のグループの先頭行は親 (（楽天親）を付与)
+    'parent_with_children': [
+        {URL_COL: 'item-a', '商品番号': 'A001', '商品名': '商品A', 'サーチ表示': '表示', '注文ボタン': '1',
+         '販売期間指定（開始日時）': '2025/01/01 00:00', '販売期間指定（終了日時）': '2025/12/31 23:59'},
+        {URL_COL: 'item-a', 'SKU管理番号': 's1', 'システム連携用SKU番号': 'A001-1', '在庫数': '5'},
+        {URL_COL: 'item-a', 'SKU管理番号': 's2', 'システム連携用SKU番号': 'A001-2', '在庫数': '0', 'SKU倉庫指定': '1'},
+    ],
+    # 子行のない商品 (1行・2行のグループ) は親にしない
+    'parent_without_children': [
+        {URL_COL: 'item-b', '商品番号': 'B001', '商品名': '商品B', 'サーチ表示': '表示', '倉庫指定': '0'},
+        {URL_COL: 'item-c', '商品番号': 'C001', '商品名': '商品C', 'サーチ表示': '非表示', '注文ボタン': '0'},
+        {URL_COL: 'item-c', 'システム連携用SKU番号': 'C001', '在庫数': '3'},
+    ],
+    # 複数のグループと、商品番号が空欄の行が続く区間 (SKU 番号もない行は空欄のまま)
+    'blank_item_number_runs': [
+        {URL_COL: 'item-d', '商品番号': 'D001', '商品名': '商品D', 'サーチ表示': '表示', '注文ボタン': '1'},
+        {URL_COL: 'item-d'},
+        {URL_COL: 'item-d'},
+        {URL_COL: 'item-d', 'システム連携用SKU番号': 'D001-3'},
+        {URL_COL: 'item-e', '商品番号': 'E001', '商品名': '商品E', '販売期間指定（開始日時）': '2025/06/01'},
+        {URL_COL: 'item-e'},
+        {URL_COL: 'item-f', '商品番号': 'F001', '商品名': '商品F'},
+        {URL_COL: 'item-f', 'システム連携用SKU番号': 'F001-1'},
+        {URL_COL: 'item-f', 'システム連携用SKU番号': 'F001-2', 'SKU倉庫指定': '1'},
+        {URL_COL: 'item-f', 'システム連携用SKU番号': 'F001-3'},
+    ],
+    # 先頭行の値が空欄のグループ (fill-down は先頭行の値をそのまま展開する) と、商品管理番号が空欄の行
+    'blank_first_values_and_urls': [
+        {URL_COL: 'item-g', '商品番号': 'G001'},
+        {URL_COL: 'item-g', '商品名': '子行の商品名', 'サーチ表示': '表示'},
+        {URL_COL: 'item-g', 'システム連携用SKU番号': 'G001-2'},
+        {URL_COL: '', '商品番号': 'X001', '商品名': 'URLなし1'},
+        {URL_COL: '', '商品番号': 'X002', '商品名': 'URLなし2'},
+        {URL_COL: '', '商品番号': 'X003'},
+    ],
+    # 同じ商品管理番号の行が離れている場合も、最初に出現した行を親とする
+    'non_contiguous_group': [
+        {URL_COL: 'item-h', '商品番号': 'H001', '商品名': '商品H'},
+        {URL_COL: 'item-i', '商品番号': 'I001', '商品名': '商品I'},
+        {URL_COL: 'item-h', 'システム連携用SKU番号': 'H001-1'},
+        {URL_COL: 'item-i', 'システム連携用SKU番号': 'I001-1'},
+        {URL_COL: 'item-h', 'システム連携用SKU番号': 'H001-2'},
+    ],
+}
+
+
+@pytest.mark.parametrize('name', list(FIXTURES))
+def test_matches_legacy_output(name):
+    _assert_same_output(_frame(FIXTURES[name]))
+
+
+def test_parent_tagging():
+    df = preprocess_rakuten(_frame(FIXTURES['parent_with_children'] + FIXTURES['parent_without_children']))
+    assert df['商品番号'].tolist() == ['A001（楽天親）', 'A001-1', 'A001-2', 'B001', 'C001', 'C001']
+    assert df['商品名'].tolist() == ['商品A', '商品A', '商品A', '商品B', '商品C', '商品C']
+    assert df['倉庫指定'].tolist() == ['', '', '1', '0', '', '']
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_legacy_output_random(seed):
+    rng = random.Random(seed)
+    rows = []
+    for group in range(rng.randint(1, 8)):
+        url = rng.choice([f'item-{group}', ''])
+        for i in range(rng.randint(1, 5)):
+            rows.append({
+                URL_COL: url,
+                '商品番号': f'P{group}' if i == 0 or rng.random() < 0.2 else '',
+                '商品名': rng.choice(['', f'商品{group}-{i}']),
+                'サーチ表示': rng.choice(['', '表示', '非表示']),
+                '注文ボタン': rng.choice(['', '0', '1']),
+                '販売期間指定（開始日時）': rng.choice(['', '2025/01/01']),
+                '販売期間指定（終了日時）': rng.choice(['', '2025/12/31 23:59']),
+                '倉庫指定': rng.choice(['', '0', '1']),
+                'システム連携用SKU番号': rng.choice(['', f'P{group}-{i}']),
+                'SKU倉庫指定': rng.choice(['', '1']),
+            })
+    # 同じ商品管理番号の行が離れている場合も含める
+    if rng.random() < 0.5:
+        rng.shuffle(rows)
+    _assert_same_output(_frame(rows))
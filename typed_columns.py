@@ -0,0 +1,222 @@
+import re
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- 取り込み時の型変換 ---
+# 判定ルールはセルの値を判定のたびに正規表現で 'YYYYMMDD' 文字列に整形して比較していたため、
+# (返礼品コード × ポータル) の件数だけ正規表現の処理が発生していた。
+# 在庫数・フラグも判定のたびに float() や '0' との文字列比較を行っており、ポータルによって '0.0' の扱いが異なっていた。
+# ここでは判定に使う列をファイルの取り込み時に1回だけ型付きの列 (日付は整数、在庫数・フラグは数値) に変換する。
+# 返礼品コードも取り込み時に1回だけ正規化した検索キー列 (KEY_COL) を作成し、以降の結合は完全一致で行う。
+
+# 判定に使用する日付列 (シート名 -> 列名、チョイスは列番号)
+DATE_COLUMNS = {
+    'チョイス': [98, 99],
+    '楽天': ['販売期間指定（開始日時）', '販売期間指定（終了日時）'],
+    'さとふる在庫': ['受付開始日', '受付終了日'],
+    'JRE': ['掲載期間（開始）', '掲載期間（終了）', '販売期間（開始）', '販売期間（終了）'],
+    'ANA': ['掲載開始日', '掲載終了日', '販売開始日', '販売終了日'],
+    'ふるなび': ['公開開始日', '公開終了日'],
+    'JAL': ['表示開始日時', '表示終了日時', '寄附開始日時', '寄附終了日時'],
+    'まいふる': ['表示開始日時', '表示終了日時', '寄附開始日時', '寄附終了日時'],
+    'マイナビ': ['表示開始日時', '表示終了日時', '寄附開始日時', '寄附終了日時'],
+    'プレミアム': ['公開開始日時', '公開終了日時'],
+    '百選': ['公開開始日時', '公開終了日時', '申込開始日時', '申込終了日時'],
+    'ぐるなび': ['公開開始指定日時', '公開終了指定日時', '販売期間指定(開始日時)', '販売期間指定(終了日時)'],
+    'あとギフ': ['受付開始日時', '受付終了日時'],
+}
+
+# 判定に使用する在庫数の列 (「在庫0」という値は 0 とみなす)
+STOCK_COLUMNS = {
+    'チョイス在庫': [3], # 返礼品コード挿入前の列番号 (判定では 4 列目として参照される)
+    '楽天': ['在庫数'],
+    'さとふる在庫': ['全在庫数'],
+    'JRE': ['在庫数'],
+    'ANA': ['在庫数'],
+    'ふるなび': ['在庫数'],
+    'JAL': ['在庫数'],
+    'まいふる': ['在庫数'],
+    'マイナビ': ['在庫数'],
+    'プレミアム': ['在庫数'],
+    'Amazon': ['数量'],
+    '百選在庫': ['在庫数'],
+    'ぐるなび': ['在庫数'],
+    'あとギフ': ['在庫数'],
+}
+
+# 判定に使用する数値のフラグ列 ('off' などの文字で判定する列は対象外)
+FLAG_COLUMNS = {
+    'チョイス': [97],
+    '楽天': ['倉庫指定', 'SKU倉庫指定', 'サーチ表示', '注文ボタン'],
+    'さとふる': ['公開フラグ'],
+    'ANA': ['状態(掲載フラグ)'],
+    '百選': ['公開フラグ'],
+    'ぐるなび': ['公開設定', '在庫設定'],
+    'あとギフ': ['表示有無 (表示させる場合は半角数字の1、非表示にする場合は半角数字の0)'],
+}
+
+# 数値以外の値 (「無制限」など) を表す値。空欄 (<NA>) と区別し、0 以外の数値として扱う
+NON_NUMERIC = np.inf
+# 在庫数の列で 0 とみなす文字列
+STOCK_ZERO_WORDS = ('在庫0',)
+
+# 正規化済みの検索キー (返礼品コード) を保存する列
+KEY_COL = '_key'
+# 親コードのサフィックス (キーの正規化では全角のまま残す)
+PARENT_SUFFIXES = ('（楽天親）', '（チョイス親）')
+
+# Excel のシリアル値の基準日と、シリアル値とみなす範囲 (1954年〜2173年)
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_EXCEL_SERIAL_MIN = 20000
+_EXCEL_SERIAL_MAX = 100000
+
+# 区切り文字つきの日付 ('2025/1/5', '2025-01-05 10:00', '2025年1月5日')
+_YMD_PATTERN = re.compile(r'(\d{4})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})')
+_SERIAL_PATTERN = re.compile(r'\d+(\.\d*)?')
+_NON_DIGIT_PATTERN = re.compile(r'[^0-9]')
+
+
+def _ymd(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def _from_number(number):
+    """数値を YYYYMMDD (8桁) またはExcel のシリアル値として解釈する"""
+    if 10000101 <= number <= 99991231:
+        return int(number)
+    if _EXCEL_SERIAL_MIN <= number < _EXCEL_SERIAL_MAX:
+        return _ymd(_EXCEL_EPOCH + timedelta(days=int(number)))
+    return 0
+
+
+def to_date_int(value):
+    """
+    セルの値を YYYYMMDD 形式の整数に変換する。空欄は None、日付として解釈できない値は 0。
+    (0 は「値は入っているが日付ではない」ことを表し、判定では空欄と同じく日付なしとして扱う。
+     楽天の「自身の値が空欄なら管理行の値を使う」判定で、従来どおり自身の値を優先するため区別する)
+    - 区切り文字つきの日付は月日を0埋めする
+    - 区切り文字なしは数字だけを取り出した先頭8桁 (従来の format_date と同じ)
+    - Excel の日時・シリアル値は日付に変換する
+    """
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (datetime, date)):
+        return None if pd.isna(value) else _ymd(value)
+    if isinstance(value, (int, np.integer)):
+        return _from_number(int(value))
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else _from_number(float(value))
+
+    s = str(value).strip()
+    if not s:
+        return None
+
+    m = _YMD_PATTERN.match(s)
+    if m:
+        return int(m.group(1)) * 10000 + int(m.group(2)) * 100 + int(m.group(3))
+
+    if _SERIAL_PATTERN.fullmatch(s) and len(s.split('.')[0]) < 8:
+        return _from_number(float(s))
+
+    digits = _NON_DIGIT_PATTERN.sub('', s)[:8]
+    return int(digits) if len(digits) == 8 else 0
+
+
+def parse_date_column(values):
+    """
+    日付の列を YYYYMMDD 形式の整数列 (Int32, 空欄は <NA>、日付でない値は 0) に変換する。
+    同じ値は1回だけ変換する (日付列は重複が多いため)。
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(series)
+    # 末尾の None は欠損値 (factorize のコード -1) 用
+    parsed = pd.array([to_date_int(v) for v in uniques] + [None], dtype='Int32')
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
+
+
+def to_number(value, zero_words=()):
+    """
+    セルの値を数値 (float) に変換する。空欄は None、数値以外の値は NON_NUMERIC。
+    ('0' / '0.0' / ' 0 ' はいずれも 0 になる。zero_words に含まれる文字列は 0 とする)
+    """
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        return None if np.isnan(value) else float(value)
+
+    s = str(value).strip()
+    if not s:
+        return None
+    if s in zero_words:
+        return 0.0
+    try:
+        number = float(s)
+    except ValueError:
+        return NON_NUMERIC
+    return NON_NUMERIC if np.isnan(number) else number
+
+
+def to_stock_number(value):
+    """在庫数の値を数値に変換する (「在庫0」は 0)"""
+    return to_number(value, STOCK_ZERO_WORDS)
+
+
+def parse_number_column(values, zero_words=()):
+    """数値の列を Float64 の列 (空欄は <NA>、数値以外の値は NON_NUMERIC) に変換する"""
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(series)
+    parsed = pd.array([to_number(v, zero_words) for v in uniques] + [None], dtype='Float64')
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
+
+
+def number_array(values, zero_words=()):
+    """
+    列または配列を float 配列 (空欄は NaN) にする。
+    型変換済みの列はそのまま、未変換の値 (文字列) はここで変換する。
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if not pd.api.types.is_float_dtype(series.dtype):
+        series = parse_number_column(series, zero_words)
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def normalize_column_types(df, sheet_name):
+    """ポータルの判定に使う列を型付きの列に変換する (取り込み時に1回だけ実行する)"""
+    for col in DATE_COLUMNS.get(sheet_name, ()):
+        if col in df.columns:
+            df[col] = parse_date_column(df[col])
+    for col in STOCK_COLUMNS.get(sheet_name, ()):
+        if col in df.columns:
+            df[col] = parse_number_column(df[col], STOCK_ZERO_WORDS)
+    for col in FLAG_COLUMNS.get(sheet_name, ()):
+        if col in df.columns:
+            df[col] = parse_number_column(df[col])
+    return df
+
+
+def normalize_keys(values):
+    """
+    返礼品コードの列を検索キーに正規化する (BOM除去、NFKC で全角英数字を半角に統一、'.0' 除去、空白除去、大文字化)。
+    親コードのサフィックス（楽天親）（チョイス親）は全角のまま残す。欠損値は空文字とする。
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    keys = series.fillna('').astype(str).str.replace('\ufeff', '', regex=False)
+
+    suffixes = pd.Series('', index=keys.index, dtype=object)
+    for suffix in PARENT_SUFFIXES:
+        has_suffix = keys.str.endswith(suffix)
+        if has_suffix.any():
+            keys = keys.mask(has_suffix, keys.str[:-len(suffix)])
+            suffixes = suffixes.mask(has_suffix, suffix)
+
+    keys = keys.str.normalize('NFKC').str.replace(r'\.0$', '', regex=True).str.strip().str.upper()
+    return keys + suffixes
+
+
+def normalize_key(value):
+    """1件の返礼品コードを検索キーに正規化する (normalize_keys と同じ規則)"""
+    return normalize_keys([value]).iloc[0]